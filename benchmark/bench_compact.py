@@ -0,0 +1,66 @@
+"""
+轻量行对象与完整模型实例对比：PYTHONPATH=. python benchmark/bench_compact.py [rows]
+"""
+import sys
+import time
+import tracemalloc
+
+import pendulum
+import peewee
+import peeweext
+from peeweext.cache import CachedCursor
+from peeweext.models import Model
+
+database = peewee.SqliteDatabase(':memory:')
+
+
+class Note(Model):
+    message = peeweext.TextField()
+    count = peeweext.IntegerField()
+    published_at = peeweext.DatetimeTZField()
+    content = peeweext.JSONTextField()
+
+    class Meta:
+        database = database
+
+
+def rate(query, rows):
+    best = 0
+    for _ in range(3):
+        start = time.perf_counter()
+        n = sum(1 for _ in query.clone())
+        best = max(best, n / (time.perf_counter() - start))
+    assert n == rows
+    return best
+
+
+def memory(query, rows):
+    tracemalloc.start()
+    cursor = database.execute(query)
+    raw = cursor.fetchall()
+    base = tracemalloc.get_traced_memory()[0]
+    # 以已取回的原始行构造对象，只统计对象本身占用
+    wrapper = query._get_cursor_wrapper(CachedCursor(tuple((c[0],) for c in cursor.description), raw))
+    objects = list(wrapper.iterator())
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    assert len(objects) == rows
+    return used / rows
+
+
+def main(rows=100000):
+    Note.create_table()
+    now = peeweext.DatetimeTZField().db_value(pendulum.now())
+    with database.atomic():
+        Note.insert_many(
+            [(str(i), i, now, '{"a": %d}' % i) for i in range(rows)],
+            fields=[Note.message, Note.count, Note.published_at, Note.content]
+        ).execute()
+
+    print('%-8s %12s %14s' % ('type', 'rows/sec', 'bytes/row'))
+    for name, query in (('model', Note.select()), ('compact', Note.select().compact())):
+        print('%-8s %12.0f %14.0f' % (name, rate(query, rows), memory(query, rows)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
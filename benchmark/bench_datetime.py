@@ -0,0 +1,59 @@
+"""
+DatetimeTZField.python_value 解码性能：PYTHONPATH=. python benchmark/bench_datetime.py [number]
+"""
+import sys
+import datetime
+import timeit
+
+import pendulum
+import peeweext
+from peeweext.fields import parse_datetime, parse_native_datetime
+
+field = peeweext.DatetimeTZField()
+native_field = peeweext.DatetimeTZField(native=True)
+
+
+def legacy_python_value(value):
+    # 优化前的实现
+    if isinstance(value, str):
+        return pendulum.parse(value)
+    if isinstance(value, datetime.datetime):
+        return pendulum.instance(value)
+    return value
+
+
+VALUES = [
+    ('sqlite', '2019-03-24 09:49:14.353345+00:00'),
+    ('sqlite no usec', '2019-03-24 09:49:14+00:00'),
+    ('mysql naive', datetime.datetime(2019, 3, 24, 9, 49, 14, 353345)),
+    ('postgres aware', datetime.datetime(2019, 3, 24, 9, 49, 14, 353345, tzinfo=datetime.timezone.utc)),
+]
+
+
+def distinct_strings(number):
+    start = datetime.datetime(2019, 3, 24, tzinfo=datetime.timezone.utc)
+    return [str(start + datetime.timedelta(seconds=i)) for i in range(number)]
+
+
+def main(number=100000):
+    print('%-24s %12s %12s %12s' % ('format', 'before', 'after', 'native'))
+    for name, value in VALUES:
+        rates = [
+            number / timeit.timeit(lambda: fn(value), number=number)
+            for fn in (legacy_python_value, field.python_value, native_field.python_value)
+        ]
+        print('%-24s %12.0f %12.0f %12.0f' % ((name,) + tuple(rates)))
+
+    # 值各不相同时缓存不命中
+    values = distinct_strings(number)
+    rates = []
+    for fn in (legacy_python_value, field.python_value, native_field.python_value):
+        parse_datetime.cache_clear()
+        parse_native_datetime.cache_clear()
+        elapsed = timeit.timeit(lambda: [fn(v) for v in values], number=1)
+        rates.append(number / elapsed)
+    print('%-24s %12.0f %12.0f %12.0f' % (('sqlite uncached',) + tuple(rates)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,54 @@
+"""
+查询结果实例化性能：PYTHONPATH=. python benchmark/bench_hydration.py [rows]
+"""
+import sys
+import time
+
+import peewee
+import peeweext
+from peeweext.models import Model
+from peeweext.signal import pre_init
+
+database = peewee.SqliteDatabase(':memory:')
+
+
+class Note(Model):
+    message = peeweext.TextField()
+    count = peeweext.IntegerField()
+
+    class Meta:
+        database = database
+        table_name = 'note'
+
+
+class LegacyNote(Note):
+    # 优化前的实例化方式：每个实例都发送 pre_init 并初始化校验状态
+    def __init__(self, *args, **kwargs):
+        pre_init.send(type(self), instance=self)
+        self._validate_errors = None
+        peewee.Model.__init__(self, *args, **kwargs)
+
+    class Meta:
+        table_name = 'note'
+
+
+def bench(model, rows):
+    start = time.perf_counter()
+    n = sum(1 for _ in model.select())
+    elapsed = time.perf_counter() - start
+    assert n == rows
+    return rows / elapsed
+
+
+def main(rows=100000):
+    Note.create_table()
+    with database.atomic():
+        Note.insert_many([(str(i), i) for i in range(rows)], fields=[Note.message, Note.count]).execute()
+
+    for name, model in (('before', LegacyNote), ('after', Note)):
+        rate = max(bench(model, rows) for _ in range(3))
+        print('%-8s %12.0f rows/sec' % (name, rate))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
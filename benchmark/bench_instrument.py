@@ -0,0 +1,45 @@
+"""
+SQL 执行统计的额外开销：PYTHONPATH=. python benchmark/bench_instrument.py [number]
+"""
+import sys
+import timeit
+
+import peeweext
+from peeweext import database, metrics
+
+
+def make_db(mixins=()):
+    db = database.connect('sqlite:///:memory:', mixins=mixins)
+
+    class Note(peeweext.Model):
+        message = peeweext.TextField()
+
+        class Meta:
+            database = db
+
+    Note.create_table()
+    Note.create(message='m')
+    return db, Note
+
+
+def main(number=20000):
+    plain_db, plain = make_db()
+    instrumented_db, instrumented = make_db((metrics.InstrumentMixin,))
+    instrumented_db.query_metrics = metrics.QueryMetrics()
+
+    print('%-16s %12s %12s %12s' % ('query', 'plain us', 'metrics us', 'overhead us'))
+    for name, fn in (
+        ('get_by_id', lambda model: model.get_by_id(1)),
+        ('execute_sql', lambda model: model._meta.database.execute_sql('SELECT 1').fetchall()),
+    ):
+        # 交替运行取最小值，减少噪声
+        timings = ([], [])
+        for _ in range(5):
+            for timing, model in zip(timings, (plain, instrumented)):
+                timing.append(timeit.timeit(lambda: fn(model), number=number))
+        costs = [min(timing) / number * 1e6 for timing in timings]
+        print('%-16s %12.2f %12.2f %12.2f' % (name, costs[0], costs[1], costs[1] - costs[0]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,62 @@
+"""
+JSON 字段读取与保存性能：PYTHONPATH=. python benchmark/bench_json.py [rows]
+"""
+import sys
+import time
+
+import peewee
+import peeweext
+from peeweext.models import Model
+
+database = peewee.SqliteDatabase(':memory:')
+CONTENT = '{"tags": [%s], "attrs": {%s}}' % (
+    ', '.join('"t%d"' % i for i in range(20)), ', '.join('"k%d": %d' % (i, i) for i in range(20)))
+
+
+class Note(Model):
+    message = peeweext.TextField()
+    content = peeweext.JSONTextField()
+
+    class Meta:
+        database = database
+        table_name = 'note'
+
+
+class TrackedNote(Note):
+    # 保留加载时文本，保存时重新编码比较
+    content = peeweext.JSONTextField(track_mutations=True)
+
+    class Meta:
+        table_name = 'note'
+
+
+class LazyNote(Note):
+    content = peeweext.JSONTextField(lazy=True)
+
+    class Meta:
+        table_name = 'note'
+
+
+def bench(model, rows):
+    # 读取全部行并修改非 JSON 字段后保存
+    start = time.perf_counter()
+    with database.atomic():
+        for note in model.select():
+            note.message = note.message + '.'
+            note.save(skip_validation=True)
+    elapsed = time.perf_counter() - start
+    return rows / elapsed
+
+
+def main(rows=20000):
+    Note.create_table()
+    with database.atomic():
+        Note.insert_many([(str(i), CONTENT) for i in range(rows)], fields=[Note.message, Note.content]).execute()
+
+    for name, model in (('default', Note), ('tracked', TrackedNote), ('lazy', LazyNote)):
+        rate = max(bench(model, rows) for _ in range(3))
+        print('%-8s %12.0f rows/sec' % (name, rate))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,269 @@
+"""
+数据库并发准入控制
+"""
+import math
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+
+from peeweext.exceptions import AdmissionRejected
+
+__all__ = [
+    "AdmissionController",
+    "AdmissionMixin",
+    "start_request",
+    "end_request",
+    "release",
+    "exposition",
+]
+
+# 估计排队时间所用的平均占用时间(秒)的平滑系数
+EWMA_ALPHA = 0.2
+
+
+class _Waiter:
+    __slots__ = ('granted', 'wake')
+
+    def __init__(self, wake):
+        self.granted = False
+        self.wake = wake
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    # 同时占用数据库的请求不超过 max_in_flight，其余按到达顺序排队；
+    # 队列已满、预计等待超过 RPC 剩余时间或等待超时时立即拒绝，释放时名额直接交给队首
+    def __init__(self, alias='default', max_in_flight=20, max_queue=0, max_wait=None):
+        self.alias = alias
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'deadline': 0, 'timeout': 0}
+        self.wait_time = 0.0
+        self.service_time = 0.0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _timeout(self, timeout):
+        if self.max_wait is None:
+            return timeout
+        return self.max_wait if timeout is None else min(timeout, self.max_wait)
+
+    def expected_wait(self):
+        return math.ceil((len(self._waiters) + 1) / self.max_in_flight) * self.service_time
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        raise AdmissionRejected('Database "%s" is overloaded (%s).' % (self.alias, reason.replace('_', ' ')))
+
+    def _enqueue(self, timeout, wake):
+        # 需持有锁；可以立即准入时返回 None
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            self._reject('queue_full')
+        if timeout is not None and self.expected_wait() > timeout:
+            self._reject('deadline')
+        waiter = _Waiter(wake)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _give_up(self, waiter, start):
+        # 等待结束但未被唤醒(超时或取消)；需持有锁，返回是否已在此之前获得名额
+        self.wait_time += time.monotonic() - start
+        if waiter.granted:
+            return True
+        self._waiters.remove(waiter)
+        return False
+
+    def acquire(self, timeout=None):
+        timeout = self._timeout(timeout)
+        event = threading.Event()
+        with self._lock:
+            waiter = self._enqueue(timeout, event.set)
+        if waiter is None:
+            return
+
+        start = time.monotonic()
+        if event.wait(timeout):
+            with self._lock:
+                self.wait_time += time.monotonic() - start
+            return
+        with self._lock:
+            if self._give_up(waiter, start):
+                return
+            self._reject('timeout')
+
+    async def aio_acquire(self, timeout=None):
+        timeout = self._timeout(timeout)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            waiter = self._enqueue(timeout, lambda: loop.call_soon_threadsafe(_resolve, future))
+        if waiter is None:
+            return
+
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if self._give_up(waiter, start):
+                    return
+                self._reject('timeout')
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = self._give_up(waiter, start)
+            if granted:
+                self.release()
+            raise
+        with self._lock:
+            self.wait_time += time.monotonic() - start
+
+    def release(self, elapsed=None):
+        with self._lock:
+            if elapsed is not None:
+                self.service_time += EWMA_ALPHA * (elapsed - self.service_time)
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                self.admitted += 1
+                waiter.wake()
+                return
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'queue_depth': len(self._waiters),
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'wait_time': self.wait_time,
+                'service_time': self.service_time,
+            }
+
+
+class _RequestAdmission:
+    # 请求持有的名额 {AdmissionController: 获取时间}，第一次使用数据库时才获取，同一请求只占一个名额
+    def __init__(self, timeout=None):
+        self.expires = time.monotonic() + timeout if timeout is not None else None
+        self.held = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def admit(self, controller):
+        with self._lock:
+            if controller not in self.held:
+                controller.acquire(self.remaining())
+                self.held[controller] = time.monotonic()
+
+    async def aio_admit(self, controller):
+        if controller in self.held:
+            return
+        # 同一请求中并发的查询共用一次获取
+        pending = self._pending.get(controller)
+        if pending is None:
+            pending = self._pending[controller] = asyncio.ensure_future(self._aio_acquire(controller))
+        await asyncio.shield(pending)
+
+    async def _aio_acquire(self, controller):
+        await controller.aio_acquire(self.remaining())
+        with self._lock:
+            self.held[controller] = time.monotonic()
+
+    def release(self, controller=None):
+        with self._lock:
+            if controller is None:
+                held, self.held = self.held, {}
+            else:
+                held = {controller: self.held.pop(controller)} if controller in self.held else {}
+            for controller in held:
+                self._pending.pop(controller, None)
+        now = time.monotonic()
+        for controller, start in reversed(list(held.items())):
+            controller.release(now - start)
+
+
+_request = contextvars.ContextVar('peeweext_admission', default=None)
+
+
+def start_request(timeout=None):
+    # timeout 为 RPC 的剩余时间，排队等待不超过它
+    return _request.set(_RequestAdmission(timeout))
+
+
+def end_request(token):
+    _request.get().release()
+    _request.reset(token)
+
+
+def release(controller):
+    request = _request.get()
+    if request is not None:
+        request.release(controller)
+
+
+class AdmissionMixin:
+    # 请求中第一次获取连接(包括 autoconnect)时占用名额，不使用数据库的请求不占用
+    admission = None
+
+    def _admit(self):
+        request = _request.get()
+        if request is not None and self.admission is not None and self.admission not in request.held:
+            request.admit(self.admission)
+
+    def connect(self, reuse_if_open=False):
+        self._admit()
+        return super().connect(reuse_if_open)
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        # 连接已在本线程打开(如其他请求遗留)时也需要占用名额
+        self._admit()
+        return super().execute_sql(sql, params, *args, **kwargs)
+
+    async def aio_admit(self):
+        # 在事件循环中排队，避免阻塞线程池
+        request = _request.get()
+        if request is not None and self.admission is not None:
+            await request.aio_admit(self.admission)
+
+
+def exposition(controllers, prefix='peeweext'):
+    # Prometheus 文本格式
+    lines = []
+    series = (
+        ('admission_in_flight', 'gauge', 'Requests holding a database admission slot.', 'in_flight'),
+        ('admission_queue_depth', 'gauge', 'Requests waiting for a database admission slot.', 'queue_depth'),
+        ('admission_admitted_total', 'counter', 'Requests admitted to the database.', 'admitted'),
+        ('admission_wait_seconds_total', 'counter', 'Time spent waiting for admission.', 'wait_time'),
+    )
+    stats = [(controller.alias, controller.stats()) for controller in controllers]
+    for name, kind, help_text, key in series:
+        lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+        lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+        for alias, values in stats:
+            lines.append('%s_%s{alias="%s"} %r' % (prefix, name, alias, values[key]))
+    lines.append('# HELP %s_admission_rejected_total Requests rejected by admission control.' % prefix)
+    lines.append('# TYPE %s_admission_rejected_total counter' % prefix)
+    for alias, values in stats:
+        for reason, count in sorted(values['rejected'].items()):
+            lines.append('%s_admission_rejected_total{alias="%s",reason="%s"} %d' % (prefix, alias, reason, count))
+    return '\n'.join(lines) + '\n'
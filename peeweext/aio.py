@@ -0,0 +1,83 @@
+"""
+异步支持，查询在有界线程池中执行
+"""
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import peewee
+
+__all__ = [
+    "get_executor",
+    "setup_executor",
+    "run_sync",
+    "execute",
+    "get",
+    "count",
+]
+
+DEFAULT_MAX_WORKERS = 20
+_executor = None
+
+
+def setup_executor(max_workers=None):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS, thread_name_prefix='peeweext')
+    return _executor
+
+
+def get_executor(max_workers=None):
+    # 线程池只在第一次调用时创建，之后指定不同的 max_workers 需要先调用 setup_executor 重建
+    if _executor is None:
+        return setup_executor(max_workers)
+    if max_workers is not None and max_workers != _executor._max_workers:
+        raise ValueError(
+            'Executor already created with max_workers=%d, call setup_executor() to change it.'
+            % _executor._max_workers
+        )
+    return _executor
+
+
+def _run_in_connection(database, fn, *args, **kwargs):
+    # 连接状态是线程局部的，每次调用在工作线程中获取连接并在结束后归还
+    opened = database.connect(reuse_if_open=True)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if opened:
+            database.close()
+        router = getattr(database, 'replica_router', None)
+        if router is not None:
+            router.close()
+
+
+async def run_sync(database, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # 开启准入控制时先在事件循环中获取名额
+    admit = getattr(database, 'aio_admit', None)
+    if admit is not None:
+        await admit()
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, _run_in_connection, database, fn, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+def _execute(query):
+    if isinstance(query, peewee.SelectBase):
+        return list(query)
+    return query.execute()
+
+
+async def execute(query):
+    return await run_sync(query._database, _execute, query)
+
+
+async def get(query):
+    return await run_sync(query._database, query.get)
+
+
+async def count(query):
+    return await run_sync(query._database, query.count)
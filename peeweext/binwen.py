@@ -1,24 +1,108 @@
+import asyncio
 import grpc
-from playhouse import db_url
 from peewee import DoesNotExist, DataError
 from binwen.pb2 import default_pb2
 from binwen.utils.cache import cached_property
 from binwen.middleware import MiddlewareMixin
 
 
-from peeweext.exceptions import ValidationError
+from peeweext import admission, aio, database, deadline, pool
+from peeweext import cache, loader, metrics
+from peeweext.exceptions import ValidationError, DeadlineExceeded, AdmissionRejected
+from peeweext.fields import get_json_codec
 from peeweext.models import TimeStampedModel, Model
+from peeweext.replica import ReplicaRouter, ReplicaRoutingMixin, start_pins, end_pins
 
 
 class PeeweeExt:
     def __init__(self, alias='default'):
         self.alias = alias
         self.database = None
+        self.lazy_connect = True
+        self.json_codec = None
+        self.identity_map = False
+        self.instrument = False
+        self.admission = None
 
     def init_app(self, app):
         db_config = app.config["DATABASES"][self.alias]
         conn_params = db_config.get('CONN_OPTIONS', {})
-        self.database = db_url.connect(db_config['DB_URL'], **conn_params)
+        # 延迟连接依赖 peewee 的 autoconnect，在第一次查询时才获取连接
+        self.lazy_connect = db_config.get('LAZY_CONNECT', conn_params.get('autoconnect', True))
+        self.json_codec = get_json_codec(db_config.get('JSON_CODEC'))
+        pool_options = db_config.get('POOL_OPTIONS')
+        if pool_options is not None:
+            pool_options = {
+                'max_connections': pool_options.get('MAX_CONNECTIONS', 20),
+                'stale_timeout': pool_options.get('STALE_TIMEOUT'),
+                'timeout': pool_options.get('WAIT_TIMEOUT'),
+                'pre_ping': pool_options.get('PRE_PING', False),
+            }
+
+        # 每条 SQL 的耗时、行数、语句指纹按 alias/模型/RPC 方法统计，见 peeweext.metrics
+        self.instrument = db_config.get('INSTRUMENT', False)
+        # SLOW_QUERY: 超过 THRESHOLD 秒的语句记录日志并在后台 EXPLAIN
+        slow_query = db_config.get('SLOW_QUERY')
+        # 请求级查询预算需要统计所有数据库的查询
+        track_requests = app.config.get('PEEWEE_QUERY_BUDGET') is not None
+        instrumented = self.instrument or slow_query is not None or track_requests
+        base_mixins = (metrics.InstrumentMixin,) if instrumented else ()
+        # PROPAGATE_DEADLINE: RPC 的剩余时间作为语句超时，RPC 取消时中断正在执行的语句
+        if db_config.get('PROPAGATE_DEADLINE', False):
+            base_mixins += (deadline.DeadlineMixin,)
+        # ADMISSION: 限制同时使用该数据库的请求数，超出时排队，排不上或等不及时快速失败；
+        # 请求第一次获取连接时才占用名额，从库与主库共用
+        admission_options = db_config.get('ADMISSION')
+        if admission_options is not None:
+            base_mixins += (admission.AdmissionMixin,)
+        replicas = [
+            database.connect(url, mixins=base_mixins, pool_options=pool_options, **conn_params)
+            for url in db_config.get('REPLICAS', [])
+        ]
+        cache_options = db_config.get('QUERY_CACHE')
+        self.identity_map = db_config.get('IDENTITY_MAP', False)
+        mixins = base_mixins
+        if cache_options is not None or self.identity_map:
+            mixins += (cache.QueryCacheMixin,)
+        if replicas:
+            mixins += (ReplicaRoutingMixin,)
+        self.database = database.connect(db_config['DB_URL'], mixins=mixins, pool_options=pool_options, **conn_params)
+        if cache_options is not None:
+            # BACKEND 可以是任意实现了 CacheBackend 接口的实例，默认使用进程内 LRU
+            backend = cache_options.get('BACKEND') or cache.LRUCache(
+                maxsize=cache_options.get('MAXSIZE', 1024), ttl=cache_options.get('TTL', 60)
+            )
+            self.database.query_cache = cache.QueryCache(
+                backend, key_prefix=cache_options.get('KEY_PREFIX', 'peeweext:%s' % self.alias)
+            )
+        self.database.use_identity_map = self.identity_map
+        if slow_query is not None:
+            slow_query = metrics.SlowQueryLog(
+                threshold=slow_query.get('THRESHOLD', 1.0),
+                explain=slow_query.get('EXPLAIN', True),
+                explain_interval=slow_query.get('EXPLAIN_INTERVAL', 60),
+                redact=slow_query.get('REDACT', False),
+            )
+        if instrumented:
+            for db in [self.database] + replicas:
+                db.metrics_alias = self.alias
+                db.query_metrics = metrics.registry if self.instrument else None
+                db.slow_query_log = slow_query
+        if replicas:
+            self.database.replica_router = ReplicaRouter(
+                replicas,
+                strategy=db_config.get('REPLICA_STRATEGY', 'round_robin'),
+                read_your_writes=db_config.get('READ_YOUR_WRITES_WINDOW')
+            )
+        if admission_options is not None:
+            self.admission = admission.AdmissionController(
+                self.alias,
+                max_in_flight=admission_options.get('MAX_IN_FLIGHT', 20),
+                max_queue=admission_options.get('MAX_QUEUE', 0),
+                max_wait=admission_options.get('MAX_WAIT'),
+            )
+            for db in [self.database] + replicas:
+                db.admission = self.admission
         self.try_setup_celery()
 
     @cached_property
@@ -26,6 +110,7 @@ class PeeweeExt:
         class BaseModel(Model):
             class Meta:
                 database = self.database
+                json_codec = self.json_codec
 
         return BaseModel
 
@@ -34,6 +119,7 @@ class PeeweeExt:
         class BaseTimeStampedModel(TimeStampedModel):
             class Meta:
                 database = self.database
+                json_codec = self.json_codec
 
         return BaseTimeStampedModel
 
@@ -44,6 +130,30 @@ class PeeweeExt:
     def close_db(self):
         if not self.database.is_closed():
             self.database.close()
+        router = getattr(self.database, 'replica_router', None)
+        if router is not None:
+            router.release()
+        if self.admission is not None:
+            # 连接归还后再释放名额
+            admission.release(self.admission)
+
+    @property
+    def pool_stats(self):
+        if isinstance(self.database, pool.PoolStatsMixin):
+            return self.database.pool_stats()
+        return None
+
+    @property
+    def admission_stats(self):
+        if self.admission is not None:
+            return self.admission.stats()
+        return None
+
+    @property
+    def query_metrics(self):
+        if self.instrument:
+            return metrics.snapshot(self.alias)
+        return None
 
     def try_setup_celery(self):
         try:
@@ -54,30 +164,158 @@ class PeeweeExt:
             pass
 
 
+def get_query_budget(options, *methods):
+    # METHODS 中按 RPC 方法(Servicer.Method 或方法名)覆盖全局设置
+    if options is None:
+        return None
+    overrides = options.get('METHODS', {})
+    for method in methods:
+        if method in overrides:
+            options = dict(options, **overrides[method])
+            break
+    return metrics.QueryBudget(
+        max_queries=options.get('MAX_QUERIES'),
+        max_time=options.get('MAX_TIME'),
+        max_repeats=options.get('MAX_REPEATS'),
+        action=options.get('ACTION', 'log'),
+    )
+
+
 class PeeweeExtMiddleware(MiddlewareMixin):
     def __init__(self, app, handler, origin_handler):
         super().__init__(app, handler, origin_handler)
         self.peewee_exts = [ext for ext in app.extensions.values() if isinstance(ext, PeeweeExt)]
+        self.identity_map = any(pwx.identity_map for pwx in self.peewee_exts)
+        self.replica_routing = any(
+            getattr(pwx.database, 'replica_router', None) is not None for pwx in self.peewee_exts
+        )
+        self.rpc_method = getattr(origin_handler, '__qualname__', None) or getattr(origin_handler, '__name__', None)
+        self.query_budget = get_query_budget(
+            app.config.get('PEEWEE_QUERY_BUDGET'), self.rpc_method, getattr(origin_handler, '__name__', None)
+        )
+        # 每个请求的查询次数、数据库耗时见 metrics.get_request_stats()
+        self.track_queries = any(isinstance(pwx.database, metrics.InstrumentMixin) for pwx in self.peewee_exts)
+        self.propagate_deadline = any(isinstance(pwx.database, deadline.DeadlineMixin) for pwx in self.peewee_exts)
+        self.admission = any(pwx.admission is not None for pwx in self.peewee_exts)
+
+    def check_query_budget(self):
+        stats = metrics.get_request_stats()
+        if self.query_budget is not None and stats is not None:
+            self.query_budget.check(stats)
+
+    @staticmethod
+    def time_remaining(context):
+        return context.time_remaining() if context is not None else None
+
+    def start_admission(self, context):
+        # 名额在请求第一次使用数据库时获取，见 admission.AdmissionMixin
+        if not self.admission:
+            return None
+        return admission.start_request(self.time_remaining(context))
+
+    def start_deadline(self, context):
+        if not self.propagate_deadline or context is None:
+            return None
+        return deadline.start_deadline(self.time_remaining(context), context)
 
     def connect_db(self):
         for pwx in self.peewee_exts:
-            pwx.connect_db()
+            if not pwx.lazy_connect:
+                pwx.connect_db()
 
     def close_db(self):
         for pwx in self.peewee_exts:
             pwx.close_db()
 
+    # 同步中间件在请求开始、结束时打开和关闭连接；异步中间件的连接由工作线程各自获取和归还
+    manage_connections = True
+
+    def _begin(self, context):
+        # 请求级的上下文，_end 中按相反的顺序恢复
+        state = {}
+        # 请求级身份映射，请求结束时丢弃；随上下文复制到工作线程
+        state['identity_map'] = cache.start_identity_map() if self.identity_map else None
+        # aio_get_by_id 的批量加载只在本请求内合并
+        state['loaders'] = loader.start_batch_loaders()
+        # 写入后读主库的标记在请求结束时丢弃
+        state['pins'] = start_pins() if self.replica_routing else None
+        state['method'] = metrics.set_rpc_method(self.rpc_method)
+        state['stats'] = metrics.start_request(self.rpc_method) if self.track_queries else None
+        state['deadline'] = self.start_deadline(context)
+        state['admission'] = self.start_admission(context)
+        return state
+
+    @staticmethod
+    def _handle_error(context, exc):
+        # 已知的异常转换为 gRPC 状态码，返回 False 时由调用方继续抛出
+        if isinstance(exc, AdmissionRejected):
+            code, details = grpc.StatusCode.RESOURCE_EXHAUSTED, str(exc)
+        elif isinstance(exc, DeadlineExceeded):
+            code, details = grpc.StatusCode.DEADLINE_EXCEEDED, str(exc)
+        elif isinstance(exc, DoesNotExist):
+            code, details = grpc.StatusCode.NOT_FOUND, 'Record Not Found'
+        elif isinstance(exc, (ValidationError, DataError)):
+            code, details = grpc.StatusCode.INVALID_ARGUMENT, str(exc)
+        else:
+            return False
+        context.set_code(code)
+        context.set_details(details)
+        return True
+
+    def _end(self, state):
+        if state['deadline'] is not None:
+            deadline.end_deadline(state['deadline'])
+        if state['stats'] is not None:
+            metrics.end_request(state['stats'])
+        metrics.reset_rpc_method(state['method'])
+        if state['pins'] is not None:
+            end_pins(state['pins'])
+        loader.end_batch_loaders(state['loaders'])
+        if state['identity_map'] is not None:
+            cache.end_identity_map(state['identity_map'])
+        if self.manage_connections:
+            self.close_db()
+        # 连接归还后再释放名额
+        if state['admission'] is not None:
+            admission.end_request(state['admission'])
+
     def __call__(self, servicer, request, context):
+        state = self._begin(context)
         try:
             self.connect_db()
-            return self.handler(servicer, request, context)
-        except DoesNotExist:
-            context.set_code(grpc.StatusCode.NOT_FOUND)
-            context.set_details('Record Not Found')
-        except (ValidationError, DataError) as e:
-            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
-            context.set_details(str(e))
+            response = self.handler(servicer, request, context)
+            self.check_query_budget()
+            return response
+        except Exception as e:
+            if not self._handle_error(context, e):
+                raise
         finally:
-            self.close_db()
+            self._end(state)
         return default_pb2.Empty()
 
+
+class AsyncPeeweeExtMiddleware(PeeweeExtMiddleware):
+    manage_connections = False
+
+    def __init__(self, app, handler, origin_handler):
+        super().__init__(app, handler, origin_handler)
+        aio.get_executor(app.config.get('PEEWEE_ASYNC_MAX_WORKERS'))
+
+    async def __call__(self, servicer, request, context):
+        # 查询通过 aio_* 方法在线程池中执行，这里不在事件循环线程中打开或关闭连接
+        state = self._begin(context)
+        try:
+            response = await self.handler(servicer, request, context)
+            self.check_query_budget()
+            return response
+        except asyncio.CancelledError:
+            # 任务被取消时工作线程中的语句仍在执行，中断它们
+            if state['deadline'] is not None:
+                deadline.get_deadline().cancel()
+            raise
+        except Exception as e:
+            if not self._handle_error(context, e):
+                raise
+        finally:
+            self._end(state)
+        return default_pb2.Empty()
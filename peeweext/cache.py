@@ -0,0 +1,330 @@
+"""
+查询缓存
+"""
+import time
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+
+import peewee
+from peewee import OP, Expression, Node
+from peeweext.signal import post_save, post_delete, post_bulk_save, post_bulk_delete
+
+__all__ = [
+    "CacheBackend",
+    "LRUCache",
+    "QueryCache",
+    "IdentityMap",
+    "QueryCacheMixin",
+    "start_identity_map",
+    "end_identity_map",
+    "get_identity_map",
+]
+
+
+class CacheBackend:
+    # 外部存储(如 redis)实现这三个方法即可，值需要可序列化，key 为字符串
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CachedCursor:
+    # 以缓存的行数据模拟 DB-API cursor，每次命中都重新构造模型实例，避免共享可变对象
+    lastrowid = None
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.rowcount = len(rows)
+        self._rows = iter(rows)
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size=1):
+        return [row for _, row in zip(range(size), self._rows)]
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class QueryCache:
+    # 查询结果(.cached()、Model.get)的 key 包含涉及表的版本号，表有任何写入时失效；
+    # 主键查询(Model.get_by_id)按主键删除，只有无法确定主键的写入才使整表的主键缓存失效
+    def __init__(self, backend=None, key_prefix='peeweext'):
+        self.backend = backend if backend is not None else LRUCache()
+        self.key_prefix = key_prefix
+
+    def _version(self, kind, model):
+        # 版本号丢失(如被淘汰)时生成新版本，旧版本下的缓存不会再被读到
+        version = self.backend.get('%s:v:%s:%s' % (self.key_prefix, kind, model._meta.table_name))
+        if version is None:
+            version = self._bump(kind, model)
+        return version
+
+    def _bump(self, kind, model):
+        version = '%x' % time.time_ns()
+        self.backend.set('%s:v:%s:%s' % (self.key_prefix, kind, model._meta.table_name), version, 0)
+        return version
+
+    def _pk_key(self, model, pk):
+        pk = model._meta.primary_key.db_value(pk)
+        return '%s:pk:%s:%s:%r' % (self.key_prefix, model._meta.table_name, self._version('r', model), pk)
+
+    def _query_key(self, query, sql, params):
+        digest = hashlib.sha1(repr((sql, params)).encode('utf8')).hexdigest()
+        versions = ':'.join(self._version('q', model) for model in _query_models(query))
+        return '%s:q:%s:%s' % (self.key_prefix, digest, versions)
+
+    def fetch(self, query, database, sql, params, ttl=None, pk=None):
+        key = self._pk_key(query.model, pk) if pk is not None else self._query_key(query, sql, params)
+        value = self.backend.get(key)
+        if value is None:
+            value = _fetch(query, database)
+            self.backend.set(key, value, ttl)
+        return value
+
+    def invalidate(self, model, pk=None, instance=None):
+        if pk is not None:
+            self.backend.delete(self._pk_key(model, pk))
+        else:
+            self._bump('r', model)
+        self._bump('q', model)
+
+    def invalidate_queries(self, model):
+        self._bump('q', model)
+
+
+class IdentityMap:
+    # 请求级的身份映射：同一主键返回同一实例，相同的 SELECT 在表被写入前只执行一次
+    def __init__(self):
+        self._instances = {}
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model, pk):
+        return model, model._meta.primary_key.db_value(pk)
+
+    def get(self, model, pk):
+        return self._instances.get(self._key(model, pk))
+
+    def add(self, instance):
+        self._instances[self._key(type(instance), instance._pk)] = instance
+
+    def get_query(self, sql, params):
+        entry = self._queries.get((sql, repr(params)))
+        return entry[1] if entry is not None else None
+
+    def set_query(self, sql, params, models, value):
+        self._queries[(sql, repr(params))] = (models, value)
+
+    def invalidate(self, model, pk=None, instance=None):
+        with self._lock:
+            if pk is not None:
+                # 刚保存的实例代表最新的数据，作为该主键的实例
+                key = self._key(model, pk)
+                if instance is not None:
+                    self._instances[key] = instance
+                else:
+                    self._instances.pop(key, None)
+            else:
+                for key in [key for key in self._instances if key[0] is model]:
+                    del self._instances[key]
+        self.invalidate_queries(model)
+
+    def invalidate_queries(self, model):
+        with self._lock:
+            for key in [key for key, (models, _) in self._queries.items() if model in models]:
+                del self._queries[key]
+
+
+_identity_map = contextvars.ContextVar('peeweext_identity_map', default=None)
+
+
+def start_identity_map():
+    return _identity_map.set(IdentityMap())
+
+
+def end_identity_map(token):
+    _identity_map.reset(token)
+
+
+def get_identity_map(database):
+    # 只对开启了 IDENTITY_MAP 的数据库生效，事务中可能回滚，不使用
+    identity_map = _identity_map.get()
+    if identity_map is None or not getattr(database, 'use_identity_map', False) or database.in_transaction():
+        return None
+    return identity_map
+
+
+def _fetch(query, database):
+    cursor = database.execute(query)
+    value = (tuple((column[0],) for column in cursor.description), tuple(cursor.fetchall()))
+    cursor.close()
+    return value
+
+
+def execute_select(query, database, cached=False, ttl=None, pk=None):
+    identity_map = get_identity_map(database)
+    query_cache = getattr(database, 'query_cache', None) if cached else None
+    # 事务中可能读到未提交的数据，不读也不写缓存
+    if query_cache is not None and database.in_transaction():
+        query_cache = None
+    if identity_map is None and query_cache is None:
+        return database.execute(query)
+
+    sql, params = database.get_sql_context().sql(query).query()
+    value = identity_map.get_query(sql, params) if identity_map is not None else None
+    if value is None:
+        if query_cache is not None:
+            value = query_cache.fetch(query, database, sql, params, ttl, pk)
+        else:
+            value = _fetch(query, database)
+        if identity_map is not None:
+            identity_map.set_query(sql, params, _query_models(query), value)
+    return CachedCursor(*value)
+
+
+def _caches(database):
+    identity_map = _identity_map.get()
+    if identity_map is not None and getattr(database, 'use_identity_map', False):
+        yield identity_map
+    query_cache = getattr(database, 'query_cache', None)
+    if query_cache is not None:
+        yield query_cache
+
+
+def _invalidate(database, method, *args):
+    for cache in _caches(database):
+        getattr(cache, method)(*args)
+    # 事务提交前，其他连接读到的仍是旧数据并可能重新写入缓存，提交后再失效一次
+    if getattr(database, 'query_cache', None) is not None and database.in_transaction():
+        pending = getattr(database._state, 'cache_invalidations', None)
+        if pending is None:
+            pending = database._state.cache_invalidations = []
+        pending.append((method, args))
+
+
+def invalidate_query(database, query):
+    model = query.model
+    if isinstance(query, peewee.ModelInsert) and not query._on_conflict:
+        # 新插入的行不影响主键缓存(未命中不缓存)，只需使查询结果失效
+        _invalidate(database, 'invalidate_queries', model)
+        return
+
+    where = getattr(query, '_where', None)
+    pk = None
+    if isinstance(where, Expression) and where.op == OP.EQ and where.lhs is model._meta.primary_key \
+            and not isinstance(where.rhs, Node):
+        pk = where.rhs
+    _invalidate(database, 'invalidate', model, pk)
+
+
+def _query_models(query):
+    models = [query.model]
+    for joins in query._joins.values():
+        for dest, *_ in joins:
+            model = getattr(dest, 'model', dest)
+            if isinstance(model, type) and issubclass(model, peewee.Model) and model not in models:
+                models.append(model)
+    return models
+
+
+class QueryCacheMixin:
+    query_cache = None
+    use_identity_map = False
+
+    def execute(self, query, *args, **kwargs):
+        ret = super().execute(query, *args, **kwargs)
+        # 不经过模型实例的写入(Model.update()/delete()/insert())在这里失效
+        if isinstance(query, peewee._ModelWriteQueryHelper):
+            invalidate_query(self, query)
+        return ret
+
+    def commit(self):
+        ret = super().commit()
+        pending = getattr(self._state, 'cache_invalidations', None)
+        if pending and self.query_cache is not None:
+            self._state.cache_invalidations = None
+            for method, args in pending:
+                getattr(self.query_cache, method)(*args)
+        return ret
+
+    def rollback(self):
+        # 回滚后数据恢复为旧值，写入时已失效过，不需要再失效
+        self._state.cache_invalidations = None
+        return super().rollback()
+
+
+@post_save.connect
+def _on_save(sender, instance, **kwargs):
+    _invalidate(sender._meta.database, 'invalidate', sender, instance._pk, instance)
+
+
+@post_delete.connect
+def _on_delete(sender, instance, **kwargs):
+    _invalidate(sender._meta.database, 'invalidate', sender, instance._pk)
+
+
+@post_bulk_save.connect
+def _on_bulk_save(sender, instances, created=False, **kwargs):
+    database = sender._meta.database
+    if created:
+        _invalidate(database, 'invalidate_queries', sender)
+    else:
+        for instance in instances:
+            _invalidate(database, 'invalidate', sender, instance._pk, instance)
+
+
+@post_bulk_delete.connect
+def _on_bulk_delete(sender, instances, **kwargs):
+    database = sender._meta.database
+    for instance in instances:
+        _invalidate(database, 'invalidate', sender, instance._pk)
@@ -0,0 +1,43 @@
+"""
+根据 DB_URL 构建数据库实例
+"""
+from urllib.parse import urlparse
+
+from playhouse import db_url
+from peeweext import pool
+
+__all__ = [
+    "connect",
+]
+
+_composed_classes = {}
+
+
+def compose(database_class, mixins):
+    # 将扩展功能以 mixin 的形式叠加在具体的数据库类之上，同样的组合只创建一次
+    if not mixins:
+        return database_class
+
+    key = (database_class,) + tuple(mixins)
+    if key not in _composed_classes:
+        _composed_classes[key] = type(database_class.__name__, tuple(mixins) + (database_class,), {})
+    return _composed_classes[key]
+
+
+def connect(url, mixins=(), pool_options=None, **connect_params):
+    parsed = urlparse(url)
+    schemes = db_url.schemes if pool_options is None else pool.schemes
+    database_class = schemes.get(parsed.scheme)
+    if database_class is None:
+        raise RuntimeError('Unrecognized or unsupported scheme: "%s".' % parsed.scheme)
+
+    # 与 playhouse.db_url.connect 一致，这两个参数用于解析 URL，不传给驱动
+    connect_params = dict(connect_params)
+    unquote_password = connect_params.pop('unquote_password', False)
+    unquote_user = connect_params.pop('unquote_user', False)
+    connect_kwargs = db_url.parseresult_to_dict(parsed, unquote_password, unquote_user)
+    if parsed.scheme.startswith('mysql') and 'password' in connect_kwargs:
+        connect_kwargs['passwd'] = connect_kwargs.pop('password')
+    connect_kwargs.update(pool_options or {})
+    connect_kwargs.update(connect_params)
+    return compose(database_class, mixins)(**connect_kwargs)
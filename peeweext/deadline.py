@@ -0,0 +1,192 @@
+"""
+RPC 截止时间传递为语句超时
+"""
+import re
+import time
+import weakref
+import threading
+import contextvars
+
+import peewee
+from playhouse.pool import PooledDatabase
+from playhouse.cockroachdb import CockroachDatabase
+from peeweext.exceptions import DeadlineExceeded
+
+__all__ = [
+    "Deadline",
+    "DeadlineMixin",
+    "start_deadline",
+    "end_deadline",
+    "get_deadline",
+]
+
+# sqlite 每执行多少条虚拟机指令检查一次截止时间
+SQLITE_PROGRESS_STEPS = 1000
+# 单独设置 Postgres 语句超时时按此粒度(毫秒)向上取整，取整后不变时不重复设置
+STATEMENT_TIMEOUT_STEP = 100
+
+_SELECT = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+
+_deadline = contextvars.ContextVar('peeweext_deadline', default=None)
+
+
+class Deadline:
+    def __init__(self, timeout=None):
+        self.expires = time.monotonic() + timeout if timeout is not None else None
+        self.cancelled = False
+        self.finished = False
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.cancelled or (self.expires is not None and time.monotonic() >= self.expires)
+
+    def begin(self, database, conn):
+        with self._lock:
+            self._in_flight[id(conn)] = (database, conn)
+
+    def end(self, conn):
+        with self._lock:
+            self._in_flight.pop(id(conn), None)
+
+    def cancel(self):
+        # RPC 被取消(或结束)时调用，可能在其他线程中；中断正在执行的语句，之后的语句直接失败
+        with self._lock:
+            if self.finished:
+                return
+            self.cancelled = True
+            in_flight = list(self._in_flight.values())
+        for database, conn in in_flight:
+            try:
+                database.interrupt(conn)
+            except Exception:
+                pass
+
+    def finish(self):
+        with self._lock:
+            self.finished = True
+
+
+def start_deadline(timeout=None, context=None):
+    # context 为 gRPC 的 ServicerContext，RPC 终止时取消正在执行的语句
+    deadline = Deadline(timeout)
+    if context is not None:
+        if hasattr(context, 'add_done_callback'):
+            context.add_done_callback(lambda _: deadline.cancel())
+        elif hasattr(context, 'add_callback'):
+            context.add_callback(deadline.cancel)
+    return _deadline.set(deadline)
+
+
+def end_deadline(token):
+    _deadline.get().finish()
+    _deadline.reset(token)
+
+
+def get_deadline():
+    return _deadline.get()
+
+
+def _sqlite_progress():
+    # 进度回调读取执行线程当前上下文的截止时间，连接归还连接池后遗留的回调对其他请求无影响
+    deadline = _deadline.get()
+    return deadline is not None and deadline.expired()
+
+
+class DeadlineMixin:
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        deadline = _deadline.get()
+        if deadline is None:
+            return super().execute_sql(self._reset_timeout(sql), params, *args, **kwargs)
+
+        if deadline.expired():
+            raise DeadlineExceeded('Deadline exceeded before executing query.')
+        conn = self.connection()
+        sql = self.apply_timeout(conn, sql, deadline)
+        deadline.begin(self, conn)
+        try:
+            return super().execute_sql(sql, params, *args, **kwargs)
+        except peewee.DatabaseError as e:
+            # 各数据库的超时、中断错误不同，截止时间已过或 RPC 已取消即视为超时
+            if deadline.expired():
+                raise DeadlineExceeded('Deadline exceeded while executing query.') from e
+            raise
+        finally:
+            deadline.end(conn)
+
+    def apply_timeout(self, conn, sql, deadline):
+        remaining = deadline.remaining()
+        if remaining is None:
+            return self._reset_timeout(sql)
+        timeout = max(int(remaining * 1000), 1)
+        if isinstance(self, peewee.PostgresqlDatabase):
+            if self._inline_timeout(conn):
+                # 与语句一起发送，不增加往返；之后没有截止时间的语句会先重置
+                self._statement_timeouts()[conn] = timeout
+                return 'SET statement_timeout = %d; %s' % (timeout, sql)
+            self._set_timeout(conn, -(-timeout // STATEMENT_TIMEOUT_STEP) * STATEMENT_TIMEOUT_STEP)
+            return sql
+        if isinstance(self, peewee.MySQLDatabase):
+            # MAX_EXECUTION_TIME 只对 SELECT 生效，其他语句在 RPC 取消时中断
+            return _SELECT.sub('SELECT /*+ MAX_EXECUTION_TIME(%d) */' % timeout, sql, count=1)
+        if isinstance(self, peewee.SqliteDatabase):
+            conn.set_progress_handler(_sqlite_progress, SQLITE_PROGRESS_STEPS)
+        return sql
+
+    def _statement_timeouts(self):
+        # 以连接为键，连接关闭释放后自动移除，避免 id 被新连接复用
+        return self.__dict__.setdefault('_peeweext_statement_timeouts', weakref.WeakKeyDictionary())
+
+    def _inline_timeout(self, conn):
+        # 只有 psycopg2 以简单查询协议发送，允许一次执行多条语句；psycopg3 与 CockroachDB 不接受
+        return type(conn).__module__.startswith('psycopg2') and not isinstance(self, CockroachDatabase)
+
+    def _set_timeout(self, conn, timeout):
+        # 单独执行 SET，不经过 execute_sql
+        timeouts = self._statement_timeouts()
+        if timeouts.get(conn, 0) == timeout:
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SET statement_timeout = %d' % timeout)
+        finally:
+            cursor.close()
+        if timeout:
+            timeouts[conn] = timeout
+        else:
+            timeouts.pop(conn, None)
+
+    def _reset_timeout(self, sql):
+        if not isinstance(self, peewee.PostgresqlDatabase) or self.is_closed():
+            return sql
+        conn = self._state.conn
+        if conn not in self._statement_timeouts():
+            return sql
+        if not self._inline_timeout(conn):
+            self._set_timeout(conn, 0)
+            return sql
+        del self._statement_timeouts()[conn]
+        return 'SET statement_timeout = 0; %s' % sql
+
+    def interrupt(self, conn):
+        if isinstance(self, peewee.SqliteDatabase):
+            conn.interrupt()
+        elif isinstance(self, peewee.PostgresqlDatabase):
+            conn.cancel()
+        elif isinstance(self, peewee.MySQLDatabase):
+            # 执行中的连接被占用，需要另开连接 KILL QUERY；连接池的 _connect 会占用名额，绕过连接池
+            if isinstance(self, PooledDatabase):
+                killer = super(PooledDatabase, self)._connect()
+            else:
+                killer = self._connect()
+            try:
+                cursor = killer.cursor()
+                cursor.execute('KILL QUERY %d' % conn.thread_id())
+                cursor.close()
+            finally:
+                killer.close()
@@ -1,3 +1,6 @@
+import peewee
+
+
 
 class ValidationError(Exception):
     default_message = 'Invalid input'
@@ -13,3 +16,19 @@ class ValidationError(Exception):
 
     def __str__(self):
         return str(self.message)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudgetWarning(UserWarning):
+    pass
+
+
+class DeadlineExceeded(peewee.OperationalError):
+    pass
+
+
+class AdmissionRejected(Exception):
+    pass
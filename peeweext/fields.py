@@ -1,5 +1,6 @@
 import json
 import datetime
+import functools
 import peewee
 import pendulum
 
@@ -8,24 +9,101 @@ peewee.MySQLDatabase.field_types.update({'DATETIME': 'DATETIME(6)'})
 peewee.PostgresqlDatabase.field_types.update({'DATETIME': 'TIMESTAMPTZ'})
 __all__ = [
     "DatetimeTZField",
+    "JSONCodec",
     "JSONTextField",
     "CreationDateTimeField",
     "ModificationDateTimeField"
 ]
 
 
+@functools.lru_cache(maxsize=64)
+def _fixed_timezone(offset):
+    return pendulum.tz.fixed_timezone(offset)
+
+
+def _to_pendulum(value):
+    # 与 pendulum.instance 结果一致：无时区按 UTC，固定偏移的时区转换为 pendulum 的固定偏移时区
+    tzinfo = value.tzinfo
+    if tzinfo is None:
+        tzinfo = pendulum.UTC
+    elif type(tzinfo) is datetime.timezone:
+        tzinfo = _fixed_timezone(int(value.utcoffset().total_seconds()))
+    else:
+        return pendulum.instance(value)
+
+    return pendulum.DateTime(
+        value.year, value.month, value.day,
+        value.hour, value.minute, value.second, value.microsecond,
+        tzinfo=tzinfo
+    )
+
+
+def _to_native(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def _parse_iso(value):
+    # 各数据库驱动返回的 "YYYY-MM-DD HH:MM:SS[.ffffff][+HH:MM]" 格式，其余格式返回 None 交给 pendulum.parse
+    if len(value) < 19 or value[10] not in ' T':
+        return None
+    if value[-1] == 'Z':
+        value = value[:-1]
+        if value[-6] in '+-':
+            return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_datetime(value):
+    parsed = _parse_iso(value)
+    if parsed is None:
+        return pendulum.parse(value)
+    return _to_pendulum(parsed)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_native_datetime(value):
+    parsed = _parse_iso(value)
+    if parsed is None:
+        parsed = pendulum.parse(value)
+        return datetime.datetime(
+            parsed.year, parsed.month, parsed.day,
+            parsed.hour, parsed.minute, parsed.second, parsed.microsecond,
+            tzinfo=datetime.timezone(parsed.utcoffset())
+        )
+    return _to_native(parsed)
+
+
+def to_native_datetime(value):
+    # 数据库返回值转换为带时区的标准库 datetime
+    if isinstance(value, str):
+        return parse_native_datetime(value)
+    if isinstance(value, datetime.datetime):
+        return _to_native(value)
+    return value
+
+
 class DatetimeTZField(peewee.Field):
     field_type = 'DATETIME'
 
-    def __init__(self, tz="Asia/Shanghai", *args, **kwargs):
+    def __init__(self, tz="Asia/Shanghai", *args, native=False, **kwargs):
         self.tz = tz
+        # native=True 时返回标准库 datetime 而不是 pendulum.DateTime
+        self.native = native
         super().__init__(*args, **kwargs)
 
     def python_value(self, value):
+        if self.native:
+            return to_native_datetime(value)
         if isinstance(value, str):
-            return pendulum.parse(value)
+            return parse_datetime(value)
         if isinstance(value, datetime.datetime):
-            return pendulum.instance(value)
+            return _to_pendulum(value)
         return value
 
     def db_value(self, value):
@@ -44,19 +122,158 @@ class DatetimeTZField(peewee.Field):
         return value.astimezone(datetime.timezone.utc)
 
 
+class JSONCodec:
+    def __init__(self, dumps=json.dumps, loads=json.loads):
+        self.dumps = dumps
+        self.loads = loads
+
+
+def _orjson_codec():
+    import orjson
+    return JSONCodec(lambda value: orjson.dumps(value).decode(), orjson.loads)
+
+
+def _ujson_codec():
+    import ujson
+    return JSONCodec(ujson.dumps, ujson.loads)
+
+
+json_codecs = {
+    'json': JSONCodec,
+    'orjson': _orjson_codec,
+    'ujson': _ujson_codec,
+}
+
+
+def get_json_codec(codec=None):
+    if codec is None:
+        codec = 'json'
+    if isinstance(codec, JSONCodec):
+        return codec
+    if codec == 'auto':
+        # 优先使用已安装的更快的实现，都未安装时使用标准库
+        for name in ('orjson', 'ujson'):
+            try:
+                return json_codecs[name]()
+            except ImportError:
+                pass
+        return json_codecs['json']()
+
+    if codec not in json_codecs:
+        raise ValueError('Unknown json codec: "%s".' % codec)
+    return json_codecs[codec]()
+
+
+class RawJSON(str):
+    # 尚未解码的 JSON 文本
+    pass
+
+
+class LazyJSONData(dict):
+    # 含惰性 JSON 字段的模型实例的 __data__，按键读取时解码，直接读取 __data__ 的代码(如 model_to_dict)也得到解码后的值；
+    # copy()、items() 等不解码，保存时未访问的值原样写回
+    __slots__ = ('_fields',)
+
+    def __init__(self, data, fields):
+        super().__init__(data)
+        self._fields = fields
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if type(value) is RawJSON:
+            value = self._decode(key, value)
+        return value
+
+    def get(self, key, default=None):
+        value = dict.get(self, key, default)
+        if type(value) is RawJSON:
+            value = self._decode(key, value)
+        return value
+
+    def _decode(self, key, value):
+        value = self._fields[key].decode(value)
+        dict.__setitem__(self, key, value)
+        return value
+
+
+class JSONAccessor(peewee.FieldAccessor):
+    def __get__(self, instance, instance_type=None):
+        if instance is not None:
+            value = instance.__data__.get(self.name)
+            if isinstance(value, RawJSON):
+                value = instance.__data__[self.name] = self.field.decode(value)
+            return value
+        return self.field
+
+    def __set__(self, instance, value):
+        if type(value) is RawJSON:
+            # 来自查询结果的原始文本(只有惰性或跟踪原地修改的字段)，记录在实例上用于保存时判断是否变更；
+            # 非惰性字段立即解码
+            loaded = instance.__dict__.get('_json_loaded')
+            if loaded is None:
+                loaded = instance.__dict__['_json_loaded'] = {}
+            loaded[self.name] = value
+            if not self.field.lazy:
+                value = self.field.decode(value)
+        super().__set__(instance, value)
+
+
 class JSONTextField(peewee.TextField):
     field_type = 'JSON'
 
+    def __init__(self, *args, codec=None, raw=False, lazy=False, track_mutations=False, **kwargs):
+        # codec 未指定时使用模型 Meta.json_codec(PeeweeExt 的 JSON_CODEC 配置)，默认标准库 json
+        # raw=True 时读取返回数据库中的原始文本，写入的 str/bytes 视为已编码的 JSON
+        # lazy=True 时第一次访问属性才解码，未访问过的值保存时原样写回
+        # track_mutations=True 时保留加载时的文本，保存时重新编码比较以发现原地修改；
+        # 未开启时只有赋值才视为变更。惰性字段总是跟踪，只比较访问过(已解码)的值
+        self.codec = None if codec is None else get_json_codec(codec)
+        self.raw = raw
+        self.lazy = lazy and not raw
+        self.track_mutations = (track_mutations or lazy) and not raw
+        self._codec = self.codec or get_json_codec()
+        if not self.raw:
+            self.accessor_class = JSONAccessor
+        super().__init__(*args, **kwargs)
+
+    def bind(self, model, name, set_attribute=True):
+        super().bind(model, name, set_attribute)
+        if self.codec is None:
+            self._codec = get_json_codec(getattr(model._meta, 'json_codec', None))
+
+    def decode(self, value):
+        return self._codec.loads(value)
+
     def db_value(self, value):
         if value is None:
             return value
-        data = json.dumps(value)
-        return data
+        if isinstance(value, RawJSON):
+            return str(value)
+        if self.raw and isinstance(value, (str, bytes)):
+            return value
+        return self._codec.dumps(value)
 
     def python_value(self, value):
+        if value is None or self.raw:
+            return value
+        return self._codec.loads(value)
+
+    def load_value(self, value):
+        # 只在构造模型实例时使用，由 JSONAccessor 记录原始文本并解码(惰性字段在访问时解码)
         if value is None:
             return value
-        return json.loads(value)
+        return RawJSON(value.decode() if isinstance(value, bytes) else value)
+
+
+class RawJSONCursorWrapperMixin:
+    # 构造模型实例时惰性或跟踪原地修改的 JSON 列先保持为 RawJSON，其余 JSON 列直接解码；
+    # dicts()、tuples() 等结果不经过这里，仍立即解码
+    def initialize(self):
+        super().initialize()
+        converters = self.converters
+        for index, field in enumerate(self.fields):
+            if isinstance(field, JSONTextField) and field.track_mutations and converters[index] is not None:
+                converters[index] = field.load_value
 
 
 class CreationDateTimeField(DatetimeTZField):
@@ -73,5 +290,4 @@ class ModificationDateTimeField(DatetimeTZField):
             kwargs["default"] = pendulum.now
         else:
             kwargs["null"] = True
-        self.update_modified = True
         super().__init__(*args, **kwargs)
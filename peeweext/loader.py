@@ -0,0 +1,206 @@
+"""
+批量加载，避免 N+1 查询
+"""
+import asyncio
+import weakref
+import contextvars
+
+import peewee
+from peewee import chunked, BackrefAccessor, ForeignKeyField
+from peeweext import aio
+from peeweext.cache import get_identity_map
+from peeweext.fields import RawJSONCursorWrapperMixin
+
+__all__ = [
+    "load_many",
+    "load_foreign",
+    "load_backref",
+    "prefetch_related",
+    "BatchLoader",
+    "start_batch_loaders",
+    "end_batch_loaders",
+]
+
+# IN 查询每次最多携带的值
+IN_CHUNK_SIZE = 500
+
+
+class BatchCursorWrapperMixin:
+    # 同一结果集中的实例互为兄弟，懒加载外键时一次加载已取回的兄弟的外键，不为此取回剩余的行；
+    # 边遍历边访问外键时只能合并已取回的行，先取回全部结果(如 list(query) 并保留 query)才能合并为一次查询。
+    # iterator() 不缓存结果，不参与。
+    # 实例只弱引用结果集，不延长整个结果集的生命周期
+    _batch_cache = True
+
+    def iterate(self, cache=True):
+        self._batch_cache = cache
+        return super().iterate(cache)
+
+    def process_row(self, row):
+        obj = super().process_row(row)
+        if self._batch_cache and isinstance(obj, peewee.Model):
+            obj.__batch__ = weakref.ref(self)
+        return obj
+
+
+class BatchModelObjectCursorWrapper(BatchCursorWrapperMixin, RawJSONCursorWrapperMixin,
+                                    peewee.ModelObjectCursorWrapper):
+    pass
+
+
+class BatchModelCursorWrapper(BatchCursorWrapperMixin, RawJSONCursorWrapperMixin, peewee.ModelCursorWrapper):
+    pass
+
+
+class BatchForeignKeyAccessor(peewee.ForeignKeyAccessor):
+    def get_rel_instance(self, instance):
+        if self.name not in instance.__rel__ and self.field.lazy_load:
+            ref = instance.__dict__.get('__batch__')
+            batch = ref() if ref is not None else None
+            if batch is not None and instance.__data__.get(self.name) is not None:
+                load_foreign([obj for obj in batch.row_cache if isinstance(obj, self.model)], self.field)
+        return super().get_rel_instance(instance)
+
+
+def load_many(model, pks):
+    # 返回 {主键: 实例}，主键为 db_value 后的值
+    pk_field = model._meta.primary_key
+    instances = {}
+    for values in chunked(list(pks), IN_CHUNK_SIZE):
+        for obj in model.select().where(pk_field.in_(values)):
+            instances[pk_field.db_value(obj._pk)] = obj
+
+    identity_map = get_identity_map(model._meta.database)
+    if identity_map is not None:
+        for obj in instances.values():
+            identity_map.add(obj)
+    return instances
+
+
+def load_foreign(instances, field):
+    name = field.name
+    rel_name = field.rel_field.name
+    pending = {}
+    for obj in instances:
+        value = obj.__data__.get(name)
+        if value is not None and name not in obj.__rel__:
+            pending.setdefault(value, []).append(obj)
+
+    for values in chunked(list(pending), IN_CHUNK_SIZE):
+        for rel in field.rel_model.select().where(field.rel_field.in_(values)):
+            for obj in pending.get(rel.__data__.get(rel_name), ()):
+                obj.__rel__[name] = rel
+
+
+def load_backref(instances, field):
+    # 与 peewee.prefetch 一致，子对象列表保存在 backref 同名属性上
+    name = field.name
+    rel_name = field.rel_field.name
+    parents = {}
+    for obj in instances:
+        setattr(obj, field.backref, [])
+        value = obj.__data__.get(rel_name)
+        if value is not None:
+            parents.setdefault(value, []).append(obj)
+
+    for values in chunked(list(parents), IN_CHUNK_SIZE):
+        for child in field.model.select().where(field.in_(values)):
+            for obj in parents.get(child.__data__.get(name), ()):
+                getattr(obj, field.backref).append(child)
+                child.__rel__[name] = obj
+
+
+def _resolve_relation(model, relation):
+    if isinstance(relation, str):
+        if isinstance(model._meta.fields.get(relation), ForeignKeyField):
+            relation = model._meta.fields[relation]
+        else:
+            relation = next((fk for fk in model._meta.backrefs if fk.backref == relation), relation)
+    if isinstance(relation, BackrefAccessor):
+        relation = relation.field
+    if isinstance(relation, ForeignKeyField):
+        if issubclass(model, relation.model):
+            return load_foreign, relation
+        if issubclass(model, relation.rel_model):
+            return load_backref, relation
+    raise ValueError('Cannot prefetch "%s" for %s.' % (relation, model.__name__))
+
+
+def prefetch_related(instances, *relations):
+    # relations 可以是外键字段、指向当前模型的外键字段、backref 或它们的名字，每个关系一次查询
+    instances = list(instances)
+    if not instances:
+        return instances
+    model = type(instances[0])
+    for relation in relations:
+        loader, field = _resolve_relation(model, relation)
+        loader(instances, field)
+    return instances
+
+
+# 请求级的 {模型: BatchLoader}，由中间件在请求开始时创建，避免不同请求的查询合并、共享实例
+_request_loaders = contextvars.ContextVar('peeweext_batch_loaders', default=None)
+# 请求之外按事件循环共享
+_loaders = weakref.WeakKeyDictionary()
+
+
+def start_batch_loaders():
+    return _request_loaders.set({})
+
+
+def end_batch_loaders(token):
+    _request_loaders.reset(token)
+
+
+class BatchLoader:
+    # 同一轮事件循环内对同一模型的 aio_get_by_id 合并为一次 IN 查询
+    def __init__(self, model, loop):
+        self.model = model
+        self.loop = loop
+        self._pending = {}
+
+    @classmethod
+    def get(cls, model):
+        loop = asyncio.get_running_loop()
+        loaders = _request_loaders.get()
+        if loaders is None:
+            loaders = _loaders.setdefault(loop, {})
+        loader = loaders.get(model)
+        if loader is None or loader.loop is not loop:
+            loader = loaders[model] = cls(model, loop)
+        return loader
+
+    def load(self, pk):
+        key = self.model._meta.primary_key.db_value(pk)
+        future = self.loop.create_future()
+        if not self._pending:
+            self.loop.call_soon(self._dispatch)
+        self._pending.setdefault(key, []).append(future)
+        return future
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        self.loop.create_task(self._resolve(pending))
+
+    async def _resolve(self, pending):
+        model = self.model
+        try:
+            instances = await aio.run_sync(model._meta.database, load_many, model, list(pending))
+        except Exception as e:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for key, futures in pending.items():
+            obj = instances.get(key)
+            for future in futures:
+                if future.done():
+                    continue
+                if obj is None:
+                    future.set_exception(model.DoesNotExist(
+                        '%s instance matching query does not exist:\nPK: %s' % (model.__name__, key)
+                    ))
+                else:
+                    future.set_result(obj)
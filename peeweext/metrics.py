@@ -0,0 +1,432 @@
+"""
+SQL 执行统计
+"""
+import re
+import time
+import queue
+import bisect
+import logging
+import warnings
+import functools
+import threading
+import contextlib
+import contextvars
+
+import peewee
+from peeweext.exceptions import QueryBudgetExceeded, QueryBudgetWarning
+
+__all__ = [
+    "QueryMetrics",
+    "SlowQueryLog",
+    "RequestStats",
+    "QueryBudget",
+    "InstrumentMixin",
+    "fingerprint",
+    "registry",
+    "snapshot",
+    "exposition",
+    "track_queries",
+]
+
+# 直方图分桶上界(秒)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 超出上限的语句指纹合并统计，避免拼接 SQL 导致内存无限增长
+OTHER_STATEMENTS = '<other>'
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w\"`.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_PARAM_LIST = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)")
+_ROW_LIST = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_SPACE = re.compile(r"\s+")
+
+logger = logging.getLogger('peeweext.slow_query')
+budget_logger = logging.getLogger('peeweext.query_budget')
+
+_rpc_method = contextvars.ContextVar('peeweext_rpc_method', default=None)
+_query_model = contextvars.ContextVar('peeweext_query_model', default=None)
+_request_stats = contextvars.ContextVar('peeweext_request_stats', default=None)
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(sql):
+    # 字面量替换为 ?，参数列表(IN、批量 VALUES)折叠为 (...)，同一类语句得到同一指纹
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PARAM_LIST.sub('(...)', sql)
+    sql = _ROW_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def set_rpc_method(name):
+    return _rpc_method.set(name)
+
+
+def reset_rpc_method(token):
+    _rpc_method.reset(token)
+
+
+def get_rpc_method():
+    return _rpc_method.get()
+
+
+class QueryMetrics:
+    # 每个线程只写自己的分片，记录时不加锁；snapshot 时合并所有分片
+    def __init__(self, buckets=BUCKETS, max_statements=1000):
+        self.buckets = tuple(buckets)
+        self.max_statements = max_statements
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, alias, model, method, statement, elapsed, rows=-1):
+        series, statements = self._shard()
+        key = (alias, model, method)
+        entry = series.get(key)
+        if entry is None:
+            # [次数, 总耗时, 行数, 各分桶次数]
+            entry = series[key] = [0, 0.0, 0, [0] * (len(self.buckets) + 1)]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[3][bisect.bisect_left(self.buckets, elapsed)] += 1
+
+        key = (alias, statement)
+        stats = statements.get(key)
+        if stats is None:
+            if len(statements) >= self.max_statements:
+                key = (alias, OTHER_STATEMENTS)
+                stats = statements.get(key)
+            if stats is None:
+                # [次数, 总耗时, 最大耗时, 行数]
+                stats = statements[key] = [0, 0.0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+        if rows > 0:
+            entry[2] += rows
+            stats[3] += rows
+
+    def snapshot(self, alias=None):
+        with self._lock:
+            shards = list(self._shards)
+
+        series, statements = {}, {}
+        for shard_series, shard_statements in shards:
+            for key, (count, total, rows, buckets) in shard_series.copy().items():
+                if alias is not None and key[0] != alias:
+                    continue
+                entry = series.setdefault(key, [0, 0.0, 0, [0] * len(buckets)])
+                entry[0] += count
+                entry[1] += total
+                entry[2] += rows
+                entry[3] = [a + b for a, b in zip(entry[3], buckets)]
+            for key, (count, total, maximum, rows) in shard_statements.copy().items():
+                if alias is not None and key[0] != alias:
+                    continue
+                stats = statements.setdefault(key, [0, 0.0, 0.0, 0])
+                stats[0] += count
+                stats[1] += total
+                stats[2] = max(stats[2], maximum)
+                stats[3] += rows
+
+        queries = []
+        for (alias_, model, method), (count, total, rows, buckets) in sorted(series.items(), key=_sort_key):
+            cumulative, running = [], 0
+            for bound, value in zip(self.buckets + (float('inf'),), buckets):
+                running += value
+                cumulative.append((bound, running))
+            queries.append(dict(
+                alias=alias_, model=model, method=method, count=count, sum=total, rows=rows, buckets=cumulative
+            ))
+        statements = [
+            dict(alias=alias_, fingerprint=statement, count=count, sum=total, max=maximum, rows=rows)
+            for (alias_, statement), (count, total, maximum, rows) in statements.items()
+        ]
+        statements.sort(key=lambda stats: stats['sum'], reverse=True)
+        return dict(queries=queries, statements=statements)
+
+    def reset(self):
+        with self._lock:
+            for series, statements in self._shards:
+                series.clear()
+                statements.clear()
+
+    def exposition(self, alias=None, prefix='peeweext'):
+        # Prometheus 文本格式
+        data = self.snapshot(alias)
+        lines = [
+            '# HELP %s_query_duration_seconds Time spent executing SQL statements.' % prefix,
+            '# TYPE %s_query_duration_seconds histogram' % prefix,
+        ]
+        for entry in data['queries']:
+            labels = _labels(alias=entry['alias'], model=entry['model'], method=entry['method'])
+            for bound, count in entry['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_query_duration_seconds_bucket{%s,le="%s"} %d' % (prefix, labels, le, count))
+            lines.append('%s_query_duration_seconds_sum{%s} %r' % (prefix, labels, entry['sum']))
+            lines.append('%s_query_duration_seconds_count{%s} %d' % (prefix, labels, entry['count']))
+
+        lines.append('# HELP %s_query_rows_total Rows reported by the driver for SQL statements.' % prefix)
+        lines.append('# TYPE %s_query_rows_total counter' % prefix)
+        for entry in data['queries']:
+            labels = _labels(alias=entry['alias'], model=entry['model'], method=entry['method'])
+            lines.append('%s_query_rows_total{%s} %d' % (prefix, labels, entry['rows']))
+
+        lines.append('# HELP %s_statement_seconds_total Time spent per statement fingerprint.' % prefix)
+        lines.append('# TYPE %s_statement_seconds_total counter' % prefix)
+        for stats in data['statements']:
+            labels = _labels(alias=stats['alias'], fingerprint=stats['fingerprint'])
+            lines.append('%s_statement_seconds_total{%s} %r' % (prefix, labels, stats['sum']))
+        lines.append('# HELP %s_statements_total Executions per statement fingerprint.' % prefix)
+        lines.append('# TYPE %s_statements_total counter' % prefix)
+        for stats in data['statements']:
+            labels = _labels(alias=stats['alias'], fingerprint=stats['fingerprint'])
+            lines.append('%s_statements_total{%s} %d' % (prefix, labels, stats['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def _sort_key(item):
+    return tuple(value or '' for value in item[0])
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (name, _escape('' if value is None else value)) for name, value in labels.items())
+
+
+# 进程内共享的统计，各数据库以 alias 区分
+registry = QueryMetrics()
+
+
+def snapshot(alias=None):
+    return registry.snapshot(alias)
+
+
+def exposition(alias=None):
+    return registry.exposition(alias)
+
+
+class SlowQueryLog:
+    # 超过阈值(秒)的语句记录日志；EXPLAIN 在后台线程中用该线程自己的连接执行，
+    # 同一指纹每 explain_interval 秒最多一次，队列满时丢弃
+    explainable = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+    def __init__(self, threshold=1.0, explain=True, explain_interval=60, redact=False, max_pending=100):
+        self.threshold = threshold
+        self.explain = explain
+        self.explain_interval = explain_interval
+        # redact: True 时参数全部替换为 '?'，也可以是处理参数列表的函数
+        self.redact = redact
+        self._queue = queue.Queue(max_pending)
+        self._explained = {}
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def redact_params(self, params):
+        if not self.redact or not params:
+            return params
+        if callable(self.redact):
+            return self.redact(params)
+        return ['?'] * len(params)
+
+    def record(self, database, sql, params, elapsed, model=None, method=None):
+        statement = fingerprint(sql)
+        logger.warning(
+            'Slow query (%.3fs) alias=%s method=%s model=%s: %s; params=%r',
+            elapsed, getattr(database, 'metrics_alias', None), method,
+            model.__name__ if model is not None else None, sql, self.redact_params(params)
+        )
+        if self.explain and self._should_explain(sql, statement):
+            try:
+                self._queue.put_nowait((database, sql, params, statement))
+            except queue.Full:
+                return
+            self._ensure_worker()
+
+    def _should_explain(self, sql, statement):
+        if not sql.lstrip().upper().startswith(self.explainable):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained.get(statement)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            if len(self._explained) >= 1000:
+                self._explained = {
+                    key: value for key, value in self._explained.items() if now - value < self.explain_interval
+                }
+            self._explained[statement] = now
+        return True
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='peeweext-explain', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            database, sql, params, statement = self._queue.get()
+            try:
+                plan = self.explain_query(database, sql, params)
+                logger.warning('EXPLAIN for slow query %s:\n%s', statement, '\n'.join(map(str, plan)))
+            except Exception:
+                logger.warning('EXPLAIN failed for slow query %s', statement, exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def explain_query(database, sql, params=None):
+        # 工作线程中的连接与请求线程互不相干，直接用游标执行，不经过统计
+        prefix = 'EXPLAIN QUERY PLAN ' if isinstance(database, peewee.SqliteDatabase) else 'EXPLAIN '
+        opened = database.connect(reuse_if_open=True)
+        try:
+            cursor = database.cursor()
+            try:
+                cursor.execute(prefix + sql, params or ())
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        finally:
+            if opened and not database.is_closed():
+                database.close()
+
+    def flush(self):
+        # 等待已入队的 EXPLAIN 完成，用于测试
+        self._queue.join()
+
+
+class RequestStats:
+    # 一次请求内所有数据库的查询次数、总耗时和各语句指纹的执行次数；
+    # 异步请求中查询在多个工作线程中执行，因此加锁
+    def __init__(self, method=None):
+        self.method = method
+        self.queries = 0
+        self.time = 0.0
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def add(self, statement, elapsed):
+        with self._lock:
+            self.queries += 1
+            self.time += elapsed
+            self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, limit):
+        return {statement: count for statement, count in self.statements.items() if count > limit}
+
+
+def start_request(method=None):
+    return _request_stats.set(RequestStats(method))
+
+
+def end_request(token):
+    _request_stats.reset(token)
+
+
+def get_request_stats():
+    return _request_stats.get()
+
+
+class QueryBudget:
+    # 请求结束时检查：查询次数超过 max_queries、总耗时超过 max_time 秒，
+    # 或同一语句指纹执行超过 max_repeats 次(N+1)；action 为 log、warn 或 raise(用于测试)
+    actions = ('log', 'warn', 'raise')
+
+    def __init__(self, max_queries=None, max_time=None, max_repeats=None, action='log'):
+        if action not in self.actions:
+            raise ValueError('Unknown query budget action: "%s".' % action)
+
+        self.max_queries = max_queries
+        self.max_time = max_time
+        self.max_repeats = max_repeats
+        self.action = action
+
+    def violations(self, stats):
+        problems = []
+        if self.max_queries is not None and stats.queries > self.max_queries:
+            problems.append('%d queries (budget %d)' % (stats.queries, self.max_queries))
+        if self.max_time is not None and stats.time > self.max_time:
+            problems.append('%.3fs in database (budget %.3fs)' % (stats.time, self.max_time))
+        if self.max_repeats is not None:
+            for statement, count in stats.repeated(self.max_repeats).items():
+                problems.append('possible N+1, %d executions of %s' % (count, statement))
+        return problems
+
+    def check(self, stats):
+        problems = self.violations(stats)
+        if not problems:
+            return problems
+
+        message = '%s exceeded query budget: %s' % (stats.method or 'Request', '; '.join(problems))
+        if self.action == 'raise':
+            raise QueryBudgetExceeded(message)
+        if self.action == 'warn':
+            warnings.warn(message, QueryBudgetWarning, stacklevel=2)
+        else:
+            budget_logger.warning(message)
+        return problems
+
+
+@contextlib.contextmanager
+def track_queries(budget=None, method=None):
+    # 在中间件之外(如测试、后台任务)统计一段代码的查询，需要数据库开启了统计(InstrumentMixin)
+    token = start_request(method)
+    stats = _request_stats.get()
+    try:
+        yield stats
+    finally:
+        end_request(token)
+    if budget is not None:
+        budget.check(stats)
+
+
+class InstrumentMixin:
+    metrics_alias = 'default'
+    query_metrics = None
+    slow_query_log = None
+
+    def execute(self, query, *args, **kwargs):
+        # execute_sql 只拿到 SQL，模型在这里记下
+        token = _query_model.set(getattr(query, 'model', None))
+        try:
+            return super().execute(query, *args, **kwargs)
+        finally:
+            _query_model.reset(token)
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        cursor = None
+        start = time.perf_counter()
+        try:
+            cursor = super().execute_sql(sql, params, *args, **kwargs)
+            return cursor
+        finally:
+            self.record_query(sql, params, time.perf_counter() - start, cursor)
+
+    def record_query(self, sql, params, elapsed, cursor=None):
+        model = _query_model.get()
+        method = _rpc_method.get()
+        query_metrics = self.query_metrics
+        if query_metrics is not None:
+            # sqlite 的 SELECT 不报告行数(-1)，此时不计入
+            query_metrics.observe(
+                self.metrics_alias, model.__name__ if model is not None else None, method,
+                fingerprint(sql), elapsed, getattr(cursor, 'rowcount', -1)
+            )
+        request_stats = _request_stats.get()
+        if request_stats is not None:
+            request_stats.add(fingerprint(sql), elapsed)
+        slow_query_log = self.slow_query_log
+        if slow_query_log is not None and elapsed >= slow_query_log.threshold:
+            slow_query_log.record(self, sql, params, elapsed, model, method)
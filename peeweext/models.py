@@ -1,12 +1,21 @@
 import json
+import operator
+import asyncio
 import inspect
 
 import peewee
 import pendulum
-from peewee import OP, Expression, DJANGO_MAP
-from peeweext.fields import CreationDateTimeField, ModificationDateTimeField
+from peewee import OP, Expression, DJANGO_MAP, chunked
+from peeweext import aio, cache, loader, stream
+from peeweext.fields import (
+    CreationDateTimeField, ModificationDateTimeField, JSONTextField, RawJSON, RawJSONCursorWrapperMixin,
+    LazyJSONData,
+)
 from peeweext.exceptions import ValidationError
-from peeweext.signal import pre_init, post_delete, pre_delete, pre_save, post_save
+from peeweext.signal import (
+    pre_init, post_delete, pre_delete, pre_save, post_save,
+    pre_bulk_save, post_bulk_save, pre_bulk_delete, post_bulk_delete
+)
 
 CUSTOM_DJANGO_MAP = {
     "exact": lambda l, r: Expression(l, OP.EQ, r),  # 精确等于，忽略大小写
@@ -20,58 +29,328 @@ CUSTOM_DJANGO_MAP = {
 DJANGO_MAP.update(CUSTOM_DJANGO_MAP)
 
 
+def validates(*fields):
+    # 跨字段校验，fields 为依赖的字段，更新时只有这些字段变更才执行，未指定时总是执行
+    def decorator(fn):
+        fn.__validates__ = fields
+        return fn
+
+    return decorator
+
+
+def _compile_validators(validators, cross_validators):
+    field_validators = tuple((name, fn) for name, fn in validators.items() if not inspect.iscoroutinefunction(fn))
+    async_field_validators = tuple((name, fn) for name, fn in validators.items() if inspect.iscoroutinefunction(fn))
+    cross = tuple(
+        (name, fn, frozenset(fn.__validates__)) for name, fn in cross_validators.items()
+        if not inspect.iscoroutinefunction(fn)
+    )
+    async_cross = tuple(
+        (name, fn, frozenset(fn.__validates__)) for name, fn in cross_validators.items()
+        if inspect.iscoroutinefunction(fn)
+    )
+
+    def validate(instance, dirty=None):
+        errors = {}
+        for name, fn in field_validators:
+            if dirty is None or name in dirty:
+                try:
+                    fn(instance, getattr(instance, name))
+                except ValidationError as e:
+                    errors[name] = str(e.message)
+
+        for name, fn, fields in cross:
+            if dirty is None or not fields or not fields.isdisjoint(dirty):
+                try:
+                    fn(instance)
+                except ValidationError as e:
+                    errors[name] = str(e.message)
+        return errors
+
+    async def validate_async(instance, dirty=None):
+        errors = validate(instance, dirty)
+        for name, fn in async_field_validators:
+            if dirty is None or name in dirty:
+                try:
+                    await fn(instance, getattr(instance, name))
+                except ValidationError as e:
+                    errors[name] = str(e.message)
+
+        for name, fn, fields in async_cross:
+            if dirty is None or not fields or not fields.isdisjoint(dirty):
+                try:
+                    await fn(instance)
+                except ValidationError as e:
+                    errors[name] = str(e.message)
+        return errors
+
+    validate.has_async = bool(async_field_validators or async_cross)
+    return validate, validate_async
+
+
+class CompactRow:
+    # 只读的轻量行对象，没有 dirty 跟踪、校验与信号，外键属性为关联的主键值
+    __slots__ = ('_extra',)
+    __model__ = None
+    __fields__ = frozenset()
+
+    def __getattr__(self, name):
+        # 未查询的字段返回 None，非模型字段的列(如聚合)保存在 _extra 中
+        if name in self.__fields__ or name == '_extra':
+            return None
+        extra = self._extra
+        if extra is not None and name in extra:
+            return extra[name]
+        raise AttributeError('%r object has no attribute %r' % (type(self).__name__, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is read-only.' % type(self).__name__)
+
+    def __repr__(self):
+        return '<%s: %s>' % (type(self).__name__, self._pk)
+
+    @property
+    def _pk(self):
+        pk = self.__model__._meta.primary_key
+        return getattr(self, pk.name) if pk else None
+
+    def get_id(self):
+        return self._pk
+
+    def _asdict(self):
+        data = {name: getattr(self, name) for name in self.__model__._meta.fields}
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+
+def _compact_row_class(model):
+    fields = model._meta.fields
+    attrs = {'__slots__': tuple(fields), '__model__': model, '__fields__': frozenset(fields)}
+    for name, field in fields.items():
+        if isinstance(field, peewee.ForeignKeyField) and field.object_id_name not in fields:
+            attrs[field.object_id_name] = property(operator.attrgetter(name))
+    return type('%sRow' % model.__name__, (CompactRow,), attrs)
+
+
+class CompactCursorWrapper(peewee.BaseModelCursorWrapper):
+    def initialize(self):
+        self._initialize_columns()
+        row_class = self.row_class = self.model.__compact_row__
+        plan = []
+        extra = []
+        seen = set()
+        for index, column in enumerate(self.columns):
+            if column in seen:
+                continue
+            seen.add(column)
+            converter = self.converters[index]
+            field = self.fields[index]
+            if column in row_class.__fields__ and (field is None or field.model is self.model):
+                plan.append((index, converter, row_class.__dict__[column].__set__))
+            else:
+                extra.append((index, converter, column))
+        self.plan = tuple(plan)
+        self.extra = tuple(extra)
+        self._set_extra = CompactRow.__dict__['_extra'].__set__
+
+    def process_row(self, row):
+        obj = self.row_class.__new__(self.row_class)
+        for index, converter, setter in self.plan:
+            value = row[index]
+            setter(obj, value if converter is None else converter(value))
+        if self.extra:
+            self._set_extra(obj, {
+                column: row[index] if converter is None else converter(row[index])
+                for index, converter, column in self.extra
+            })
+        return obj
+
+
+class ModelObjectCursorWrapper(RawJSONCursorWrapperMixin, peewee.ModelObjectCursorWrapper):
+    pass
+
+
+class ModelCursorWrapper(RawJSONCursorWrapperMixin, peewee.ModelCursorWrapper):
+    pass
+
+
+class ModelSelect(peewee.ModelSelect):
+    _cached = False
+    _compact = False
+    _cache_ttl = None
+    _cache_pk = None
+
+    @peewee.Node.copy
+    def cached(self, ttl=None):
+        # 结果缓存在数据库的 query_cache 中，未配置 QUERY_CACHE 时不生效
+        self._cached = True
+        self._cache_ttl = ttl
+
+    @peewee.Node.copy
+    def compact(self):
+        # 结果为只读的 __slots__ 行对象，适用于只读取、序列化的列表接口
+        self._compact = True
+
+    def _get_model_cursor_wrapper(self, cursor):
+        if self._compact:
+            return CompactCursorWrapper(cursor, self.model, self._returning)
+        if not self.model.__batch_load__:
+            if len(self._from_list) == 1 and not self._joins:
+                return ModelObjectCursorWrapper(cursor, self.model, self._returning, self.model)
+            return ModelCursorWrapper(cursor, self.model, self._returning, self._from_list, self._joins)
+        if len(self._from_list) == 1 and not self._joins:
+            return loader.BatchModelObjectCursorWrapper(cursor, self.model, self._returning, self.model)
+        return loader.BatchModelCursorWrapper(cursor, self.model, self._returning, self._from_list, self._joins)
+
+    def _execute(self, database):
+        # 查询缓存及请求级身份映射都未开启时直接执行
+        if self._cursor_wrapper is None:
+            cursor = cache.execute_select(self, database, self._cached, self._cache_ttl, self._cache_pk)
+            self._cursor_wrapper = self._get_cursor_wrapper(cursor)
+        return self._cursor_wrapper
+
+
 class ModelMeta(peewee.ModelBase):
     def __new__(cls, name, bases, attrs):
         cls = super().__new__(cls, name, bases, attrs)
         cls._validators = {}
+        cls._cross_validators = {}
+        for base in reversed(bases):
+            cls._validators.update(getattr(base, '_validators', {}))
+            cls._cross_validators.update(getattr(base, '_cross_validators', {}))
         for k, v in attrs.items():
-            if k.startswith("validate_") and inspect.isfunction(v):
+            if not inspect.isfunction(v):
+                continue
+            if hasattr(v, '__validates__'):
+                cls._cross_validators[k] = v
+            elif k.startswith("validate_"):
                 fn = k[9:]
                 if fn in cls._meta.fields:
                     cls._validators[fn] = v
+        validate, validate_async = _compile_validators(cls._validators, cls._cross_validators)
+        cls._compiled_validator = staticmethod(validate)
+        cls._compiled_async_validator = staticmethod(validate_async)
 
         cls.__has_whitelist__ = getattr(cls._meta, "has_whitelist", False)
+        cls.__signal_on_load__ = getattr(cls._meta, "signal_on_load", False)
+        cls.__compare_dirty__ = getattr(cls._meta, "compare_dirty", False)
+        cls.__cache_ttl__ = getattr(cls._meta, "cache_ttl", None)
+        cls.__batch_load__ = getattr(cls._meta, "batch_load", False)
+        cls.__compact_row__ = _compact_row_class(cls)
+        if cls.__batch_load__:
+            # Meta.batch_load 开启后，外键懒加载时批量加载同一结果集中已取回实例的外键
+            for f in cls._meta.refs:
+                if type(cls.__dict__.get(f.name)) is peewee.ForeignKeyAccessor:
+                    setattr(cls, f.name, loader.BatchForeignKeyAccessor(cls, f, f.name))
         cls.__accessible_fields__ = set(getattr(cls._meta, "accessible_fields", set()))
         cls.__protected_fields__ = set(getattr(cls._meta, "protected_fields", set()))
+        creation_datetime_fields = []
         modification_datetime_fields = []
         for f in cls._meta.sorted_fields:
-            if isinstance(f, ModificationDateTimeField):
+            if isinstance(f, CreationDateTimeField):
+                creation_datetime_fields.append(f)
+            elif isinstance(f, ModificationDateTimeField):
                 modification_datetime_fields.append(f)
+        cls.creation_datetime_fields = creation_datetime_fields
         cls.modification_datetime_fields = modification_datetime_fields
+        # 值可能被原地修改的字段，无法通过赋值感知变更，不参与快照比较
+        cls.__mutable_fields__ = tuple(f.name for f in cls._meta.sorted_fields if isinstance(f, JSONTextField))
+        # 其中保留加载时文本、保存时比较的字段
+        cls.__tracked_fields__ = tuple(
+            f.name for f in cls._meta.sorted_fields if isinstance(f, JSONTextField) and f.track_mutations)
+        cls.__lazy_json__ = any(isinstance(f, JSONTextField) and f.lazy for f in cls._meta.sorted_fields)
         return cls
 
 
 class Model(peewee.Model, metaclass=ModelMeta):
+    _validate_errors = None
+    _snapshot = None
+    # 跟踪原地修改的 JSON 字段加载或上次保存时的文本，由 JSONAccessor 记录
+    _json_loaded = None
+
+    class Meta:
+        # 更新时只保存变更的字段，Meta.compare_dirty 开启后还会与加载时的值比较
+        only_save_dirty = True
+
     def __init__(self, *args, **kwargs):
-        pre_init.send(type(self), instance=self)
-        self._validate_errors = None
+        # 查询结果实例化时(__no_default__)默认不发送 pre_init，可通过 Meta.signal_on_load 开启
+        if not kwargs.get('__no_default__') or self.__signal_on_load__:
+            if pre_init.has_receivers_for(type(self)):
+                pre_init.send(type(self), instance=self)
         super().__init__(*args, **kwargs)
+        if self.__lazy_json__:
+            self.__data__ = LazyJSONData(self.__data__, self._meta.fields)
+        if self.__compare_dirty__:
+            self._snapshot = self._snapshot_values(self.__data__) if kwargs.get('__no_default__') else {}
 
     @classmethod
     def create(cls, **query):
         return super().create(**cls._filter_attrs(query))
 
-    def update_with(self, **query):
-        for k, v in self._filter_attrs(query).items():
-            setattr(self, k, v)
-        return self.save()
+    @classmethod
+    def select(cls, *fields):
+        is_default = not fields
+        if not fields:
+            fields = cls._meta.sorted_fields
+        return ModelSelect(cls, fields, is_default=is_default)
 
     @classmethod
-    def _normalize_modification_datetime(cls):
-        normalized = {}
-        for f in cls.modification_datetime_fields:
-            if f.update_modified:
-                normalized[f.name] = pendulum.now()
+    def get(cls, *query, **filters):
+        # Meta.cache_ttl 开启后 get/get_by_id 的结果会被缓存
+        if cls.__cache_ttl__ is None:
+            return super().get(*query, **filters)
+
+        sq = cls.select().cached(cls.__cache_ttl__)
+        if query:
+            if len(query) == 1 and isinstance(query[0], int):
+                sq = sq.where(cls._meta.primary_key == query[0])
             else:
-                f.update_modified = True
+                sq = sq.where(*query)
+        if filters:
+            sq = sq.filter(**filters)
+        return sq.get()
+
+    @classmethod
+    def get_by_id(cls, pk):
+        # 开启请求级身份映射时，同一请求内相同主键返回同一实例
+        identity_map = cache.get_identity_map(cls._meta.database)
+        if identity_map is not None:
+            instance = identity_map.get(cls, pk)
+            if instance is not None:
+                return instance
+
+        if cls.__cache_ttl__ is None:
+            instance = super().get_by_id(pk)
+        else:
+            sq = cls.select().where(cls._meta.primary_key == pk).cached(cls.__cache_ttl__)
+            sq._cache_pk = pk
+            instance = sq.get()
 
-        return normalized
+        if identity_map is not None:
+            identity_map.add(instance)
+        return instance
+
+    def _assign(self, query):
+        data = self.__data__
+        for k, v in self._filter_attrs(query).items():
+            # 值未变化的字段不标记为 dirty，dict/list 可能被原地修改，总是赋值
+            if isinstance(v, (dict, list)) or k not in data or data[k] != v:
+                setattr(self, k, v)
+
+    def update_with(self, **query):
+        self._assign(query)
+        return self.save()
 
     @classmethod
     def update(cls, __data=None, **update):
-        modification_datetime = cls._normalize_modification_datetime()
-        update.update(modification_datetime)
-        return super().update(__data, **update)
+        data = cls._normalize_data(__data, update)
+        # 每次调用只取一次当前时间，显式指定的变更时间不覆盖(传入字段自身即可跳过更新)
+        if cls.modification_datetime_fields and isinstance(data, dict):
+            now = pendulum.now()
+            for f in cls.modification_datetime_fields:
+                data.setdefault(f, now)
+        return super().update(data)
 
     @classmethod
     def _filter_attrs(cls, attrs):
@@ -82,16 +361,122 @@ class Model(peewee.Model, metaclass=ModelMeta):
             blacklist = cls.__protected_fields__ - cls.__accessible_fields__
             return {k: v for k, v in attrs.items() if k not in blacklist}
 
+    def _touch(self, now):
+        for f in self.modification_datetime_fields:
+            setattr(self, f.name, now)
+
+    def _snapshot_values(self, names):
+        # JSON 字段通过文本比较，不在这里复制
+        data = self.__data__
+        mutable = self.__mutable_fields__
+        return {name: data[name] for name in names if name in data and name not in mutable}
+
+    def _mark_mutated(self):
+        # 跟踪的 JSON 值可能被原地修改：已解码的值重新编码后与加载(或上次保存)时的文本比较，不同才视为 dirty；
+        # 没有文本的已解码值视为已变更，未访问的惰性值(RawJSON)不编码也不会写回；返回编码结果供保存时复用
+        loaded = self._json_loaded or {}
+        data = self.__data__
+        fields = self._meta.fields
+        texts = {}
+        for name in self.__tracked_fields__:
+            if name not in data:
+                continue
+            value = dict.__getitem__(data, name)
+            if type(value) is RawJSON:
+                continue
+            if name in loaded:
+                text = texts[name] = fields[name].db_value(value)
+                if text == loaded[name]:
+                    self._dirty.discard(name)
+                else:
+                    self._dirty.add(name)
+            elif isinstance(value, (dict, list)):
+                self._dirty.add(name)
+        return texts
+
+    def _encode_json(self, names, texts):
+        # 写入前编码跟踪的 JSON 字段，保存时直接使用文本，保存后记录为已加载文本
+        data = self.__data__
+        fields = self._meta.fields
+        for name in self.__tracked_fields__:
+            if name in texts or name not in names or name not in data:
+                continue
+            value = dict.__getitem__(data, name)
+            if value is not None and type(value) is not RawJSON:
+                texts[name] = fields[name].db_value(value)
+        return {name: text for name, text in texts.items() if name in names and text is not None}
+
+    def _written_names(self, created, dirty, only):
+        if only is not None:
+            return {f if isinstance(f, str) else f.name for f in only}
+        if created or not self._meta.only_save_dirty:
+            return set(self.__data__)
+        return dirty
+
+    def _prune_unchanged(self):
+        # 去掉值与加载时相同的 dirty 字段，没有快照的字段(如关联查询填充、JSON 字段)跳过
+        snapshot = self._snapshot
+        data = self.__data__
+        for name in list(self._dirty):
+            if name not in snapshot or name not in data:
+                continue
+            old, new = snapshot[name], data[name]
+            if type(old) is type(new) and old == new:
+                self._dirty.discard(name)
+
     def save(self, *args, **kwargs):
         skip_validation = kwargs.pop('skip_validation', False)
+        touch = kwargs.pop('touch', True)
+        pk_value = self._pk
+        created = kwargs.get('force_insert', False) or not bool(pk_value)
+        texts = {}
+        if not created and kwargs.get('only') is None and self._meta.only_save_dirty:
+            texts = self._mark_mutated()
+            if self._snapshot is not None:
+                self._prune_unchanged()
+            if not self._dirty:
+                # 没有变更时不访问数据库
+                return False
+
         if not skip_validation:
-            if not self.is_valid():
+            # 更新时只校验变更过的字段
+            self._validate(dirty=None if created else self._dirty)
+            if self._validate_errors:
                 raise ValidationError(json.dumps(self._validate_errors))
 
-        pk_value = self._pk
-        created = kwargs.get('force_insert', False) or not bool(pk_value)
+        if not created and self.modification_datetime_fields:
+            if touch:
+                self._touch(pendulum.now())
+            else:
+                # 不更新时间时保留原值，避免 update() 自动填充
+                self._dirty.update(f.name for f in self.modification_datetime_fields)
+            if kwargs.get('only') is not None:
+                kwargs['only'] = list(kwargs['only']) + self.modification_datetime_fields
         pre_save.send(type(self), instance=self, created=created)
-        ret = super().save(*args, **kwargs)
+        dirty = set(self._dirty)
+        if self.__tracked_fields__:
+            written = self._written_names(created, dirty, kwargs.get('only'))
+            texts = self._encode_json(written, texts)
+            # 保存期间用编码后的文本替换原值，避免重复编码
+            data = self.__data__
+            values = {name: dict.__getitem__(data, name) for name in texts}
+            dict.update(data, {name: RawJSON(text) for name, text in texts.items()})
+            try:
+                ret = super().save(*args, **kwargs)
+            finally:
+                dict.update(data, values)
+            loaded = self.__dict__.get('_json_loaded')
+            if loaded is None:
+                loaded = self._json_loaded = {}
+            for name in self.__tracked_fields__:
+                if name in texts:
+                    loaded[name] = texts[name]
+                elif name in written and dict.get(data, name) is None:
+                    loaded.pop(name, None)
+        else:
+            ret = super().save(*args, **kwargs)
+        if self._snapshot is not None:
+            self._snapshot.update(self._snapshot_values(dirty - self._dirty))
         post_save.send(type(self), instance=self, created=created)
         return ret
 
@@ -101,18 +486,264 @@ class Model(peewee.Model, metaclass=ModelMeta):
         post_delete.send(type(self), instance=self)
         return ret
 
-    def _validate(self):
+    @classmethod
+    def validate_many(cls, instances, fields=None):
+        # 返回 {序号: 错误}，fields 指定时只校验这些字段
+        instances = list(instances)
+        dirty = None if fields is None else {f if isinstance(f, str) else f.name for f in fields}
+        if cls._compiled_validator.has_async:
+            return cls._run_async(cls.aio_validate_many(instances, fields))
+
+        errors = {}
+        validate = cls._compiled_validator
+        for index, instance in enumerate(instances):
+            instance._validate_errors = validate(instance, dirty)
+            if instance._validate_errors:
+                errors[index] = instance._validate_errors
+        return errors
+
+    @classmethod
+    async def aio_validate_many(cls, instances, fields=None):
+        instances = list(instances)
+        dirty = None if fields is None else {f if isinstance(f, str) else f.name for f in fields}
+        validate = cls._compiled_async_validator
+        results = await asyncio.gather(*[validate(instance, dirty) for instance in instances])
         errors = {}
+        for index, (instance, result) in enumerate(zip(instances, results)):
+            instance._validate_errors = result
+            if result:
+                errors[index] = result
+        return errors
 
-        for name, validator in self._validators.items():
-            value = getattr(self, name)
+    @classmethod
+    def _validate_batch(cls, instances, fields=None, offset=0):
+        # offset 为这一批在整个输入中的起始序号，保证错误序号对应原始输入
+        errors = cls.validate_many(instances, fields)
+        if errors:
+            raise ValidationError(json.dumps({offset + i: e for i, e in errors.items()}))
 
-            try:
-                validator(self, value)
-            except ValidationError as e:
-                errors[name] = str(e.message)
+    @classmethod
+    async def _aio_validate_batch(cls, instances, fields=None, offset=0):
+        errors = await cls.aio_validate_many(instances, fields)
+        if errors:
+            raise ValidationError(json.dumps({offset + i: e for i, e in errors.items()}))
+
+    @staticmethod
+    def _batches(instances, batch_size):
+        if batch_size is None:
+            return [instances]
+        return chunked(instances, batch_size)
+
+    @classmethod
+    def _prepare_bulk_create(cls, rows, now):
+        # rows 中的 dict 经过白名单过滤后实例化；创建/变更时间整个调用使用同一个时间，
+        # 实例的时间字段在构造时已由默认值填充，统一覆盖，dict 中显式指定的保留
+        fields = cls.creation_datetime_fields + cls.modification_datetime_fields
+        instances = []
+        for row in rows:
+            if isinstance(row, cls):
+                instance = row
+                for f in fields:
+                    setattr(instance, f.name, now)
+            else:
+                attrs = cls._filter_attrs(row)
+                instance = cls(**attrs)
+                for f in fields:
+                    if f.name not in attrs:
+                        setattr(instance, f.name, now)
+            instances.append(instance)
+        return instances
+
+    @classmethod
+    def _bulk_insert(cls, instances):
+        pre_bulk_save.send(cls, instances=instances, created=True)
+        with cls._meta.database.atomic():
+            super().bulk_create(instances)
+        for instance in instances:
+            instance._dirty.clear()
+        post_bulk_save.send(cls, instances=instances, created=True)
+        return len(instances)
+
+    @classmethod
+    def bulk_create(cls, rows, batch_size=None, skip_validation=False):
+        # 按 batch_size 逐批读取 rows(可以是生成器)，每批依次实例化、校验、发送信号并插入，
+        # 内存占用只与 batch_size 有关。原子性以批为单位：每批在各自的事务中插入，
+        # 某一批校验或插入失败时之前的批次已经写入，需要整体原子性时在外层使用 database.atomic()。
+        # 返回插入的行数
+        now = pendulum.now()
+        count = 0
+        for batch in cls._batches(rows, batch_size):
+            instances = cls._prepare_bulk_create(batch, now)
+            if not skip_validation:
+                cls._validate_batch(instances, offset=count)
+            count += cls._bulk_insert(instances)
+        return count
+
+    @classmethod
+    def _prepare_bulk_update(cls, instances, fields, touch):
+        if isinstance(cls._meta.primary_key, peewee.CompositeKey):
+            raise ValueError('bulk_update() is not supported for models with a composite primary key.')
+
+        instances = list(instances)
+        names = [f if isinstance(f, str) else f.name for f in fields]
+        names = list(cls._filter_attrs(dict.fromkeys(names)))
+        if not instances or not names:
+            return instances, []
+
+        if touch and cls.modification_datetime_fields:
+            now = pendulum.now()
+            for instance in instances:
+                instance._touch(now)
+            names.extend(f.name for f in cls.modification_datetime_fields if f.name not in names)
+        return instances, names
+
+    @classmethod
+    def _bulk_update(cls, instances, names, batch_size):
+        pk = cls._meta.primary_key
+        fields = [cls._meta.fields[name] for name in names]
+        pre_bulk_save.send(cls, instances=instances, created=False)
+        rows = 0
+        with cls._meta.database.atomic():
+            for batch in cls._batches(instances, batch_size):
+                data = {}
+                for field in fields:
+                    attr = field.object_id_name if isinstance(field, peewee.ForeignKeyField) else field.name
+                    cases = []
+                    for instance in batch:
+                        value = getattr(instance, attr)
+                        if not isinstance(value, peewee.Node):
+                            value = field.to_value(value)
+                        cases.append((pk.to_value(instance._pk), value))
+                    data[field] = peewee.Case(pk, cases)
+                # 不更新变更时间时将字段赋值为自身，避免 update() 自动写入当前时间
+                for f in cls.modification_datetime_fields:
+                    data.setdefault(f, f)
+                rows += cls.update(data).where(pk.in_([instance._pk for instance in batch])).execute()
+        for instance in instances:
+            instance._dirty.difference_update(names)
+        post_bulk_save.send(cls, instances=instances, created=False)
+        return rows
+
+    @classmethod
+    def bulk_update(cls, instances, fields, batch_size=None, skip_validation=False, touch=True):
+        instances, names = cls._prepare_bulk_update(instances, fields, touch)
+        if not names:
+            return 0
+        if not skip_validation:
+            cls._validate_batch(instances, names)
+        return cls._bulk_update(instances, names, batch_size)
+
+    @classmethod
+    def bulk_delete(cls, instances, batch_size=None):
+        if isinstance(cls._meta.primary_key, peewee.CompositeKey):
+            raise ValueError('bulk_delete() is not supported for models with a composite primary key.')
 
-        self._validate_errors = errors
+        instances = list(instances)
+        if not instances:
+            return 0
+
+        pre_bulk_delete.send(cls, instances=instances)
+        rows = 0
+        pk = cls._meta.primary_key
+        with cls._meta.database.atomic():
+            for batch in cls._batches(instances, batch_size):
+                rows += cls.delete().where(pk.in_([instance._pk for instance in batch])).execute()
+        post_bulk_delete.send(cls, instances=instances)
+        return rows
+
+    @classmethod
+    def iter_chunks(cls, query=None, chunk_size=1000, key=None, server_side=False):
+        # 分批遍历大结果集，返回实例还是元组/字典由 query 的 .tuples()/.dicts() 决定
+        return stream.iter_chunks(cls.select() if query is None else query, chunk_size, key, server_side)
+
+    @classmethod
+    def aio_iter_chunks(cls, query=None, chunk_size=1000, key=None):
+        return stream.aio_iter_chunks(cls.select() if query is None else query, chunk_size, key)
+
+    @classmethod
+    async def aio_create(cls, **query):
+        # 与 create() 一致先过滤白名单，校验在当前事件循环中执行
+        instance = cls(**cls._filter_attrs(query))
+        await instance.aio_save(force_insert=True)
+        return instance
+
+    @classmethod
+    async def aio_bulk_create(cls, rows, batch_size=None, skip_validation=False):
+        now = pendulum.now()
+        count = 0
+        for batch in cls._batches(rows, batch_size):
+            instances = cls._prepare_bulk_create(batch, now)
+            if not skip_validation:
+                await cls._aio_validate_batch(instances, offset=count)
+            count += await aio.run_sync(cls._meta.database, cls._bulk_insert, instances)
+        return count
+
+    @classmethod
+    async def aio_bulk_update(cls, instances, fields, batch_size=None, skip_validation=False, touch=True):
+        instances, names = cls._prepare_bulk_update(instances, fields, touch)
+        if not names:
+            return 0
+        if not skip_validation:
+            await cls._aio_validate_batch(instances, names)
+        return await aio.run_sync(cls._meta.database, cls._bulk_update, instances, names, batch_size)
+
+    @classmethod
+    async def aio_get(cls, *query, **filters):
+        return await aio.run_sync(cls._meta.database, cls.get, *query, **filters)
+
+    @classmethod
+    async def aio_get_by_id(cls, pk):
+        # 同一轮事件循环内的调用合并为一次 IN 查询
+        identity_map = cache.get_identity_map(cls._meta.database)
+        if identity_map is not None:
+            instance = identity_map.get(cls, pk)
+            if instance is not None:
+                return instance
+        if cls.__cache_ttl__ is not None:
+            return await aio.run_sync(cls._meta.database, cls.get_by_id, pk)
+        return await loader.BatchLoader.get(cls).load(pk)
+
+    async def aio_update_with(self, **query):
+        self._assign(query)
+        return await self.aio_save()
+
+    async def aio_save(self, *args, **kwargs):
+        # 校验在调用方的事件循环中执行(异步校验器可能使用绑定事件循环的资源)，只有写入在线程池中执行；
+        # 不重新编码 JSON 判断是否变更，已加载的跟踪 JSON 字段一并校验
+        if not kwargs.pop('skip_validation', False):
+            if kwargs.get('force_insert', False) or not bool(self._pk):
+                dirty = None
+            else:
+                dirty = set(self._dirty).union(name for name in self.__tracked_fields__ if name in self.__data__)
+            await self.aio_validate(dirty)
+            if self._validate_errors:
+                raise ValidationError(json.dumps(self._validate_errors))
+        return await aio.run_sync(self._meta.database, self.save, *args, skip_validation=True, **kwargs)
+
+    async def aio_delete_instance(self, *args, **kwargs):
+        return await aio.run_sync(self._meta.database, self.delete_instance, *args, **kwargs)
+
+    @staticmethod
+    def _run_async(coro):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        coro.close()
+        raise RuntimeError(
+            'Model has async validators, use aio_validate/aio_save/aio_bulk_create/aio_bulk_update '
+            'inside an event loop.'
+        )
+
+    def _validate(self, dirty=None):
+        if self._compiled_validator.has_async:
+            self._validate_errors = self._run_async(self._compiled_async_validator(self, dirty))
+        else:
+            self._validate_errors = self._compiled_validator(self, dirty)
+
+    async def aio_validate(self, dirty=None):
+        self._validate_errors = await self._compiled_async_validator(self, dirty)
+        return self._validate_errors
 
     @property
     def errors(self):
@@ -128,13 +759,3 @@ class Model(peewee.Model, metaclass=ModelMeta):
 class TimeStampedModel(Model):
     created_at = CreationDateTimeField(help_text="创建时间")
     updated_at = ModificationDateTimeField(help_text="变更时间")
-
-
-def _touch_model(sender, instance, created):
-    if issubclass(sender, Model) and not created:
-        for f in instance.modification_datetime_fields:
-            setattr(instance, f.name, pendulum.now())
-            f.update_modified = False
-
-
-pre_save.connect(_touch_model)
@@ -1,10 +1,21 @@
 """
 分页
 """
+import json
+import time
+import base64
+import binascii
+import datetime
+import operator
+import threading
+from functools import reduce
+from collections import OrderedDict
 from collections.abc import Sequence
 
 from math import ceil
-from peewee import Query
+import peewee
+from peewee import Query, Ordering, Tuple, Value
+from peeweext import loader
 
 
 class UnorderedObjectListWarning(RuntimeWarning):
@@ -23,13 +34,133 @@ class EmptyPage(InvalidPage):
     pass
 
 
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class ExactCount:
+    skip_count = False
+
+    def count(self, queryset):
+        try:
+            return queryset.count()
+        except (AttributeError, TypeError):
+            return len(queryset)
+
+
+class CachedCount(ExactCount):
+    # 按 SQL 与参数缓存精确计数，多个 Paginator 共用同一个实例
+    def __init__(self, ttl=60, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cache_key(self, queryset):
+        sql, params = queryset.sql()
+        return queryset._database.database, sql, repr(params)
+
+    def count(self, queryset):
+        if not isinstance(queryset, Query):
+            return super().count(queryset)
+
+        key = self.cache_key(queryset)
+        now = time.time()
+        with self._lock:
+            item = self._cache.get(key)
+            if item is not None and item[0] > now:
+                self._cache.move_to_end(key)
+                return item[1]
+
+        count = super().count(queryset)
+        with self._lock:
+            self._cache[key] = (now + self.ttl, count)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class EstimatedCount(ExactCount):
+    # 使用查询计划的行数估算，估算值小于 threshold 或无法估算时退回精确计数
+    def __init__(self, threshold=1000):
+        self.threshold = threshold
+
+    def count(self, queryset):
+        estimate = None
+        if isinstance(queryset, Query):
+            try:
+                estimate = self.estimate(queryset)
+            except peewee.DatabaseError:
+                estimate = None
+
+        if estimate is None or estimate < self.threshold:
+            return super().count(queryset)
+        return estimate
+
+    def estimate(self, queryset):
+        database = queryset._database
+        if isinstance(database, peewee.PostgresqlDatabase):
+            return self._estimate_postgresql(database, queryset)
+        if isinstance(database, peewee.MySQLDatabase):
+            return self._estimate_mysql(database, queryset)
+        if isinstance(database, peewee.SqliteDatabase):
+            return self._estimate_sqlite(database, queryset)
+        return None
+
+    def _estimate_postgresql(self, database, queryset):
+        sql, params = queryset.order_by().sql()
+        plan = database.execute_sql('EXPLAIN (FORMAT JSON) ' + sql, params).fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def _estimate_mysql(self, database, queryset):
+        sql, params = queryset.order_by().sql()
+        cursor = database.execute_sql('EXPLAIN ' + sql, params)
+        columns = [c[0].lower() for c in cursor.description]
+        row = cursor.fetchone()
+        if row is None or row[columns.index('rows')] is None:
+            return None
+
+        filtered = row[columns.index('filtered')] if 'filtered' in columns else None
+        return int(row[columns.index('rows')] * (100 if filtered is None else float(filtered)) / 100)
+
+    def _estimate_sqlite(self, database, queryset):
+        # sqlite_stat1 只有整表的统计，带条件或关联的查询无法估算
+        model = getattr(queryset, 'model', None)
+        if model is None or queryset._where is not None or getattr(queryset, '_joins', None):
+            return None
+
+        cursor = database.execute_sql('SELECT stat FROM sqlite_stat1 WHERE tbl = ?', (model._meta.table_name,))
+        counts = [int(row[0].split()[0]) for row in cursor.fetchall() if row[0]]
+        return max(counts) if counts else None
+
+
+class HasMoreCount(ExactCount):
+    # 不计数，每页多取一行判断是否还有下一页
+    skip_count = True
+
+    def count(self, queryset):
+        return None
+
+
 class Paginator:
-    def __init__(self, queryset, page_size=20, orphans=0, allow_empty_first_page=True):
+    # page() 对不是整数的页码返回第一页，超出范围的页码返回最后一页；strict 为 True 时超出范围抛出 EmptyPage。
+    # 各计数策略的行为一致，HasMoreCount 只在页码超出范围时才精确计数以确定最后一页
+    def __init__(self, queryset, page_size=20, orphans=0, allow_empty_first_page=True, count_strategy=None,
+                 strict=False):
         self.queryset = queryset
         self.page_size = int(page_size)
         self.orphans = int(orphans)
         self._num_pages = self._count = None
         self.allow_empty_first_page = allow_empty_first_page
+        self.count_strategy = count_strategy or ExactCount()
+        self.strict = strict
 
     def validate_number(self, number):
         try:
@@ -42,7 +173,7 @@ class Paginator:
         if number < 1:
             raise EmptyPage("页码小于1")
 
-        if number > self.num_pages:
+        if self.num_pages is not None and number > self.num_pages:
             if number == 1 and self.allow_empty_first_page:
                 pass
             else:
@@ -51,11 +182,20 @@ class Paginator:
         return number
 
     def page(self, page_number):
+        if self.count_strategy.skip_count:
+            page = self._page_without_count(page_number)
+            if page is not None:
+                return page
+            self._num_pages = None
+            self._count = ExactCount().count(self.queryset)
+
         try:
             number = self.validate_number(page_number)
         except PageNotAnInteger:
             number = 1
         except EmptyPage:
+            if self.strict:
+                raise
             number = self.num_pages
 
         bottom = (number - 1) * self.page_size
@@ -71,6 +211,37 @@ class Paginator:
 
         return self._get_page(object_list, number, self)
 
+    def _page_without_count(self, page_number):
+        # 总数未知，count 为已读取到的行数，num_pages 只到下一页为止；页码超出范围时返回 None
+        self._num_pages = self._count = None
+        try:
+            number = self.validate_number(page_number)
+        except PageNotAnInteger:
+            number = 1
+        except EmptyPage:
+            if self.strict:
+                raise
+            return None
+
+        bottom = (number - 1) * self.page_size
+        limit = self.page_size + self.orphans + 1
+        if isinstance(self.queryset, Query):
+            rows = list(self.queryset.limit(limit).offset(bottom))
+        else:
+            rows = list(self.queryset[bottom:bottom + limit])
+
+        # 超出末页(或只剩已并入上一页的 orphans)时与 validate_number 一致
+        if (number > 1 and len(rows) <= self.orphans) or (not rows and not self.allow_empty_first_page):
+            if self.strict:
+                raise EmptyPage("该分页不包含任何结果")
+            return None
+
+        has_more = len(rows) == limit
+        object_list = rows[:self.page_size] if has_more else rows
+        self._count = bottom + len(rows)
+        self._num_pages = number + 1 if has_more else number
+        return self._get_page(object_list, number, self)
+
     @staticmethod
     def _get_page(*args, **kwargs):
         return Page(*args, **kwargs)
@@ -78,16 +249,15 @@ class Paginator:
     @property
     def count(self):
         if self._count is None:
-            try:
-                self._count = self.queryset.count()
-            except (AttributeError, TypeError):
-                self._count = len(self.queryset)
+            self._count = self.count_strategy.count(self.queryset)
 
         return self._count
 
     @property
     def num_pages(self):
         if self._num_pages is None:
+            if self.count is None:
+                return None
             if self.count == 0 and not self.allow_empty_first_page:
                 self._num_pages = 0
             else:
@@ -121,6 +291,11 @@ class Page(Sequence):
     def has_next(self):
         return self.page_number < self.paginator.num_pages
 
+    def prefetch(self, *relations):
+        # 每个关系一次查询加载整页的关联数据
+        self.object_list = loader.prefetch_related(self.object_list, *relations)
+        return self
+
     def has_previous(self):
         return self.page_number > 1
 
@@ -150,3 +325,134 @@ class Page(Sequence):
     @property
     def num_pages(self):
         return self.paginator.num_pages
+
+
+def _cursor_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(' ')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)
+
+
+class KeysetPaginator:
+    # 游标分页，按唯一的排序列定位边界，翻页开销与页码深度无关
+    def __init__(self, queryset, ordering, page_size=20):
+        self.queryset = queryset
+        self.ordering = [o if isinstance(o, Ordering) else o.asc() for o in ordering]
+        self.page_size = int(page_size)
+
+    def encode_cursor(self, direction, values):
+        data = json.dumps([direction, values], default=_cursor_default, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            direction, values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (AttributeError, TypeError, ValueError, binascii.Error):
+            raise InvalidCursor("游标无效")
+
+        if direction not in ('next', 'prev') or not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor("游标无效")
+
+        return direction, values
+
+    def row_values(self, row):
+        if isinstance(row, dict):
+            return [row[o.node.name] for o in self.ordering]
+        return [getattr(row, o.node.name) for o in self.ordering]
+
+    def _is_ascending(self, ordering, reverse):
+        return (ordering.direction.upper() == 'ASC') != reverse
+
+    def _seek(self, values, reverse):
+        values = [Value(v, converter=getattr(o.node, 'db_value', None)) for o, v in zip(self.ordering, values)]
+        directions = {self._is_ascending(o, reverse) for o in self.ordering}
+        if len(directions) == 1:
+            # 排序方向一致时使用行值比较，便于数据库走索引范围扫描
+            lhs, rhs = Tuple(*[o.node for o in self.ordering]), Tuple(*values)
+            return lhs > rhs if directions.pop() else lhs < rhs
+
+        # (c1 > v1) OR (c1 = v1 AND c2 > v2) OR ...
+        clauses = []
+        for i, ordering in enumerate(self.ordering):
+            node = ordering.node
+            expr = node > values[i] if self._is_ascending(ordering, reverse) else node < values[i]
+            for prev, value in zip(self.ordering[:i], values[:i]):
+                expr = (prev.node == value) & expr
+            clauses.append(expr)
+        return reduce(operator.or_, clauses)
+
+    def page(self, cursor=None):
+        if cursor is None:
+            direction, values = 'next', None
+        else:
+            direction, values = self.decode_cursor(cursor)
+
+        reverse = direction == 'prev'
+        ordering = self.ordering
+        if reverse:
+            ordering = [
+                Ordering(o.node, 'DESC' if o.direction.upper() == 'ASC' else 'ASC', o.collation, o.nulls)
+                for o in self.ordering
+            ]
+
+        query = self.queryset.order_by(*ordering)
+        if values is not None:
+            query = query.where(self._seek(values, reverse))
+
+        rows = list(query.limit(self.page_size + 1))
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            return self._get_page(rows, self, has_next=True, has_previous=has_more)
+
+        return self._get_page(rows, self, has_next=has_more, has_previous=values is not None)
+
+    @staticmethod
+    def _get_page(*args, **kwargs):
+        return KeysetPage(*args, **kwargs)
+
+
+class KeysetPage(Sequence):
+
+    def __init__(self, object_list, paginator, has_next=False, has_previous=False):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+
+    def __repr__(self):
+        return '<KeysetPage of %s>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        if not isinstance(index, (int, slice)):
+            raise TypeError
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def prefetch(self, *relations):
+        self.object_list = loader.prefetch_related(self.object_list, *relations)
+        return self
+
+    def next_cursor(self):
+        if not self.has_next():
+            raise EmptyPage("该分页不包含任何结果")
+        return self.paginator.encode_cursor('next', self.paginator.row_values(self.object_list[-1]))
+
+    def previous_cursor(self):
+        if not self.has_previous():
+            raise EmptyPage("该分页不包含任何结果")
+        return self.paginator.encode_cursor('prev', self.paginator.row_values(self.object_list[0]))
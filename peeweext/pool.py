@@ -0,0 +1,101 @@
+"""
+连接池
+"""
+import time
+
+from playhouse import db_url, pool
+from playhouse.pool import MaxConnectionsExceeded
+
+__all__ = [
+    "PooledSqliteDatabase",
+    "PooledMySQLDatabase",
+    "PooledPostgresqlDatabase",
+    "MaxConnectionsExceeded",
+]
+
+
+class PoolStatsMixin:
+    def __init__(self, database, pre_ping=False, **kwargs):
+        self._pre_ping = pre_ping
+        self._waits = 0
+        self._wait_time = 0.0
+        super().__init__(database, **kwargs)
+
+    def connect(self, reuse_if_open=False):
+        # 先不等待地尝试获取连接，连接池耗尽时才进入等待并记录等待次数与耗时
+        try:
+            return super(pool.PooledDatabase, self).connect(reuse_if_open)
+        except MaxConnectionsExceeded:
+            if not self._wait_timeout:
+                raise
+
+        start = time.time()
+        try:
+            return super().connect(reuse_if_open)
+        finally:
+            with self._pool_lock:
+                self._waits += 1
+                self._wait_time += time.time() - start
+
+    def _is_closed(self, conn):
+        if super()._is_closed(conn):
+            return True
+        if self._pre_ping:
+            try:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute('SELECT 1')
+                finally:
+                    cursor.close()
+            except Exception:
+                return True
+        return False
+
+    def pool_stats(self):
+        with self._pool_lock:
+            return {
+                'max_connections': self._max_connections,
+                'in_use': len(self._in_use),
+                'idle': len(self._connections),
+                'waits': self._waits,
+                'wait_time': self._wait_time,
+            }
+
+
+class PooledSqliteDatabase(PoolStatsMixin, pool.PooledSqliteDatabase):
+    pass
+
+
+class PooledMySQLDatabase(PoolStatsMixin, pool.PooledMySQLDatabase):
+    pass
+
+
+class PooledPostgresqlDatabase(PoolStatsMixin, pool.PooledPostgresqlDatabase):
+    pass
+
+
+_stats_classes = {
+    pool.PooledSqliteDatabase: PooledSqliteDatabase,
+    pool.PooledMySQLDatabase: PooledMySQLDatabase,
+    pool.PooledPostgresqlDatabase: PooledPostgresqlDatabase,
+}
+
+
+def _with_stats(database_class):
+    if database_class not in _stats_classes:
+        _stats_classes[database_class] = type(database_class.__name__, (PoolStatsMixin, database_class), {})
+    return _stats_classes[database_class]
+
+
+def _pooled_schemes():
+    # db_url 支持的每个协议都对应到连接池版本(如 postgresext -> postgresext+pool)
+    schemes = {}
+    for scheme, database_class in db_url.schemes.items():
+        if database_class is not None and not issubclass(database_class, pool.PooledDatabase):
+            database_class = db_url.schemes.get(scheme + '+pool')
+        if database_class is not None:
+            schemes[scheme] = _with_stats(database_class)
+    return schemes
+
+
+schemes = _pooled_schemes()
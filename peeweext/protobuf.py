@@ -0,0 +1,235 @@
+"""
+查询结果直接序列化为 protobuf 消息
+"""
+import threading
+
+import peewee
+from peeweext import cache, stream
+from peeweext.fields import DatetimeTZField, JSONTextField, to_native_datetime
+
+try:
+    # protobuf 是可选依赖，只有使用本模块时才需要
+    from google.protobuf.descriptor import FieldDescriptor
+except ImportError as e:
+    raise ImportError(
+        'peeweext.protobuf requires protobuf, install it with "pip install binwen-peewee[protobuf]".'
+    ) from e
+
+__all__ = [
+    "MessageMapper",
+    "get_mapper",
+]
+
+_WRAPPER_TYPES = frozenset('google.protobuf.%s' % name for name in (
+    'DoubleValue', 'FloatValue', 'Int64Value', 'UInt64Value', 'Int32Value', 'UInt32Value',
+    'BoolValue', 'StringValue', 'BytesValue',
+))
+_SCALAR_TYPES = {
+    FieldDescriptor.CPPTYPE_INT32: int,
+    FieldDescriptor.CPPTYPE_INT64: int,
+    FieldDescriptor.CPPTYPE_UINT32: int,
+    FieldDescriptor.CPPTYPE_UINT64: int,
+    FieldDescriptor.CPPTYPE_ENUM: int,
+    FieldDescriptor.CPPTYPE_DOUBLE: float,
+    FieldDescriptor.CPPTYPE_FLOAT: float,
+    FieldDescriptor.CPPTYPE_BOOL: bool,
+}
+
+
+def _is_repeated(fd):
+    is_repeated = getattr(fd, 'is_repeated', None)
+    if is_repeated is None:
+        return fd.label == FieldDescriptor.LABEL_REPEATED
+    return is_repeated
+
+
+def _json_value(field):
+    # 游标中是 JSON 文本，模型实例中可能已解码
+    def convert(value):
+        if isinstance(value, (dict, list)):
+            return value
+        return field.decode(value)
+
+    return convert
+
+
+def _json_text(field):
+    def convert(value):
+        if isinstance(value, str):
+            return value
+        if isinstance(value, bytes):
+            return value.decode()
+        return field.db_value(value)
+
+    return convert
+
+
+def _scalar(fd, field):
+    # 值可能来自游标(未转换)或模型实例(已转换)，python_value 对两者都适用
+    if isinstance(field, DatetimeTZField):
+        if fd.cpp_type == FieldDescriptor.CPPTYPE_STRING:
+            return lambda value: to_native_datetime(value).isoformat()
+        if fd.cpp_type in (FieldDescriptor.CPPTYPE_INT64, FieldDescriptor.CPPTYPE_UINT64):
+            return lambda value: int(to_native_datetime(value).timestamp())
+        return to_native_datetime
+    if isinstance(field, JSONTextField) and fd.cpp_type == FieldDescriptor.CPPTYPE_STRING:
+        return _json_text(field)
+
+    python_value = field.python_value
+    if fd.cpp_type == FieldDescriptor.CPPTYPE_STRING:
+        if fd.type == FieldDescriptor.TYPE_BYTES:
+            return lambda value: bytes(python_value(value))
+        return lambda value: str(python_value(value))
+    cast = _SCALAR_TYPES.get(fd.cpp_type)
+    if cast is None:
+        return python_value
+    return lambda value: cast(python_value(value))
+
+
+def _build_setter(fd, field):
+    name = fd.name
+    if fd.message_type is not None:
+        full_name = fd.message_type.full_name
+        if full_name == 'google.protobuf.Timestamp' and isinstance(field, DatetimeTZField):
+            def set_timestamp(message, value):
+                getattr(message, name).FromDatetime(to_native_datetime(value))
+
+            return set_timestamp
+        if full_name == 'google.protobuf.Struct' and isinstance(field, JSONTextField):
+            convert = _json_value(field)
+
+            def set_struct(message, value):
+                getattr(message, name).update(convert(value))
+
+            return set_struct
+        if full_name == 'google.protobuf.ListValue' and isinstance(field, JSONTextField):
+            convert = _json_value(field)
+
+            def set_list(message, value):
+                getattr(message, name).extend(convert(value))
+
+            return set_list
+        if full_name in _WRAPPER_TYPES:
+            convert = _scalar(fd.message_type.fields_by_name['value'], field)
+
+            def set_wrapper(message, value):
+                getattr(message, name).value = convert(value)
+
+            return set_wrapper
+        return None
+
+    if _is_repeated(fd):
+        if not isinstance(field, JSONTextField):
+            return None
+        convert = _json_value(field)
+
+        def set_repeated(message, value):
+            getattr(message, name).extend(convert(value))
+
+        return set_repeated
+
+    convert = _scalar(fd, field)
+
+    def set_scalar(message, value):
+        setattr(message, name, convert(value))
+
+    return set_scalar
+
+
+class MessageMapper:
+    def __init__(self, model, message_class, fields=None):
+        # fields: {消息字段名: 模型字段或字段名}，未指定的消息字段按同名匹配(外键也匹配 <name>_id)，
+        # 匹配不到或类型不支持的消息字段忽略
+        self.model = model
+        self.message_class = message_class
+        mapping = dict(fields or {})
+        model_fields = model._meta.fields
+        object_id_fields = {
+            f.object_id_name: f for f in model_fields.values() if isinstance(f, peewee.ForeignKeyField)
+        }
+
+        plan = []
+        for fd in message_class.DESCRIPTOR.fields:
+            field = mapping.get(fd.name, fd.name)
+            if isinstance(field, str):
+                field = model_fields.get(field) or object_id_fields.get(field)
+            if field is None:
+                if fd.name in mapping:
+                    raise ValueError('Unknown field "%s" for %s.' % (mapping[fd.name], model.__name__))
+                continue
+
+            setter = _build_setter(fd, field)
+            if setter is None:
+                if fd.name in mapping:
+                    raise ValueError('Cannot map %s.%s to message field "%s".' % (model.__name__, field.name, fd.name))
+                continue
+            plan.append((field, setter))
+        self.plan = tuple(plan)
+
+    def to_message(self, obj, message=None):
+        # obj 可以是模型实例或 .compact() 行对象
+        message = self.message_class() if message is None else message
+        data = obj.__data__ if isinstance(obj, peewee.Model) else None
+        for field, setter in self.plan:
+            # 直接读取字典，惰性 JSON 的原始文本不必解码
+            value = dict.get(data, field.name) if data is not None else getattr(obj, field.name, None)
+            if value is not None:
+                setter(message, value)
+        return message
+
+    def _row_plan(self, query):
+        # 按 select 的列位置取值，Field 重载了 ==，用 id 比较
+        indexes = {}
+        for index, node in enumerate(query._returning):
+            indexes.setdefault(id(node), index)
+        return tuple((indexes[id(field)], setter) for field, setter in self.plan if id(field) in indexes)
+
+    @staticmethod
+    def _fill_row(message, row, plan):
+        for index, setter in plan:
+            value = row[index]
+            if value is not None:
+                setter(message, value)
+        return message
+
+    def fill(self, repeated, query):
+        # 直接用游标行填充 repeated 消息字段，不构造模型实例，返回填充的行数
+        plan = self._row_plan(query)
+        database = query._database or self.model._meta.database
+        cursor = cache.execute_select(
+            query, database, getattr(query, '_cached', False), getattr(query, '_cache_ttl', None)
+        )
+        try:
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        add, fill_row = repeated.add, self._fill_row
+        for row in rows:
+            fill_row(add(), row, plan)
+        return len(rows)
+
+    def iter_messages(self, query, chunk_size=1000, key=None, server_side=False):
+        # 分批返回消息列表，用于服务端流式 RPC
+        plan = self._row_plan(query)
+        message_class, fill_row = self.message_class, self._fill_row
+        for rows in stream.iter_chunks(query, chunk_size, key, server_side, raw=True):
+            yield [fill_row(message_class(), row, plan) for row in rows]
+
+
+_mappers = {}
+_mappers_lock = threading.Lock()
+
+
+def get_mapper(model, message_class, fields=None):
+    # 映射关系按 (模型, 消息类型, fields) 缓存，只计算一次
+    key = (model, message_class, tuple(sorted(
+        (name, field if isinstance(field, str) else id(field)) for name, field in (fields or {}).items()
+    )))
+    mapper = _mappers.get(key)
+    if mapper is None:
+        with _mappers_lock:
+            mapper = _mappers.get(key)
+            if mapper is None:
+                mapper = _mappers[key] = MessageMapper(model, message_class, fields)
+    return mapper
@@ -0,0 +1,119 @@
+"""
+读写分离
+"""
+import time
+import itertools
+import threading
+import contextvars
+
+import peewee
+
+__all__ = [
+    "ReplicaRouter",
+    "ReplicaRoutingMixin",
+    "start_pins",
+    "end_pins",
+]
+
+# 请求级的 {ReplicaRouter: 最近写入时间}，由中间件在请求开始时创建，
+# 线程池中执行的 aio_* 调用复制上下文后共享同一个字典，写入后的读取同样走主库
+_pins = contextvars.ContextVar('peeweext_replica_pins', default=None)
+# 请求之外没有结束时机，read_your_writes 为 None 时写入后读主库的时间窗口(秒)
+UNSCOPED_READ_YOUR_WRITES = 5
+
+
+class _UnscopedPins(dict):
+    # 请求之外(脚本、Celery 任务等)在当前上下文中创建的标记
+    pass
+
+
+def start_pins():
+    return _pins.set({})
+
+
+def end_pins(token):
+    _pins.reset(token)
+
+
+class ReplicaRouter:
+    strategies = ('round_robin', 'least_busy')
+
+    def __init__(self, replicas, strategy='round_robin', read_your_writes=None):
+        if strategy not in self.strategies:
+            raise ValueError('Unknown replica strategy: "%s".' % strategy)
+
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        # 写入后读主库的时间窗口(秒)，None 表示直到请求结束(请求之外为 UNSCOPED_READ_YOUR_WRITES)，0 表示不启用
+        self.read_your_writes = read_your_writes
+        self._cycle = itertools.cycle(range(len(self.replicas)))
+        self._in_flight = [0] * len(self.replicas)
+        self._lock = threading.Lock()
+
+    def choose(self):
+        with self._lock:
+            if self.strategy == 'round_robin':
+                return next(self._cycle)
+            return min(range(len(self.replicas)), key=self._in_flight.__getitem__)
+
+    def execute(self, query, *args, **kwargs):
+        index = self.choose()
+        with self._lock:
+            self._in_flight[index] += 1
+        try:
+            return self.replicas[index].execute(query, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._in_flight[index] -= 1
+
+    def mark_write(self):
+        if self.read_your_writes != 0:
+            pins = _pins.get()
+            if pins is None:
+                # 请求之外在当前上下文(线程)中记录，由 Celery task_postrun 或时间窗口清除
+                pins = _UnscopedPins()
+                _pins.set(pins)
+            pins[self] = time.time()
+
+    def pinned(self):
+        pins = _pins.get()
+        last_write = pins.get(self) if pins else None
+        if last_write is None:
+            return False
+        window = self.read_your_writes
+        if window is None:
+            if type(pins) is not _UnscopedPins:
+                return True
+            window = UNSCOPED_READ_YOUR_WRITES
+        if time.time() - last_write < window:
+            return True
+        pins.pop(self, None)
+        return False
+
+    def release(self):
+        pins = _pins.get()
+        if pins:
+            pins.pop(self, None)
+        self.close()
+
+    def close(self):
+        # 只关闭当前线程的从库连接，不影响写入后读主库
+        for replica in self.replicas:
+            if not replica.is_closed():
+                replica.close()
+
+
+class ReplicaRoutingMixin:
+    replica_router = None
+
+    def execute(self, query, *args, **kwargs):
+        router = self.replica_router
+        if router is None:
+            return super().execute(query, *args, **kwargs)
+
+        if isinstance(query, peewee.SelectBase) and not getattr(query, '_for_update', None):
+            if not self.in_transaction() and not router.pinned():
+                return router.execute(query, *args, **kwargs)
+        else:
+            router.mark_write()
+        return super().execute(query, *args, **kwargs)
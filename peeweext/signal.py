@@ -5,3 +5,7 @@ post_save = signal('post_save')
 pre_delete = signal('pre_delete')
 post_delete = signal('post_delete')
 pre_init = signal('pre_init')
+pre_bulk_save = signal('pre_bulk_save')
+post_bulk_save = signal('post_bulk_save')
+pre_bulk_delete = signal('pre_bulk_delete')
+post_bulk_delete = signal('post_bulk_delete')
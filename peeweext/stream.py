@@ -0,0 +1,131 @@
+"""
+大结果集分批遍历
+"""
+import uuid
+import operator
+
+import peewee
+from peewee import ROW
+from peeweext import aio
+from peeweext.cache import CachedCursor
+
+__all__ = [
+    "iter_chunks",
+    "aio_iter_chunks",
+]
+
+
+def _key_getter(query, key, raw=False):
+    # 从不同行类型的结果中取出 keyset 的值，raw 为未经转换的游标行
+    if not any(field is key for field in query._returning):
+        raise ValueError('Key field "%s" must be selected by the query.' % key.name)
+
+    row_type = query._row_type or ROW.MODEL
+    if row_type == ROW.DICT and not raw:
+        return operator.itemgetter(key.name)
+    if row_type in (ROW.TUPLE, ROW.NAMED_TUPLE) or raw:
+        index = next(i for i, field in enumerate(query._returning) if field is key)
+        return operator.itemgetter(index)
+    return lambda row: row.__data__.get(key.name)
+
+
+def _fetch_chunk(query, key, last, chunk_size, database, raw=False):
+    # 直接执行，不经过查询缓存和请求级身份映射，避免大量结果常驻内存
+    chunk = query.order_by(key).limit(chunk_size)
+    if last is not None:
+        chunk = chunk.where(key > last)
+    cursor = database.execute(chunk)
+    if raw:
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+    return list(chunk._get_cursor_wrapper(cursor))
+
+
+def _server_side_cursor(database):
+    # 返回 (游标, 独立连接)，独立连接由调用方归还
+    if isinstance(database, peewee.PostgresqlDatabase):
+        # 命名游标即服务端游标，只在事务内有效
+        return database.connection().cursor(name='peeweext_%s' % uuid.uuid4().hex), None
+    if isinstance(database, peewee.MySQLDatabase):
+        # SSCursor 读完之前所在连接不能执行其他查询(Commands out of sync)，使用独立连接，
+        # 遍历期间仍可以在当前连接上查询，如懒加载外键
+        conn = database._connect()
+        database._initialize_connection(conn)
+        return conn.cursor(peewee.mysql.cursors.SSCursor), conn
+    # sqlite 的游标本身按需读取
+    return database.cursor(), None
+
+
+def _fetch_server_side(query, chunk_size, database, raw=False):
+    sql, params = database.get_sql_context().sql(query).query()
+    cursor, conn = _server_side_cursor(database)
+    try:
+        cursor.execute(sql, params or ())
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if raw:
+                yield list(rows)
+                continue
+            description = tuple((column[0],) for column in cursor.description)
+            yield list(query._get_cursor_wrapper(CachedCursor(description, tuple(rows))))
+    finally:
+        cursor.close()
+        if conn is not None:
+            database._close(conn)
+
+
+def _server_side_chunks(query, chunk_size, database, raw=False):
+    if isinstance(database, peewee.PostgresqlDatabase):
+        # 在事务中打开命名游标；withhold 游标在自动提交模式下会让服务端先物化整个结果集
+        with database.atomic():
+            yield from _fetch_server_side(query, chunk_size, database, raw)
+        return
+    yield from _fetch_server_side(query, chunk_size, database, raw)
+
+
+def iter_chunks(query, chunk_size=1000, key=None, server_side=False, raw=False):
+    # 按 key(默认主键)的 keyset 分批返回行列表，server_side 为 True 时改为单条查询 + 服务端游标；
+    # raw 为 True 时返回未经字段转换的游标行(按 select 的列顺序)；
+    # 提前停止迭代或 RPC 取消时(生成器被关闭)释放游标与本函数打开的连接
+    model = query.model
+    key = key or model._meta.primary_key
+    database = query._database or model._meta.database
+    get_key = _key_getter(query, key, raw)
+
+    opened = database.connect(reuse_if_open=True)
+    try:
+        if server_side:
+            yield from _server_side_chunks(query, chunk_size, database, raw)
+            return
+
+        last = None
+        while True:
+            rows = _fetch_chunk(query, key, last, chunk_size, database, raw)
+            if rows:
+                yield rows
+            if len(rows) < chunk_size:
+                break
+            last = get_key(rows[-1])
+    finally:
+        if opened and not database.is_closed():
+            database.close()
+
+
+async def aio_iter_chunks(query, chunk_size=1000, key=None):
+    # keyset 分批天然可以从中断处继续，每批在线程池中独立获取和归还连接
+    model = query.model
+    key = key or model._meta.primary_key
+    database = query._database or model._meta.database
+    get_key = _key_getter(query, key)
+
+    last = None
+    while True:
+        rows = await aio.run_sync(database, _fetch_chunk, query, key, last, chunk_size, database)
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            break
+        last = get_key(rows[-1])
@@ -56,5 +56,8 @@ setup(
     packages=find_packages(exclude=['tests']),
     package_data={'peeweext': find_package_data('peeweext')},
     python_requires='>=3',
-    install_requires=requirements
+    install_requires=requirements,
+    extras_require={
+        'protobuf': ['protobuf'],
+    }
 )
@@ -1,9 +1,14 @@
 from binwen.servicer import ServicerMeta
 from extensions import db
+from vip.models import Note
 
 
 class VipServicer(metaclass=ServicerMeta):
 
     def return_normal(self, request, context):
+        Note.select().count()
         return not db.database.is_closed()
 
+    def return_lazy(self, request, context):
+        return db.database.is_closed()
+
@@ -0,0 +1,33 @@
+import pytest
+from peeweext.binwen import PeeweeExt
+
+
+@pytest.fixture
+def make_ext(tmp_path):
+    # make_ext(alias='default', **数据库配置) 创建并初始化 PeeweeExt，
+    # 未指定 DB_URL 时使用临时目录中的 sqlite 文件；测试结束时关闭连接(包括连接池)
+    exts = []
+
+    def make(alias='default', **db_config):
+        db_config.setdefault('DB_URL', 'sqlite:///%s' % (tmp_path / ('%s%s.db' % (alias, len(exts)))))
+
+        class App:
+            config = dict(DATABASES={alias: db_config})
+
+        ext = PeeweeExt(alias)
+        ext.init_app(App())
+        exts.append(ext)
+        return ext
+
+    yield make
+    for ext in exts:
+        ext.close_db()
+        close_all = getattr(ext.database, 'close_all', None)
+        if close_all is not None:
+            close_all()
+
+
+@pytest.fixture
+def ext(request, make_ext):
+    # 数据库配置通过间接参数化传入：@pytest.mark.parametrize('ext', [dict(INSTRUMENT=True)], indirect=True)
+    return make_ext(**getattr(request, 'param', {}))
@@ -0,0 +1,170 @@
+import time
+import asyncio
+import threading
+
+import grpc
+import pytest
+import peeweext
+from peeweext.binwen import PeeweeExtMiddleware
+from peeweext import admission, aio
+from peeweext.admission import AdmissionController
+from peeweext.exceptions import AdmissionRejected
+
+ADMISSION_DB = dict(ADMISSION=dict(MAX_IN_FLIGHT=1, MAX_QUEUE=0))
+
+
+def test_admission_queue():
+    controller = AdmissionController(max_in_flight=1, max_queue=1)
+    controller.acquire()
+
+    order = []
+
+    def wait():
+        controller.acquire(5)
+        order.append('waiter')
+        controller.release(0.01)
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    while controller.stats()['queue_depth'] == 0:
+        time.sleep(0.001)
+
+    # 队列已满
+    with pytest.raises(AdmissionRejected, match='queue full'):
+        controller.acquire(5)
+    order.append('holder')
+    controller.release(0.01)
+    thread.join()
+
+    assert order == ['holder', 'waiter']
+    stats = controller.stats()
+    assert stats['in_flight'] == 0
+    assert stats['queue_depth'] == 0
+    assert stats['admitted'] == 2
+    assert stats['rejected'] == {'queue_full': 1, 'deadline': 0, 'timeout': 0}
+    assert stats['wait_time'] > 0
+
+
+def test_admission_timeout():
+    controller = AdmissionController(max_in_flight=1, max_queue=5, max_wait=0.02)
+    controller.acquire()
+    with pytest.raises(AdmissionRejected, match='timeout'):
+        controller.acquire()
+
+    # 预计等待时间超过剩余时间时不排队
+    controller.service_time = 1.0
+    with pytest.raises(AdmissionRejected, match='deadline'):
+        controller.acquire(0.5)
+    controller.release()
+    controller.acquire(0.5)
+    assert controller.stats()['rejected'] == {'queue_full': 0, 'deadline': 1, 'timeout': 1}
+    assert controller.stats()['queue_depth'] == 0
+
+    text = admission.exposition([controller])
+    assert 'peeweext_admission_rejected_total{alias="default",reason="timeout"} 1' in text
+    assert 'peeweext_admission_in_flight{alias="default"} 1' in text
+
+
+def test_aio_admission():
+    controller = AdmissionController(max_in_flight=2, max_queue=10)
+    running = []
+
+    async def work(i):
+        await controller.aio_acquire(5)
+        running.append(controller.in_flight)
+        await asyncio.sleep(0.01)
+        controller.release(0.01)
+
+    async def main():
+        await asyncio.gather(*[work(i) for i in range(6)])
+        await controller.aio_acquire()
+        await controller.aio_acquire()
+        waiter = asyncio.ensure_future(controller.aio_acquire())
+        await asyncio.sleep(0.01)
+        assert controller.stats()['queue_depth'] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        controller.release()
+        controller.release()
+
+    asyncio.run(main())
+    assert max(running) == 2
+    stats = controller.stats()
+    assert stats['admitted'] == 8
+    assert stats['in_flight'] == stats['queue_depth'] == 0
+
+
+class Context:
+    code = None
+
+    def time_remaining(self):
+        return 0.05
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+
+@pytest.mark.parametrize('ext', [ADMISSION_DB], indirect=True)
+def test_middleware_admission(ext):
+    class App:
+        config = {}
+        extensions = {'db': ext}
+
+    class Note(ext.Model):
+        message = peeweext.TextField()
+
+    Note.create_table()
+    ext.close_db()
+    inner = []
+
+    def query(servicer, request, context):
+        return Note.select().count()
+
+    def no_query(servicer, request, context):
+        return 'ok'
+
+    def handler(servicer, request, context):
+        # 第一次查询时占用名额，占用期间使用数据库的请求被拒绝，不使用数据库的请求不受影响
+        assert ext.admission_stats['in_flight'] == 0
+        Note.select().count()
+        assert ext.admission_stats['in_flight'] == 1
+        for inner_handler in (no_query, query):
+            context = Context()
+            inner.append((PeeweeExtMiddleware(App(), inner_handler, inner_handler)(None, None, context), context.code))
+        return 'ok'
+
+    middleware = PeeweeExtMiddleware(App(), handler, handler)
+    assert middleware(None, None, Context()) == 'ok'
+    assert inner[0] == ('ok', None)
+    assert inner[1][1] == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert ext.admission_stats['in_flight'] == 0
+    assert ext.admission_stats['admitted'] == 1
+    assert ext.admission_stats['rejected']['queue_full'] == 1
+
+
+@pytest.mark.parametrize('ext', [ADMISSION_DB], indirect=True)
+def test_aio_lazy_admission(ext):
+
+    class Note(ext.Model):
+        message = peeweext.TextField()
+
+    Note.create_table()
+    ext.close_db()
+
+    async def request(queries):
+        token = admission.start_request()
+        try:
+            # 同一请求的并发查询只占用一个名额
+            await asyncio.gather(*[aio.count(Note.select()) for _ in range(queries)])
+            return ext.admission_stats['in_flight']
+        finally:
+            admission.end_request(token)
+
+    assert asyncio.run(request(0)) == 0
+    assert asyncio.run(request(3)) == 1
+    assert ext.admission_stats['in_flight'] == 0
+    assert ext.admission_stats['admitted'] == 1
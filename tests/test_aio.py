@@ -0,0 +1,185 @@
+import asyncio
+from io import StringIO
+
+import grpc
+import pytest
+import peeweext
+from peeweext import aio, signal
+from peeweext.binwen import AsyncPeeweeExtMiddleware
+from peeweext.exceptions import ValidationError
+
+
+@pytest.fixture
+def Note(ext):
+    class Note(ext.TimeStampedModel):
+        message = peeweext.TextField()
+
+        def validate_message(self, value):
+            if value == 'raise error':
+                raise ValidationError
+
+    Note.create_table()
+    ext.close_db()
+    yield Note
+    Note.drop_table()
+
+
+def test_aio_model(Note):
+    out = StringIO()
+
+    def post_save(sender, instance, created):
+        out.write('post_save %s;' % created)
+
+    def post_delete(sender, instance):
+        out.write('post_delete;')
+
+    signal.post_save.connect(post_save, sender=Note)
+    signal.post_delete.connect(post_delete, sender=Note)
+
+    async def run():
+        note = await Note.aio_create(message='Hello')
+        updated_at = note.updated_at
+        await note.aio_update_with(message='Hello world')
+        assert note.updated_at > updated_at
+
+        note = await Note.aio_get_by_id(note.id)
+        assert note.message == 'Hello world'
+        assert (await Note.aio_get(message='Hello world')).id == note.id
+
+        note.message = 'raise error'
+        with pytest.raises(ValidationError):
+            await note.aio_save()
+
+        await note.aio_delete_instance()
+        assert await aio.count(Note.select()) == 0
+
+    asyncio.run(run())
+    assert out.getvalue() == 'post_save True;post_save False;post_delete;'
+    assert Note._meta.database.is_closed()
+
+
+def test_aio_create_filter_attrs(Note):
+    class GuardedNote(Note):
+        secret = peeweext.IntegerField(default=0)
+
+        class Meta:
+            table_name = 'guarded_note'
+            protected_fields = ['secret']
+
+    GuardedNote.create_table()
+    try:
+        # 与 create() 一样过滤受保护的字段
+        created = GuardedNote.create(message='sync', secret=1)
+        aio_created = asyncio.run(GuardedNote.aio_create(message='async', secret=1))
+        assert GuardedNote.get_by_id(created.id).secret == GuardedNote.get_by_id(aio_created.id).secret == 0
+    finally:
+        GuardedNote.drop_table()
+
+
+def test_aio_execute(Note):
+    async def run():
+        await asyncio.gather(*[Note.aio_create(message='Note %s' % i) for i in range(10)])
+        rows = await aio.execute(Note.select().order_by(Note.id))
+        assert len(rows) == 10
+
+        updated = await aio.execute(Note.update(message='Hello').where(Note.id <= 5))
+        assert updated == 5
+        note = await aio.get(Note.select().where(Note.message == 'Hello').order_by(Note.id))
+        assert note.id == 1
+
+    asyncio.run(run())
+
+
+def test_get_executor():
+    executor = aio.setup_executor(2)
+    try:
+        assert aio.get_executor() is aio.get_executor(2) is executor
+        # 已创建的线程池不会静默忽略不同的 max_workers
+        with pytest.raises(ValueError, match='max_workers=2'):
+            aio.get_executor(3)
+    finally:
+        aio.setup_executor()
+
+
+def test_aio_async_validator(Note):
+    loops = []
+
+    class CheckedNote(Note):
+        async def validate_message(self, value):
+            # 异步校验器在调用方的事件循环中执行
+            loops.append(asyncio.get_running_loop())
+            if value == 'raise error':
+                raise ValidationError
+
+        class Meta:
+            table_name = 'checked_note'
+
+    CheckedNote.create_table()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        note = await CheckedNote.aio_create(message='Hello')
+        await note.aio_update_with(message='Hello world')
+        with pytest.raises(ValidationError):
+            await note.aio_update_with(message='raise error')
+
+        await CheckedNote.aio_bulk_create([{'message': 'n1'}, CheckedNote(message='n2')])
+        notes = await aio.execute(CheckedNote.select().where(CheckedNote.id > note.id))
+        for n in notes:
+            n.message = n.message.upper()
+        assert await CheckedNote.aio_bulk_update(notes, ['message']) == 2
+        with pytest.raises(ValidationError):
+            await CheckedNote.aio_bulk_create([{'message': 'raise error'}])
+        with pytest.raises(RuntimeError):
+            CheckedNote.bulk_create([{'message': 'n3'}])
+        assert set(loops) == {loop}
+        return [n.message for n in await aio.execute(CheckedNote.select().order_by(CheckedNote.id))]
+
+    try:
+        assert asyncio.run(run()) == ['Hello world', 'N1', 'N2']
+    finally:
+        CheckedNote.drop_table()
+
+
+class Context:
+    code = details = None
+
+    def time_remaining(self):
+        return None
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+
+def test_async_middleware(ext):
+    class App:
+        config = {}
+        extensions = {'db': ext}
+
+    class Note(ext.Model):
+        message = peeweext.TextField()
+
+    Note.create_table()
+    ext.close_db()
+
+    async def get(servicer, request, context):
+        return await Note.aio_get_by_id(request)
+
+    async def fail(servicer, request, context):
+        raise RuntimeError('boom')
+
+    async def main():
+        note = await Note.aio_create(message='Hello')
+        middleware = AsyncPeeweeExtMiddleware(App(), get, get)
+        # 同步与异步中间件共用相同的异常映射
+        assert (await middleware(None, note.id, Context())).message == 'Hello'
+        context = Context()
+        await middleware(None, 100, context)
+        assert (context.code, context.details) == (grpc.StatusCode.NOT_FOUND, 'Record Not Found')
+        with pytest.raises(RuntimeError):
+            await AsyncPeeweeExtMiddleware(App(), fail, fail)(None, None, Context())
+
+    asyncio.run(main())
@@ -17,5 +17,7 @@ def test_binwen():
     stub = Stub(servicerclass())
     assert stub.return_normal(None)
     assert db.database.is_closed()
+    assert stub.return_lazy(None)
+    assert db.database.is_closed()
 
     Note.drop_table()
@@ -0,0 +1,199 @@
+import threading
+
+import pytest
+import peeweext
+from peeweext import cache
+from peeweext.cache import LRUCache
+
+
+@pytest.fixture
+def cache_db(make_ext, monkeypatch):
+    db = make_ext(QUERY_CACHE=dict(MAXSIZE=100, TTL=60))
+
+    class User(db.Model):
+        name = peeweext.TextField()
+        profile = peeweext.JSONTextField(default={})
+
+        class Meta:
+            cache_ttl = 60
+
+    class Note(db.Model):
+        user = peeweext.ForeignKeyField(User)
+        message = peeweext.TextField()
+
+    User.create_table()
+    Note.create_table()
+
+    sqls = []
+    execute_sql = db.database.execute_sql
+
+    def record(sql, *args, **kwargs):
+        sqls.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    monkeypatch.setattr(db.database, 'execute_sql', record)
+    return db, User, Note, sqls
+
+
+def test_get_by_id_cache(cache_db):
+    db, User, Note, sqls = cache_db
+    user = User.create(name='u1', profile={'a': 1})
+    del sqls[:]
+
+    assert User.get_by_id(user.id).name == 'u1'
+    cached = User.get_by_id(str(user.id))
+    assert cached.name == 'u1'
+    assert len(sqls) == 1
+    # 命中时每次构造新的实例
+    cached.profile['a'] = 2
+    assert User.get_by_id(user.id).profile == {'a': 1}
+
+    user.name = 'u2'
+    user.save()
+    assert User.get_by_id(user.id).name == 'u2'
+    User.update(name='u3').where(User.id == user.id).execute()
+    assert User.get_by_id(user.id).name == 'u3'
+    User.update(name='u4').execute()
+    assert User.get(name='u4').name == 'u4'
+    assert User.get_by_id(user.id).name == 'u4'
+
+    del sqls[:]
+    User.get(name='u4')
+    assert sqls == []
+
+    user.delete_instance()
+    with pytest.raises(User.DoesNotExist):
+        User.get_by_id(user.id)
+    with pytest.raises(User.DoesNotExist):
+        User.get(name='u4')
+
+    with db.database.atomic():
+        del sqls[:]
+        User.create(name='u5')
+        User.get(name='u5')
+        User.get(name='u5')
+        assert len(sqls) == 3
+
+
+def test_invalidate_after_commit(cache_db):
+    db, User, Note, sqls = cache_db
+    user = User.create(name='old')
+
+    def read():
+        # 事务未提交时其他线程读到旧数据并写入缓存
+        assert User.get_by_id(user.id).name == 'old'
+        assert User.get(User.name == 'old').id == user.id
+        db.database.close()
+
+    with db.database.atomic():
+        user.name = 'new'
+        user.save()
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+    assert User.get_by_id(user.id).name == 'new'
+    with pytest.raises(User.DoesNotExist):
+        User.get(User.name == 'old')
+
+    # 回滚时不保留待失效的记录
+    with pytest.raises(ValueError):
+        with db.database.atomic():
+            User.update(name='rollback').where(User.id == user.id).execute()
+            raise ValueError
+    assert getattr(db.database._state, 'cache_invalidations', None) is None
+    assert User.get_by_id(user.id).name == 'new'
+
+
+def test_cached_select(cache_db):
+    db, User, Note, sqls = cache_db
+    user = User.create(name='u1')
+    Note.create(user=user, message='n1')
+    query = Note.select(Note, User).join(User).where(User.name == 'u1').cached()
+    del sqls[:]
+
+    assert [n.message for n in query.clone()] == ['n1']
+    assert [n.user.name for n in query.clone()] == ['u1']
+    assert len(sqls) == 1
+
+    Note.create(user=user, message='n2')
+    assert len(list(query.clone())) == 2
+    user.name = 'u2'
+    user.save()
+    assert list(query.clone()) == []
+
+    users = User.select().where(User.name == 'u1').cached()
+    assert list(users.clone()) == []
+    User.bulk_create([dict(name='u1')])
+    assert len(list(users.clone())) == 1
+
+
+def test_lru_cache(monkeypatch):
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+    import time
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    assert cache.get('a') is None
+    cache.set('d', 4, ttl=0)
+    assert cache.get('d') == 4
+
+
+def test_identity_map(make_ext, monkeypatch):
+    db = make_ext(IDENTITY_MAP=True)
+
+    class User(db.Model):
+        name = peeweext.TextField()
+
+    User.create_table()
+    user = User.create(name='u1')
+
+    sqls = []
+    execute_sql = db.database.execute_sql
+
+    def record(sql, *args, **kwargs):
+        sqls.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    monkeypatch.setattr(db.database, 'execute_sql', record)
+
+    # 未开启时每次都查询
+    assert User.get_by_id(user.id) is not User.get_by_id(user.id)
+    assert len(sqls) == 2
+
+    token = cache.start_identity_map()
+    try:
+        del sqls[:]
+        u1 = User.get_by_id(user.id)
+        assert User.get_by_id(str(user.id)) is u1
+        assert User.get(name='u1').id == u1.id
+        assert User.get(name='u1').id == u1.id
+        assert len(sqls) == 2
+
+        u1.name = 'u2'
+        u1.save()
+        assert User.get_by_id(user.id) is u1
+        with pytest.raises(User.DoesNotExist):
+            User.get(name='u1')
+
+        User.update(name='u3').execute()
+        assert User.get_by_id(user.id) is not u1
+        assert User.get_by_id(user.id).name == 'u3'
+
+        with db.database.atomic():
+            del sqls[:]
+            User.get(name='u3')
+            User.get(name='u3')
+            assert len(sqls) == 2
+
+        User.get_by_id(user.id).delete_instance()
+        with pytest.raises(User.DoesNotExist):
+            User.get_by_id(user.id)
+    finally:
+        cache.end_identity_map(token)
+    assert cache.get_identity_map(db.database) is None
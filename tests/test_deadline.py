@@ -0,0 +1,166 @@
+import time
+import threading
+
+import grpc
+import pytest
+import peeweext
+from playhouse.psycopg3_ext import Psycopg3Database
+from playhouse.pool import PooledMySQLDatabase
+from peeweext.database import compose
+from peeweext.binwen import PeeweeExtMiddleware
+from peeweext import deadline
+from peeweext.exceptions import DeadlineExceeded
+
+# 足够慢的 sqlite 查询，截止时间生效时才能很快结束
+SLOW_SQL = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 100000000) SELECT count(*) FROM c'
+
+
+@pytest.fixture
+def deadline_db(make_ext):
+    db = make_ext(PROPAGATE_DEADLINE=True)
+
+    class Note(db.Model):
+        message = peeweext.TextField()
+
+    Note.create_table()
+    return db, Note
+
+
+class Context:
+    def __init__(self, remaining=None):
+        self.remaining = remaining
+        self.callbacks = []
+        self.code = None
+        self.details = None
+
+    def time_remaining(self):
+        return self.remaining
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+        return True
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+
+def test_statement_timeout(deadline_db):
+    db, Note = deadline_db
+    token = deadline.start_deadline(0.05)
+    try:
+        assert Note.select().count() == 0
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            db.database.execute_sql(SLOW_SQL)
+        assert time.monotonic() - start < 1
+        # 截止时间已过，后续语句不再执行
+        with pytest.raises(DeadlineExceeded, match='before executing'):
+            Note.select().count()
+    finally:
+        deadline.end_deadline(token)
+
+    # 截止时间之外遗留在连接上的进度回调不影响其他语句
+    assert Note.select().count() == 0
+
+
+def test_cancel(deadline_db):
+    db, Note = deadline_db
+    context = Context()
+    token = deadline.start_deadline(None, context)
+    try:
+        timer = threading.Timer(0.05, context.callbacks[0])
+        timer.start()
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            db.database.execute_sql(SLOW_SQL)
+        assert time.monotonic() - start < 1
+    finally:
+        deadline.end_deadline(token)
+    assert deadline.get_deadline() is None
+
+
+def test_middleware_deadline(deadline_db):
+    db, Note = deadline_db
+
+    class App:
+        extensions = {'db': db}
+        config = {}
+
+    def slow(servicer, request, context):
+        return db.database.execute_sql(SLOW_SQL).fetchone()
+
+    middleware = PeeweeExtMiddleware(App(), slow, slow)
+    context = Context(0.05)
+    middleware(None, None, context)
+    assert context.code == grpc.StatusCode.DEADLINE_EXCEEDED
+    # 正常结束后的回调不再取消
+    context = Context(10)
+    middleware = PeeweeExtMiddleware(App(), lambda *args: Note.select().count(), slow)
+    assert middleware(None, None, context) == 0
+    context.callbacks[0]()
+    assert context.code is None
+
+
+class Cursor:
+    def __init__(self, sqls):
+        self.sqls = sqls
+
+    def execute(self, sql):
+        self.sqls.append(sql)
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self):
+        self.sqls = []
+
+    def cursor(self):
+        return Cursor(self.sqls)
+
+
+class Psycopg2Connection(Connection):
+    pass
+
+
+Psycopg2Connection.__module__ = 'psycopg2.extensions'
+
+
+def test_postgres_statement_timeout():
+    database = compose(Psycopg3Database, [deadline.DeadlineMixin])('test')
+    conn = Connection()
+    # psycopg3 不接受多条语句，单独设置，取整后不变时不重复设置
+    assert database.apply_timeout(conn, 'SELECT 1', deadline.Deadline(1)) == 'SELECT 1'
+    assert database.apply_timeout(conn, 'SELECT 2', deadline.Deadline(0.99)) == 'SELECT 2'
+    assert conn.sqls == ['SET statement_timeout = 1000']
+    database._state.conn = conn
+    database._state.closed = False
+    assert database._reset_timeout('SELECT 3') == 'SELECT 3'
+    assert database._reset_timeout('SELECT 4') == 'SELECT 4'
+    assert conn.sqls == ['SET statement_timeout = 1000', 'SET statement_timeout = 0']
+
+    conn = database._state.conn = Psycopg2Connection()
+    assert database.apply_timeout(conn, 'SELECT 1', deadline.Deadline(1)).startswith('SET statement_timeout = ')
+    assert database._reset_timeout('SELECT 2') == 'SET statement_timeout = 0; SELECT 2'
+    assert database._reset_timeout('SELECT 3') == 'SELECT 3'
+    assert conn.sqls == []
+
+
+def test_mysql_interrupt(monkeypatch):
+    database = compose(PooledMySQLDatabase, [deadline.DeadlineMixin])('test', max_connections=1)
+    killer = Connection()
+    killer.close = lambda: killer.sqls.append('close')
+    monkeypatch.setattr(peeweext.deadline.peewee.MySQLDatabase, '_connect', lambda self: killer)
+
+    class Running:
+        def thread_id(self):
+            return 42
+
+    # KILL QUERY 使用的连接不占用连接池名额
+    database.interrupt(Running())
+    assert killer.sqls == ['KILL QUERY 42', 'close']
+    assert database._in_use == {}
@@ -1,7 +1,11 @@
+import json
 import pytest
 import datetime
+import pendulum
 import peeweext
+from playhouse.shortcuts import model_to_dict
 from peeweext.binwen import PeeweeExt
+from peeweext.fields import parse_datetime, parse_native_datetime, JSONCodec, get_json_codec
 
 
 class App:
@@ -15,6 +19,7 @@ db.init_app(app)
 
 class Note(db.Model):
     published_at = peeweext.DatetimeTZField(null=True)
+    native_published_at = peeweext.DatetimeTZField(null=True, native=True)
     content = peeweext.JSONTextField(default={})
     remark = peeweext.JSONTextField(null=True)
 
@@ -47,7 +52,8 @@ def test_fields(table):
     note = Note.get_by_id(note.id)
     assert note.content == [1, 2]
     assert note.published_at.in_tz(tz="Asia/Shanghai").to_datetime_string() == "2019-03-24 17:49:14"
-    assert note.published_at.in_tz(tz="Asia/Shanghai").format("YYYY-MM-DD HH:mm:ss.SSSSSS") == "2019-03-24 17:49:14.353345"
+    published_at = note.published_at.in_tz(tz="Asia/Shanghai")
+    assert published_at.format("YYYY-MM-DD HH:mm:ss.SSSSSS") == "2019-03-24 17:49:14.353345"
 
     Note.update(content={'data': None}).where(Note.id == note.id).execute()
     note = Note.get_by_id(note.id)
@@ -55,3 +61,166 @@ def test_fields(table):
     query_note = Note.get(content={'data': None})
     assert query_note.content == {'data': None}
 
+
+@pytest.mark.parametrize('value', [
+    '2019-03-24 09:49:14.353345+00:00',
+    '2019-03-24 09:49:14+08:00',
+    '2019-03-24 09:49:14.353-05:30',
+    '2019-03-24 09:49:14',
+    '2019-03-24 09:49:14.353345',
+    '2019-03-24T09:49:14Z',
+    '2019-03-24T09:49:14.353345+00:00',
+    '2019-03-24',
+    '20190324T094914',
+])
+def test_parse_datetime(value):
+    expected = pendulum.parse(value)
+    got = parse_datetime(value)
+    assert isinstance(got, pendulum.DateTime)
+    assert got == expected
+    assert got.utcoffset() == expected.utcoffset()
+    assert got.timezone_name == expected.timezone_name
+
+    native = parse_native_datetime(value)
+    assert not isinstance(native, pendulum.DateTime)
+    assert native == expected
+    assert native.utcoffset() == expected.utcoffset()
+
+
+def test_datetime_python_value():
+    field = Note.published_at
+    for value in [
+        datetime.datetime(2019, 3, 24, 9, 49, 14, 353345),
+        datetime.datetime(2019, 3, 24, 9, 49, 14, tzinfo=datetime.timezone(datetime.timedelta(hours=8))),
+        datetime.datetime(2019, 3, 24, 9, 49, 14, tzinfo=datetime.timezone.utc),
+        pendulum.datetime(2019, 3, 24, 9, 49, 14, tz='Asia/Shanghai'),
+    ]:
+        expected = pendulum.instance(value)
+        got = field.python_value(value)
+        assert isinstance(got, pendulum.DateTime)
+        assert got == expected
+        assert got.timezone_name == expected.timezone_name
+
+        native = Note.native_published_at.python_value(value)
+        assert native == expected
+        assert native.utcoffset() == expected.utcoffset()
+
+    assert field.python_value(None) is None
+
+
+def test_native_datetime_field(table):
+    dt = datetime.datetime.now(tz=datetime.timezone(datetime.timedelta(hours=8)))
+    note = Note.create(published_at=dt, native_published_at=dt)
+    note = Note.get_by_id(note.id)
+    assert isinstance(note.published_at, pendulum.DateTime)
+    assert type(note.native_published_at) is datetime.datetime
+    assert note.native_published_at == dt
+    assert note.native_published_at.utcoffset() == datetime.timedelta(0)
+
+
+def test_json_codec(table):
+    calls = []
+
+    def dumps(value):
+        calls.append('dumps')
+        return json.dumps(value, sort_keys=True)
+
+    def loads(value):
+        calls.append('loads')
+        return json.loads(value)
+
+    class CodecNote(Note):
+        custom = peeweext.JSONTextField(null=True, codec=JSONCodec(dumps, loads))
+        raw = peeweext.JSONTextField(null=True, raw=True)
+
+        class Meta:
+            table_name = 'codec_note'
+
+    CodecNote.create_table()
+    note = CodecNote.create(custom={'b': 1, 'a': 2}, raw='{"a": [1, 2]}')
+    assert db.database.execute_sql('SELECT custom FROM codec_note').fetchone()[0] == '{"a": 2, "b": 1}'
+    assert calls == ['dumps']
+    note = CodecNote.get_by_id(note.id)
+    assert note.custom == {'a': 2, 'b': 1}
+    assert calls == ['dumps', 'loads']
+    assert note.raw == '{"a": [1, 2]}'
+    note.raw = {'b': None}
+    note.save()
+    assert CodecNote.get_by_id(note.id).raw == '{"b": null}'
+    CodecNote.drop_table()
+
+    with pytest.raises(ValueError):
+        get_json_codec('unknown')
+    assert get_json_codec('auto').loads('[1]') == [1]
+
+
+def test_ext_json_codec():
+    orjson = pytest.importorskip('orjson')
+
+    class App:
+        config = dict(DATABASES={"default": {"DB_URL": "sqlite:///:memory:", "JSON_CODEC": "orjson"}})
+
+    ext = PeeweeExt()
+    ext.init_app(App())
+
+    class OrjsonNote(ext.Model):
+        content = peeweext.JSONTextField(default={})
+        remark = peeweext.JSONTextField(null=True, codec='json')
+
+    assert OrjsonNote.content.db_value({'a': 1}) == orjson.dumps({'a': 1}).decode()
+    assert OrjsonNote.remark.db_value({'a': 1}) == '{"a": 1}'
+    assert Note.content.db_value({'a': 1}) == '{"a": 1}'
+
+
+def test_lazy_json_field(table):
+    calls = []
+
+    def dumps(value):
+        calls.append('dumps')
+        return json.dumps(value)
+
+    def loads(value):
+        calls.append('loads')
+        return json.loads(value)
+
+    class LazyNote(Note):
+        detail = peeweext.JSONTextField(null=True, lazy=True, codec=JSONCodec(dumps, loads))
+
+        class Meta:
+            table_name = 'lazy_note'
+
+    LazyNote.create_table()
+    note = LazyNote.create(detail={'a': [1, 2]})
+    assert calls == ['dumps']
+    db.database.execute_sql("UPDATE lazy_note SET detail = '{\"a\":  [1,2]}'")
+
+    note = LazyNote.get_by_id(note.id)
+    assert calls == ['dumps']
+    note.save()
+    assert calls == ['dumps']
+    assert db.database.execute_sql('SELECT detail FROM lazy_note').fetchone()[0] == '{"a":  [1,2]}'
+
+    assert note.detail == {'a': [1, 2]}
+    assert note.detail == {'a': [1, 2]}
+    assert calls == ['dumps', 'loads']
+    note.detail['b'] = None
+    note.save()
+    assert calls == ['dumps', 'loads', 'dumps']
+    assert LazyNote.get_by_id(note.id).detail == {'a': [1, 2], 'b': None}
+    assert LazyNote.get(LazyNote.detail == {'a': [1, 2], 'b': None}).id == note.id
+
+    # 只有模型实例惰性解码，其他行类型立即解码
+    assert list(LazyNote.select(LazyNote.id, LazyNote.detail).dicts()) == [
+        {'id': note.id, 'detail': {'a': [1, 2], 'b': None}}
+    ]
+    assert list(LazyNote.select(LazyNote.detail).tuples()) == [({'a': [1, 2], 'b': None},)]
+    assert LazyNote.select(LazyNote.detail).namedtuples()[0].detail == {'a': [1, 2], 'b': None}
+    calls.clear()
+    loaded = LazyNote.get_by_id(note.id)
+    assert model_to_dict(loaded)['detail'] == {'a': [1, 2], 'b': None}
+    assert calls == ['loads']
+
+    note.detail = None
+    note.save()
+    assert LazyNote.get_by_id(note.id).detail is None
+    LazyNote.drop_table()
@@ -0,0 +1,133 @@
+import gc
+import asyncio
+
+import pytest
+import peeweext
+from peeweext import loader
+from peeweext.paginator import Paginator
+
+
+@pytest.fixture
+def models(make_ext, monkeypatch):
+    db = make_ext(CONN_OPTIONS=dict(check_same_thread=False))
+
+    class Author(db.Model):
+        name = peeweext.TextField()
+
+    class Note(db.Model):
+        author = peeweext.ForeignKeyField(Author, backref='notes')
+        message = peeweext.TextField()
+
+        class Meta:
+            batch_load = True
+
+    class Comment(db.Model):
+        note = peeweext.ForeignKeyField(Note, backref='comments')
+
+    db.database.create_tables([Author, Note, Comment])
+    for i in range(3):
+        author = Author.create(name='a%s' % i)
+        for j in range(2):
+            note = Note.create(author=author, message='n%s%s' % (i, j))
+            Comment.create(note=note)
+
+    sqls = []
+    execute_sql = db.database.execute_sql
+
+    def record(sql, *args, **kwargs):
+        sqls.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    monkeypatch.setattr(db.database, 'execute_sql', record)
+    return Author, Note, Comment, sqls
+
+
+def test_batch_foreign_key(models):
+    Author, Note, Comment, sqls = models
+    del sqls[:]
+    query = Note.select().order_by(Note.id)
+    names = [note.author.name for note in list(query)]
+    assert names == ['a0', 'a0', 'a1', 'a1', 'a2', 'a2']
+    assert len(sqls) == 2
+
+    # 只合并已取回的行，不为此取回整个结果集
+    del sqls[:]
+    query = Note.select().order_by(Note.id)
+    for note in query:
+        assert note.author.name == 'a0'
+        break
+    assert len(query._cursor_wrapper.row_cache) == 1
+    assert len(sqls) == 2
+
+    # iterator() 不缓存结果集，逐条加载
+    del sqls[:]
+    assert [note.author.name for note in Note.select().order_by(Note.id).iterator()] == names
+    assert len(sqls) == 7
+
+    # 实例只弱引用结果集
+    note = Note.select().order_by(Note.id)[0]
+    gc.collect()
+    assert note.__batch__() is None
+    del sqls[:]
+    assert note.author.name == 'a0'
+    assert len(sqls) == 1
+
+    # 默认不批量加载
+    del sqls[:]
+    query = Comment.select()
+    assert len([comment.note.message for comment in list(query)]) == 6
+    assert len(sqls) == 7
+
+
+def test_page_prefetch(models):
+    Author, Note, Comment, sqls = models
+    del sqls[:]
+    page = Paginator(Note.select().order_by(Note.id), 4).page(1).prefetch(Note.author, 'comments')
+    # count、当前页、author、comments
+    assert len(sqls) == 4
+    assert [note.author.name for note in page] == ['a0', 'a0', 'a1', 'a1']
+    assert [len(note.comments) for note in page] == [1, 1, 1, 1]
+    assert page[0].comments[0].note is page[0]
+    assert len(sqls) == 4
+
+    page = Paginator(Author.select().order_by(Author.id), 2).page(2).prefetch(Author.notes)
+    assert [[note.message for note in author.notes] for author in page] == [['n20', 'n21']]
+
+    with pytest.raises(ValueError):
+        page.prefetch('message')
+
+
+def test_aio_batch_get_by_id(models):
+    Author, Note, Comment, sqls = models
+
+    async def main():
+        del sqls[:]
+        authors = await asyncio.gather(*[Author.aio_get_by_id(pk) for pk in (1, 2, 1, 3)])
+        assert [author.name for author in authors] == ['a0', 'a1', 'a0', 'a2']
+        assert len(sqls) == 1
+
+        with pytest.raises(Author.DoesNotExist):
+            await Author.aio_get_by_id(100)
+
+    asyncio.run(main())
+
+
+def test_aio_batch_scope(models):
+    Author, Note, Comment, sqls = models
+
+    async def request(pks):
+        # 每个请求有独立的批量加载器，并发请求的查询不合并、不共享实例
+        token = loader.start_batch_loaders()
+        try:
+            return await asyncio.gather(*[Author.aio_get_by_id(pk) for pk in pks])
+        finally:
+            loader.end_batch_loaders(token)
+
+    async def main():
+        del sqls[:]
+        first, second = await asyncio.gather(request((1, 2)), request((1, 3)))
+        assert [author.name for author in first + second] == ['a0', 'a1', 'a0', 'a2']
+        assert first[0] is not second[0]
+        assert len(sqls) == 2
+
+    asyncio.run(main())
@@ -0,0 +1,170 @@
+import threading
+
+import pytest
+import peeweext
+from peeweext.binwen import PeeweeExtMiddleware
+from peeweext import metrics
+from peeweext.exceptions import QueryBudgetExceeded, QueryBudgetWarning
+from peeweext.metrics import QueryMetrics, QueryBudget, fingerprint
+
+
+@pytest.fixture
+def metrics_db(make_ext):
+    db = make_ext('metrics', INSTRUMENT=True)
+
+    class Note(db.Model):
+        message = peeweext.TextField()
+
+    Note.create_table()
+    metrics.registry.reset()
+    yield db, Note
+    metrics.registry.reset()
+
+
+def test_fingerprint():
+    assert fingerprint('SELECT * FROM "t1" WHERE "id" IN (?, ?, ?)') == \
+        fingerprint('SELECT  * FROM "t1"\nWHERE "id" IN (?)') == 'SELECT * FROM "t1" WHERE "id" IN (...)'
+    assert fingerprint("SELECT * FROM t WHERE a = 'x''y' AND b > 10.5 LIMIT 3") == \
+        'SELECT * FROM t WHERE a = ? AND b > ? LIMIT ?'
+    assert fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)') == 'INSERT INTO t (a, b) VALUES (...)'
+
+
+def test_instrument(metrics_db):
+    db, Note = metrics_db
+    token = metrics.set_rpc_method('NoteServicer.Create')
+    try:
+        Note.create(message='m1')
+        Note.create(message='m2')
+    finally:
+        metrics.reset_rpc_method(token)
+    list(Note.select().where(Note.id.in_([1, 2])))
+    list(Note.select().where(Note.id.in_([1])))
+
+    data = db.query_metrics
+    queries = {(entry['model'], entry['method']): entry for entry in data['queries']}
+    created = queries[('Note', 'NoteServicer.Create')]
+    assert created['alias'] == 'metrics'
+    assert created['count'] == 2
+    assert created['rows'] == 2
+    assert created['buckets'][-1] == (float('inf'), 2)
+    assert queries[('Note', None)]['count'] == 2
+
+    statements = {stats['fingerprint']: stats for stats in data['statements']}
+    select = statements['SELECT "t1"."id", "t1"."message" FROM "note" AS "t1" WHERE ("t1"."id" IN (...))']
+    assert select['count'] == 2
+    assert select['max'] <= select['sum']
+
+    text = metrics.exposition('metrics')
+    assert 'peeweext_query_duration_seconds_count{alias="metrics",model="Note",method="NoteServicer.Create"} 2' in text
+    assert 'le="+Inf"' in text
+    assert '\\"t1\\"' in text
+
+
+def test_query_metrics_threads():
+    query_metrics = QueryMetrics(buckets=(0.01, 0.1), max_statements=2)
+
+    def work():
+        for i in range(100):
+            query_metrics.observe('default', 'Note', None, 'SELECT %d' % (i % 3), 0.05, 1)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    data = query_metrics.snapshot()
+    entry, = data['queries']
+    assert entry['count'] == entry['rows'] == 400
+    assert entry['buckets'] == [(0.01, 0), (0.1, 400), (float('inf'), 400)]
+    # 超出 max_statements 的指纹合并统计
+    assert sorted(stats['fingerprint'] for stats in data['statements']) == ['<other>', 'SELECT 0', 'SELECT 1']
+    assert sum(stats['count'] for stats in data['statements']) == 400
+
+    query_metrics.reset()
+    assert query_metrics.snapshot() == dict(queries=[], statements=[])
+
+
+def test_slow_query_log(make_ext, caplog):
+    db = make_ext('slow', SLOW_QUERY=dict(THRESHOLD=0, REDACT=True))
+
+    class Note(db.Model):
+        message = peeweext.TextField()
+
+    Note.create_table()
+    slow_query_log = db.database.slow_query_log
+    caplog.set_level('WARNING', logger='peeweext.slow_query')
+    token = metrics.set_rpc_method('NoteServicer.Get')
+    try:
+        Note.create(message='secret')
+        for _ in range(3):
+            list(Note.select().where(Note.message == 'secret'))
+    finally:
+        metrics.reset_rpc_method(token)
+    slow_query_log.flush()
+    db.close_db()
+
+    slow = [r.getMessage() for r in caplog.records if 'method=NoteServicer.Get' in r.getMessage()]
+    assert len(slow) == 4
+    assert slow[1].startswith('Slow query')
+    assert 'alias=slow method=NoteServicer.Get model=Note' in slow[1]
+    assert "params=['?']" in slow[1]
+    assert 'secret' not in ''.join(slow)
+    # 同一指纹在间隔内只 EXPLAIN 一次，SELECT 的执行计划来自 EXPLAIN QUERY PLAN
+    explains = [r.getMessage() for r in caplog.records if r.getMessage().startswith('EXPLAIN for')]
+    assert len(explains) == 2
+    assert any('SCAN' in message for message in explains)
+
+    assert metrics.SlowQueryLog(redact=lambda params: params[:1]).redact_params([1, 2]) == [1]
+
+
+def test_query_budget(metrics_db):
+    db, Note = metrics_db
+    Note.insert_many([{'message': 'm%d' % i} for i in range(5)]).execute()
+
+    with metrics.track_queries() as stats:
+        for i in range(1, 6):
+            Note.get_by_id(i)
+    assert stats.queries == 5
+    assert stats.time > 0
+    assert list(stats.repeated(3).values()) == [5]
+    assert metrics.get_request_stats() is None
+
+    with pytest.raises(QueryBudgetExceeded, match='possible N\\+1, 5 executions'):
+        with metrics.track_queries(QueryBudget(max_repeats=3, action='raise'), method='NoteServicer.List'):
+            for i in range(1, 6):
+                Note.get_by_id(i)
+    with pytest.warns(QueryBudgetWarning, match='2 queries \\(budget 1\\)'):
+        with metrics.track_queries(QueryBudget(max_queries=1, action='warn')):
+            list(Note.select())
+            list(Note.select())
+    with metrics.track_queries(QueryBudget(max_queries=1, max_repeats=0)) as stats:
+        list(Note.select())
+    assert stats.queries == 1
+
+    with pytest.raises(ValueError):
+        QueryBudget(action='ignore')
+
+
+def test_middleware_query_budget(metrics_db):
+    db, Note = metrics_db
+
+    class App:
+        extensions = {'db': db}
+        config = dict(PEEWEE_QUERY_BUDGET=dict(
+            MAX_QUERIES=2, ACTION='raise', METHODS={'list_notes': dict(MAX_QUERIES=10)}
+        ))
+
+    def list_notes(servicer, request, context):
+        return [Note.get_by_id(i) for i in (1, 2, 3) if Note.select().where(Note.id == i).exists()]
+
+    def get_notes(servicer, request, context):
+        return list_notes(servicer, request, context)
+
+    Note.insert_many([{'message': 'm%d' % i} for i in range(3)]).execute()
+    middleware = PeeweeExtMiddleware(App(), list_notes, list_notes)
+    assert middleware.track_queries
+    assert len(middleware(None, None, None)) == 3
+    with pytest.raises(QueryBudgetExceeded, match='get_notes exceeded query budget: 6 queries'):
+        PeeweeExtMiddleware(App(), get_notes, get_notes)(None, None, None)
+    assert metrics.get_request_stats() is None
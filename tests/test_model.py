@@ -1,13 +1,16 @@
+import sys
 import pytest
 import peewee
 import pendulum
 import datetime
+import threading
 from io import StringIO
 import inspect
 import peeweext
 from peeweext import signal
 from peeweext.binwen import PeeweeExt
 from peeweext.exceptions import ValidationError
+from peeweext.models import validates
 
 
 class App:
@@ -142,6 +145,52 @@ def test_validator(table):
     assert note.message == Note.get_by_id(note.id).message
 
 
+class RangeNote(Note):
+    start = peeweext.IntegerField(default=0)
+    end = peeweext.IntegerField(default=0)
+
+    @validates('start', 'end')
+    def check_range(self):
+        if self.start > self.end:
+            raise ValidationError('start > end')
+
+    async def validate_end(self, value):
+        if value > 100:
+            raise ValidationError('too large')
+
+
+def test_compiled_validator(table):
+    RangeNote.create_table()
+    try:
+        # 继承父类的字段校验
+        assert set(RangeNote._validators) == {'message', 'end'}
+
+        note = RangeNote(message='raise error', start=200, end=101)
+        note._validate()
+        assert set(note._validate_errors) == {'message', 'check_range', 'end'}
+        with pytest.raises(ValidationError):
+            note.save()
+
+        note = RangeNote.create(message='ok', start=1, end=2)
+        # 更新时只校验变更字段
+        RangeNote.update(message='raise error').where(RangeNote.id == note.id).execute()
+        note = RangeNote.get_by_id(note.id)
+        note.end = 0
+        with pytest.raises(ValidationError) as exc:
+            note.save()
+        assert 'check_range' in str(exc.value) and 'message' not in str(exc.value)
+        note.end = 5
+        note.save()
+
+        notes = [RangeNote(message='ok', start=0, end=1), RangeNote(message='raise error', start=3, end=1)]
+        errors = RangeNote.validate_many(notes)
+        assert list(errors) == [1]
+        assert set(errors[1]) == {'message', 'check_range'}
+        assert list(RangeNote.validate_many(notes, fields=['message'])[1]) == ['message']
+    finally:
+        RangeNote.drop_table()
+
+
 def test_instance_delete(table):
     note = Note.create(message='Hello')
     note.delete_instance()
@@ -159,8 +208,8 @@ def test_instance_delete(table):
     signal.pre_delete.connect(pre_delete, sender=Note)
     signal.post_delete.connect(post_delete, sender=Note)
     note2.delete_instance()
-    assert f'post_delete <Model: Note>' in out.getvalue()
-    assert f'pre_delete <Model: Note>' in out.getvalue()
+    assert 'post_delete <Model: Note>' in out.getvalue()
+    assert 'pre_delete <Model: Note>' in out.getvalue()
     out = StringIO()
 
     def post_delete(sender, instance):
@@ -175,6 +224,35 @@ def test_instance_delete(table):
     assert out.getvalue() == ""
 
 
+def test_pre_init(table):
+    out = []
+
+    def pre_init(sender, instance):
+        out.append(instance)
+
+    signal.pre_init.connect(pre_init, sender=Note)
+    note = Note(message='Hello')
+    note.save()
+    assert out == [note]
+    Note.create(message='Hello')
+    assert len(out) == 2
+
+    assert len(list(Note.select())) == 2
+    Note.get_by_id(note.id)
+    assert len(out) == 2
+
+    class LoadSignalNote(Note):
+        class Meta:
+            table_name = 'note'
+            signal_on_load = True
+
+    signal.pre_init.connect(pre_init, sender=LoadSignalNote)
+    assert len(list(LoadSignalNote.select())) == 2
+    assert len(out) == 4
+    signal.pre_init.disconnect(pre_init, sender=Note)
+    signal.pre_init.disconnect(pre_init, sender=LoadSignalNote)
+
+
 def test_datetime():
     Note.create_table()
     dt = datetime.datetime.now(tz=datetime.timezone(datetime.timedelta(hours=8)))
@@ -257,3 +335,317 @@ def test_massassignment(whitelistmodel):
     assert m2.f1 == 20
     assert m2.f3 == 20
     assert m2.f4 == 30
+
+
+def test_bulk_create(table, whitelistmodel):
+    out = []
+
+    def pre_bulk_save(sender, instances, created):
+        out.append(('pre', len(instances), created))
+
+    def post_bulk_save(sender, instances, created):
+        out.append(('post', [n.message for n in instances], created))
+
+    signal.pre_bulk_save.connect(pre_bulk_save, sender=TimeStampedNote)
+    signal.post_bulk_save.connect(post_bulk_save, sender=TimeStampedNote)
+    notes = [TimeStampedNote(message='Hello 4')]
+    assert TimeStampedNote.bulk_create([{'message': 'Hello %s' % i} for i in range(4)] + notes, batch_size=2) == 5
+    assert [n.message for n in TimeStampedNote.select().order_by(TimeStampedNote.id)] == \
+        ['Hello %s' % i for i in range(5)]
+    # 信号按批发送
+    assert out == [
+        ('pre', 2, True), ('post', ['Hello 0', 'Hello 1'], True),
+        ('pre', 2, True), ('post', ['Hello 2', 'Hello 3'], True),
+        ('pre', 1, True), ('post', ['Hello 4'], True),
+    ]
+    # 整个调用(包括传入的实例)使用同一个时间
+    stored = TimeStampedNote.select().order_by(TimeStampedNote.id)
+    assert {(n.created_at, n.updated_at) for n in stored} == {(notes[0].created_at, notes[0].created_at)}
+    assert not notes[0].dirty_fields
+
+    with pytest.raises(ValidationError):
+        TimeStampedNote.bulk_create([{'message': 'ok'}, {'message': 'raise error'}])
+    assert TimeStampedNote.select().count() == 5
+
+    WhiteListNote.bulk_create([dict(f1=10, f2=10, f3=10, f4=10)])
+    m = WhiteListNote.get()
+    assert (m.f1, m.f2, m.f3, m.f4) == (10, 10, 3, 4)
+
+
+def test_bulk_create_generator(table):
+    consumed = []
+    inserted = []
+
+    def rows():
+        for i in range(5):
+            consumed.append(i)
+            yield {'message': 'Hello %s' % i}
+
+    def pre_bulk_save(sender, instances, created):
+        # 插入每一批时生成器只被读到这一批为止
+        inserted.append((len(consumed), TimeStampedNote.select().count()))
+
+    signal.pre_bulk_save.connect(pre_bulk_save, sender=TimeStampedNote)
+    try:
+        assert TimeStampedNote.bulk_create(rows(), batch_size=2) == 5
+    finally:
+        signal.pre_bulk_save.disconnect(pre_bulk_save, sender=TimeStampedNote)
+    assert inserted == [(2, 0), (4, 2), (5, 4)]
+
+    # 原子性以批为单位，出错的批次之前的批次已经写入
+    with pytest.raises(ValidationError) as exc:
+        TimeStampedNote.bulk_create([{'message': 'ok'}, {'message': 'ok'}, {'message': 'raise error'}], batch_size=2)
+    assert '"2"' in str(exc.value)
+    assert TimeStampedNote.select().count() == 7
+
+
+def test_bulk_update(table, whitelistmodel):
+    TimeStampedNote.bulk_create([{'message': 'Hello %s' % i} for i in range(3)])
+    notes = list(TimeStampedNote.select())
+    updated_at = notes[0].updated_at
+    out = []
+
+    def post_bulk_save(sender, instances, created):
+        out.append((len(instances), created))
+
+    signal.post_bulk_save.connect(post_bulk_save, sender=TimeStampedNote)
+    for note in notes:
+        note.message = note.message.upper()
+    assert TimeStampedNote.bulk_update(notes, [TimeStampedNote.message], batch_size=2) == 3
+    assert out == [(3, False)]
+    for note in TimeStampedNote.select():
+        assert note.message.startswith('HELLO')
+        assert note.updated_at > updated_at
+        assert note.updated_at == notes[0].updated_at
+
+    notes[0].message = 'raise error'
+    with pytest.raises(ValidationError):
+        TimeStampedNote.bulk_update(notes, ['message'])
+
+    m = WhiteListNote.create()
+    m.f1 = m.f4 = 40
+    assert WhiteListNote.bulk_update([m], ['f1', 'f4']) == 1
+    m = WhiteListNote.get_by_id(m.id)
+    assert (m.f1, m.f4) == (40, 4)
+    assert WhiteListNote.bulk_update([m], ['f4']) == 0
+
+
+def test_bulk_delete(table):
+    Note.bulk_create([{'message': 'Hello %s' % i} for i in range(5)])
+    notes = list(Note.select().order_by(Note.id))
+    out = []
+
+    def pre_bulk_delete(sender, instances):
+        out.append(('pre', len(instances)))
+
+    def post_bulk_delete(sender, instances):
+        out.append(('post', len(instances)))
+
+    signal.pre_bulk_delete.connect(pre_bulk_delete, sender=Note)
+    signal.post_bulk_delete.connect(post_bulk_delete, sender=Note)
+    assert Note.bulk_delete(notes[:4], batch_size=3) == 4
+    assert out == [('pre', 4), ('post', 4)]
+    assert [n.id for n in Note.select()] == [notes[4].id]
+    assert Note.bulk_delete([]) == 0
+
+
+def test_touch(table):
+    n = TimeStampedNote.create(message='Hello')
+    updated_at = n.updated_at
+
+    n.message = 'Hello world'
+    n.save(touch=False)
+    assert n.updated_at == updated_at
+    assert TimeStampedNote.get_by_id(n.id).updated_at == updated_at
+
+    n.message = 'Hello only'
+    n.save(only=[TimeStampedNote.message])
+    assert n.updated_at > updated_at
+    assert TimeStampedNote.get_by_id(n.id).updated_at == n.updated_at
+
+    updated_at = pendulum.datetime(2019, 3, 24)
+    TimeStampedNote.update(updated_at=updated_at).where(TimeStampedNote.id == n.id).execute()
+    assert TimeStampedNote.get_by_id(n.id).updated_at == updated_at
+    TimeStampedNote.update(message='Hello', updated_at=TimeStampedNote.updated_at).execute()
+    assert TimeStampedNote.get_by_id(n.id).updated_at == updated_at
+
+    assert TimeStampedNote.bulk_update([n], ['message'], touch=False) == 1
+    assert TimeStampedNote.get_by_id(n.id).updated_at == updated_at
+
+
+class CompareNote(db.TimeStampedModel):
+    message = peeweext.TextField()
+    content = peeweext.JSONTextField(default={}, track_mutations=True)
+
+    class Meta:
+        compare_dirty = True
+
+
+def test_save_dirty_only(table, monkeypatch):
+    sqls = []
+    execute_sql = db.database.execute_sql
+
+    def record(sql, *args, **kwargs):
+        sqls.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    monkeypatch.setattr(db.database, 'execute_sql', record)
+
+    n = TimeStampedNote.create(message='Hello')
+    n = TimeStampedNote.get_by_id(n.id)
+    del sqls[:]
+    assert n.save() is False
+    assert sqls == []
+
+    n.published_at = pendulum.now()
+    n.save()
+    assert len(sqls) == 1
+    assert '"message"' not in sqls[0] and '"updated_at"' in sqls[0]
+
+    del sqls[:]
+    assert n.update_with(message='Hello') is False
+    assert sqls == []
+
+    CompareNote.create_table()
+    try:
+        c = CompareNote.get_by_id(CompareNote.create(message='Hello', content={'a': 1}).id)
+        del sqls[:]
+        c.message = 'Hello'
+        c.content = {'a': 1}
+        assert c.save() is False
+        assert sqls == []
+
+        c.content['b'] = 2
+        c.save()
+        assert len(sqls) == 1 and '"content"' in sqls[0] and '"message"' not in sqls[0]
+        assert CompareNote.get_by_id(c.id).content == {'a': 1, 'b': 2}
+        del sqls[:]
+        assert c.save() is False
+        assert sqls == []
+    finally:
+        CompareNote.drop_table()
+
+    # 未跟踪原地修改的 JSON 字段只有赋值才写入
+    n = Note.get_by_id(Note.create(message='Hello', content={'a': [1]}).id)
+    assert n._json_loaded is None
+    del sqls[:]
+    n.update_with(message='World')
+    assert sqls == ['UPDATE "note" SET "message" = ? WHERE ("note"."id" = ?)']
+    del sqls[:]
+    assert n.save() is False
+    assert sqls == []
+    n.content['a'].append(2)
+    assert n.save() is False
+    n.content = n.content
+    n.save()
+    assert sqls == ['UPDATE "note" SET "content" = ? WHERE ("note"."id" = ?)']
+    del sqls[:]
+    assert n.save() is False
+    assert sqls == []
+    n.remark = None
+    n.save()
+    n.remark = {'b': 1}
+    n.save()
+    assert Note.get_by_id(n.id).content == {'a': [1, 2]} and Note.get_by_id(n.id).remark == {'b': 1}
+
+
+def test_concurrent_touch(tmp_path):
+    class App:
+        config = dict(DATABASES={"default": {"DB_URL": "sqlite:///%s" % (tmp_path / "touch.db")}})
+
+    ext = PeeweeExt()
+    ext.init_app(App())
+
+    class ConcurrentNote(ext.TimeStampedModel):
+        message = peeweext.TextField()
+
+    ConcurrentNote.create_table()
+    ids = [ConcurrentNote.create(message='Hello').id for _ in range(4)]
+    ext.close_db()
+    errors = []
+
+    def save_worker(pk):
+        try:
+            note = ConcurrentNote.get_by_id(pk)
+            for i in range(30):
+                previous = note.updated_at
+                note.message = 'save %s' % i
+                note.save()
+                assert note.updated_at > previous
+                assert ConcurrentNote.get_by_id(pk).updated_at == note.updated_at
+        except Exception as e:
+            errors.append(e)
+        finally:
+            ext.close_db()
+
+    def update_worker(pk):
+        try:
+            for i in range(30):
+                previous = ConcurrentNote.get_by_id(pk).updated_at
+                ConcurrentNote.update(message='update %s' % i).where(ConcurrentNote.id == pk).execute()
+                assert ConcurrentNote.get_by_id(pk).updated_at > previous
+        except Exception as e:
+            errors.append(e)
+        finally:
+            ext.close_db()
+
+    threads = [threading.Thread(target=save_worker, args=(pk,)) for pk in ids[:2]]
+    threads += [threading.Thread(target=update_worker, args=(pk,)) for pk in ids[2:]]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+
+    # 一个线程的 save 停在 pre_save 时，另一个线程执行 update
+    in_pre_save = threading.Event()
+    update_done = threading.Event()
+
+    def pre_save(sender, instance, created):
+        in_pre_save.set()
+        update_done.wait(5)
+
+    note = ConcurrentNote.get_by_id(ids[0])
+    signal.pre_save.connect(pre_save, sender=ConcurrentNote)
+    thread = threading.Thread(target=save_worker, args=(ids[0],))
+    try:
+        thread.start()
+        assert in_pre_save.wait(5)
+        previous = ConcurrentNote.get_by_id(ids[1]).updated_at
+        ConcurrentNote.update(message='update').where(ConcurrentNote.id == ids[1]).execute()
+        assert ConcurrentNote.get_by_id(ids[1]).updated_at > previous
+    finally:
+        update_done.set()
+        thread.join()
+        signal.pre_save.disconnect(pre_save, sender=ConcurrentNote)
+        ext.close_db()
+    assert errors == []
+    assert ConcurrentNote.get_by_id(ids[0]).updated_at > note.updated_at
+
+
+def test_compact(table):
+    published_at = pendulum.datetime(2019, 3, 24, tz='Asia/Shanghai')
+    n = Note.create(message='Hello', published_at=published_at, content={'a': 1})
+
+    row = Note.select().where(Note.id == n.id).compact().get()
+    assert type(row).__name__ == 'NoteRow'
+    assert row.id == n.id and row.get_id() == n.id
+    assert row.message == 'Hello'
+    assert row.published_at == published_at
+    assert row.content == {'a': 1}
+    assert row.remark is None
+    assert row._asdict()['message'] == 'Hello'
+    assert not hasattr(row, '__dict__')
+    with pytest.raises(AttributeError):
+        row.message = 'changed'
+
+    rows = list(Note.select(Note.message, peewee.fn.LENGTH(Note.message).coerce(False).alias('size')).compact())
+    assert rows[0].message == 'Hello' and rows[0].size == 5
+    assert rows[0].id is None
+    with pytest.raises(AttributeError):
+        rows[0].missing
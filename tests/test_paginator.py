@@ -3,7 +3,10 @@ from datetime import datetime
 import pytest
 import peeweext
 from peeweext.binwen import PeeweeExt
-from peeweext.paginator import Paginator, InvalidPage, PageNotAnInteger, EmptyPage, Page
+from peeweext.paginator import (
+    Paginator, InvalidPage, PageNotAnInteger, EmptyPage, Page, KeysetPaginator, InvalidCursor,
+    CachedCount, EstimatedCount, HasMoreCount, ExactCount
+)
 
 
 def check_paginator(params, output):
@@ -306,3 +309,140 @@ def test_page_getitem(table):
         "Article 2",
     ]
     assert isinstance(p.object_list, list)
+
+
+def test_cached_count(table):
+    strategy = CachedCount(ttl=60)
+    assert Paginator(Article.select(), 5, count_strategy=strategy).count == 9
+    Article.create(headline='Article 10', pub_date=datetime(2005, 7, 29))
+    paginator = Paginator(Article.select(), 5, count_strategy=strategy)
+    assert paginator.count == 9
+    assert paginator.num_pages == 2
+    assert Paginator(Article.select().where(Article.id > 5), 5, count_strategy=strategy).count == 5
+
+    strategy.clear()
+    assert Paginator(Article.select(), 5, count_strategy=strategy).count == 10
+    assert Paginator(Article.select(), 5, count_strategy=CachedCount(ttl=0)).count == 10
+    assert Paginator([1, 2, 3], 2, count_strategy=strategy).count == 3
+
+
+def test_estimated_count(table):
+    assert Paginator(Article.select(), 5, count_strategy=EstimatedCount(threshold=0)).count == 9
+
+    Article._meta.database.execute_sql('ANALYZE')
+    Article.create(headline='Article 10', pub_date=datetime(2005, 7, 29))
+    assert Paginator(Article.select(), 5, count_strategy=EstimatedCount(threshold=0)).count == 9
+    assert Paginator(Article.select(), 5, count_strategy=EstimatedCount()).count == 10
+    query = Article.select().where(Article.id > 5)
+    assert Paginator(query, 5, count_strategy=EstimatedCount(threshold=0)).count == 5
+
+
+def test_has_more_count(table):
+    paginator = Paginator(Article.select().order_by(Article.id), 4, count_strategy=HasMoreCount())
+    assert paginator.num_pages is None
+
+    p = paginator.page(1)
+    assert [a.id for a in p] == [1, 2, 3, 4]
+    assert p.has_next() is True
+    assert p.next_page_number() == 2
+    assert p.end_index() == 4
+
+    p = paginator.page(3)
+    assert [a.id for a in p] == [9]
+    assert p.has_next() is False
+    assert p.has_previous() is True
+    assert "<Page 3 of 3>" == str(p)
+    assert p.start_index() == 9
+    assert p.end_index() == 9
+    with pytest.raises(EmptyPage):
+        p.next_page_number()
+
+    p = Paginator(Article.select().order_by(Article.id), 4, orphans=1, count_strategy=HasMoreCount()).page(2)
+    assert [a.id for a in p] == [5, 6, 7, 8, 9]
+    assert p.has_next() is False
+    p = Paginator('abcdefghijk', 5, count_strategy=HasMoreCount()).page('x')
+    assert ''.join(p) == 'abcde'
+    assert p.has_next() is True
+
+
+@pytest.mark.parametrize('number', [0, -1, 4, 100, 'x', None])
+@pytest.mark.parametrize('orphans', [0, 1])
+def test_out_of_range_contract(table, number, orphans):
+    # 不同计数策略对超出范围的页码行为一致
+    pages = []
+    for strategy in (ExactCount(), HasMoreCount(), CachedCount()):
+        paginator = Paginator(Article.select().order_by(Article.id), 4, orphans=orphans, count_strategy=strategy)
+        page = paginator.page(number)
+        pages.append((page.page_number, [a.id for a in page], page.has_next()))
+    assert pages[0] == pages[1] == pages[2]
+
+    for strategy in (ExactCount(), HasMoreCount()):
+        paginator = Paginator(Article.select().order_by(Article.id), 4, orphans=orphans, count_strategy=strategy,
+                              strict=True)
+        if number in ('x', None):
+            assert paginator.page(number).page_number == 1
+        else:
+            with pytest.raises(EmptyPage):
+                paginator.page(number)
+
+
+@pytest.mark.parametrize('allow_empty_first_page', [True, False])
+def test_empty_contract(table, allow_empty_first_page):
+    empty = Article.select().where(Article.id > 100)
+    pages = []
+    for strategy in (ExactCount(), HasMoreCount()):
+        page = Paginator(empty, 4, allow_empty_first_page=allow_empty_first_page, count_strategy=strategy).page(1)
+        pages.append((page.page_number, list(page)))
+    assert pages[0] == pages[1]
+
+
+def test_keyset_paginator(table):
+    paginator = KeysetPaginator(Article.select(), [Article.id], 4)
+    p1 = paginator.page()
+    assert [str(s) for s in p1] == ["Article 1", "Article 2", "Article 3", "Article 4"]
+    assert p1.has_next() is True
+    assert p1.has_previous() is False
+    with pytest.raises(EmptyPage):
+        p1.previous_cursor()
+
+    p2 = paginator.page(p1.next_cursor())
+    assert [a.id for a in p2] == [5, 6, 7, 8]
+    assert p2.has_other_pages() is True
+
+    p3 = paginator.page(p2.next_cursor())
+    assert [a.id for a in p3.object_list] == [9]
+    assert p3.has_next() is False
+    with pytest.raises(EmptyPage):
+        p3.next_cursor()
+
+    p2 = paginator.page(p3.previous_cursor())
+    assert [a.id for a in p2] == [5, 6, 7, 8]
+    assert p2.has_next() is True
+    assert p2.has_previous() is True
+    p1 = paginator.page(p2.previous_cursor())
+    assert [a.id for a in p1] == [1, 2, 3, 4]
+    assert p1.has_previous() is False
+
+    with pytest.raises(InvalidCursor):
+        paginator.page('not a cursor')
+
+
+def test_keyset_paginator_multiple_columns(table):
+    Article.update(pub_date=datetime(2005, 7, 30)).where(Article.id > 6).execute()
+    query = Article.select().where(Article.id > 1).dicts()
+    paginator = KeysetPaginator(query, [Article.pub_date.desc(), Article.id.desc()], 3)
+    pages = []
+    page = paginator.page()
+    while True:
+        pages.append([a['id'] for a in page])
+        if not page.has_next():
+            break
+        page = paginator.page(page.next_cursor())
+    assert pages == [[9, 8, 7], [6, 5, 4], [3, 2]]
+
+    paginator = KeysetPaginator(Article.select(), [Article.pub_date.desc(), Article.id], 4)
+    p1 = paginator.page()
+    assert [a.id for a in p1] == [7, 8, 9, 1]
+    p2 = paginator.page(p1.next_cursor())
+    assert [a.id for a in p2] == [2, 3, 4, 5]
+    assert [a.id for a in paginator.page(p2.previous_cursor())] == [7, 8, 9, 1]
@@ -0,0 +1,114 @@
+import sys
+import subprocess
+
+import pendulum
+import pytest
+import peeweext
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory, struct_pb2, timestamp_pb2
+from peeweext.binwen import PeeweeExt
+from peeweext.protobuf import get_mapper
+
+FDP = descriptor_pb2.FieldDescriptorProto
+
+
+def make_messages():
+    pool = descriptor_pool.DescriptorPool()
+    pool.AddSerializedFile(timestamp_pb2.DESCRIPTOR.serialized_pb)
+    pool.AddSerializedFile(struct_pb2.DESCRIPTOR.serialized_pb)
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name='note.proto', package='test', syntax='proto3',
+        dependency=['google/protobuf/timestamp.proto', 'google/protobuf/struct.proto'],
+    )
+    note = file_proto.message_type.add(name='NoteMessage')
+    for number, (name, type_, type_name) in enumerate([
+        ('id', FDP.TYPE_INT64, None),
+        ('message', FDP.TYPE_STRING, None),
+        ('published_at', FDP.TYPE_MESSAGE, '.google.protobuf.Timestamp'),
+        ('content', FDP.TYPE_MESSAGE, '.google.protobuf.Struct'),
+        ('remark', FDP.TYPE_STRING, None),
+        ('author_id', FDP.TYPE_INT64, None),
+        ('title', FDP.TYPE_STRING, None),
+    ], 1):
+        field = note.field.add(name=name, number=number, type=type_, label=FDP.LABEL_OPTIONAL)
+        if type_name:
+            field.type_name = type_name
+    notes = file_proto.message_type.add(name='NoteList')
+    notes.field.add(name='items', number=1, type=FDP.TYPE_MESSAGE, label=FDP.LABEL_REPEATED,
+                    type_name='.test.NoteMessage')
+    pool.Add(file_proto)
+    return (message_factory.GetMessageClass(pool.FindMessageTypeByName('test.NoteMessage')),
+            message_factory.GetMessageClass(pool.FindMessageTypeByName('test.NoteList')))
+
+
+NoteMessage, NoteList = make_messages()
+
+
+@pytest.fixture
+def models(tmp_path):
+    class App:
+        config = dict(DATABASES={"default": {"DB_URL": "sqlite:///%s" % (tmp_path / "pb.db")}})
+
+    db = PeeweeExt()
+    db.init_app(App())
+
+    class Author(db.Model):
+        name = peeweext.TextField()
+
+    class Note(db.Model):
+        author = peeweext.ForeignKeyField(Author)
+        message = peeweext.TextField()
+        published_at = peeweext.DatetimeTZField()
+        content = peeweext.JSONTextField(default={})
+        remark = peeweext.JSONTextField(null=True)
+
+    db.database.create_tables([Author, Note])
+    author = Author.create(name='a')
+    published_at = pendulum.datetime(2019, 3, 24, 9, 49, 14)
+    for i in range(5):
+        Note.create(author=author, message='n%s' % i, published_at=published_at, content={'i': i},
+                    remark=None if i else ['x'])
+    yield Author, Note
+    db.close_db()
+
+
+def test_mapper(models):
+    Author, Note = models
+    mapper = get_mapper(Note, NoteMessage)
+    assert get_mapper(Note, NoteMessage) is mapper
+
+    note = Note.get_by_id(1)
+    message = mapper.to_message(note)
+    assert message.id == 1 and message.message == 'n0' and message.author_id == 1
+    assert message.published_at.ToJsonString() == '2019-03-24T09:49:14Z'
+    assert message.content['i'] == 0
+    assert message.remark == '["x"]'
+    assert mapper.to_message(Note.select().where(Note.id == 1).compact().get()) == message
+
+    notes = NoteList()
+    assert mapper.fill(notes.items, Note.select().order_by(Note.id)) == 5
+    assert notes.items[0] == message
+    assert [item.message for item in notes.items] == ['n%s' % i for i in range(5)]
+    assert not notes.items[1].remark
+
+    chunks = list(mapper.iter_messages(Note.select(Note.id, Note.message), chunk_size=2))
+    assert [[m.message for m in chunk] for chunk in chunks] == [['n0', 'n1'], ['n2', 'n3'], ['n4']]
+    assert not chunks[0][0].HasField('published_at')
+
+    titled = get_mapper(Note, NoteMessage, fields={'title': 'message'})
+    assert titled.to_message(note).title == 'n0'
+    with pytest.raises(ValueError):
+        get_mapper(Note, NoteMessage, fields={'title': 'missing'})
+
+
+def test_optional_dependency():
+    # 未安装 protobuf 时基础包仍可导入，使用本模块时给出安装提示
+    code = (
+        "import sys; sys.modules['google.protobuf'] = None\n"
+        "import peeweext, peeweext.models, peeweext.binwen\n"
+        "try:\n"
+        "    import peeweext.protobuf\n"
+        "except ImportError as e:\n"
+        "    print(e)\n"
+    )
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    assert 'binwen-peewee[protobuf]' in output
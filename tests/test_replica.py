@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+import peeweext
+from peeweext import aio, replica
+from peeweext.replica import ReplicaRouter
+
+
+@pytest.fixture
+def make_db(make_ext, tmp_path):
+    def make(**options):
+        db = make_ext(
+            REPLICAS=[
+                "sqlite:///%s" % (tmp_path / "replica1.db"),
+                "sqlite:///%s" % (tmp_path / "replica2.db"),
+            ],
+            **options
+        )
+
+        class Note(db.Model):
+            message = peeweext.TextField()
+
+        Note.create_table()
+        for i, replica_db in enumerate(db.database.replica_router.replicas, 1):
+            with replica_db.bind_ctx([Note]):
+                Note.create_table()
+                Note.create(message='replica%s' % i)
+        db.close_db()
+        return db, Note
+
+    return make
+
+
+def test_replica_routing(make_db):
+    db, Note = make_db()
+
+    assert Note.select().get().message == 'replica1'
+    assert Note.select().get().message == 'replica2'
+    assert Note.get_by_id(1).message == 'replica1'
+
+    with db.database.atomic():
+        assert Note.select().count() == 0
+    db.close_db()
+
+    Note.create(message='primary')
+    assert Note.get_by_id(1).message == 'primary'
+    assert Note.select().count() == 1
+    db.close_db()
+
+    assert Note.select().get().message == 'replica2'
+    db.close_db()
+    assert all(replica.is_closed() for replica in db.database.replica_router.replicas)
+
+
+def test_aio_read_your_writes(make_db):
+    db, Note = make_db(CONN_OPTIONS=dict(check_same_thread=False))
+
+    async def request():
+        # 每个请求有独立的标记，工作线程中的写入对之后的读取生效
+        token = replica.start_pins()
+        try:
+            before = (await aio.get(Note.select())).message
+            await Note.aio_create(message='primary')
+            return before, (await aio.get(Note.select())).message
+        finally:
+            replica.end_pins(token)
+
+    async def main():
+        assert await request() == ('replica1', 'primary')
+        assert (await aio.get(Note.select())).message == 'replica2'
+
+    asyncio.run(main())
+    assert all(r.is_closed() for r in db.database.replica_router.replicas)
+    db.close_db()
+
+
+def test_read_your_writes_window(make_db):
+    db, Note = make_db(READ_YOUR_WRITES_WINDOW=0)
+    Note.create(message='primary')
+    assert Note.select().get().message == 'replica1'
+    db.close_db()
+
+
+def test_unscoped_pin_expires(make_db, monkeypatch):
+    db, Note = make_db()
+    Note.create(message='primary')
+    assert Note.select().get().message == 'primary'
+    # 请求之外的标记在默认时间窗口后失效
+    monkeypatch.setattr(replica, 'UNSCOPED_READ_YOUR_WRITES', 0)
+    assert Note.select().get().message == 'replica1'
+    assert db.database.replica_router not in replica._pins.get()
+
+    # Celery 任务结束时清除
+    monkeypatch.undo()
+    Note.create(message='primary')
+    db.close_db()
+    assert Note.select().get().message == 'replica2'
+    db.close_db()
+
+
+def test_least_busy(make_db):
+    db, Note = make_db(REPLICA_STRATEGY='least_busy')
+    router = db.database.replica_router
+    router._in_flight[0] = 1
+    assert Note.select().get().message == 'replica2'
+    router._in_flight[0] = 0
+    assert Note.select().get().message == 'replica1'
+    db.close_db()
+
+    with pytest.raises(ValueError):
+        ReplicaRouter([], strategy='random')
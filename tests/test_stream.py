@@ -0,0 +1,87 @@
+import os
+import asyncio
+
+import pytest
+import peeweext
+
+
+@pytest.fixture
+def Note(make_ext):
+    db = make_ext(CONN_OPTIONS=dict(check_same_thread=False))
+
+    class Note(db.Model):
+        message = peeweext.TextField()
+
+    Note.create_table()
+    Note.insert_many([('n%s' % i,) for i in range(25)], fields=[Note.message]).execute()
+    db.close_db()
+    return Note
+
+
+def test_iter_chunks(Note):
+    database = Note._meta.database
+    chunks = list(Note.iter_chunks(chunk_size=10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert [note.message for chunk in chunks for note in chunk] == ['n%s' % i for i in range(25)]
+    assert database.is_closed()
+
+    query = Note.select(Note.id, Note.message).where(Note.id > 20)
+    assert list(Note.iter_chunks(query.tuples(), chunk_size=2)) == [
+        [(21, 'n20'), (22, 'n21')], [(23, 'n22'), (24, 'n23')], [(25, 'n24')]
+    ]
+    chunks = Note.iter_chunks(query.dicts(), chunk_size=10)
+    assert [row['id'] for chunk in chunks for row in chunk] == [21, 22, 23, 24, 25]
+    assert list(Note.iter_chunks(Note.select().where(Note.id > 100))) == []
+
+    with pytest.raises(ValueError):
+        list(Note.iter_chunks(Note.select(Note.message)))
+
+    # 提前停止时释放连接
+    chunks = Note.iter_chunks(chunk_size=10, server_side=True)
+    assert [note.message for note in next(chunks)][:2] == ['n0', 'n1']
+    assert not database.is_closed()
+    chunks.close()
+    assert database.is_closed()
+
+    chunks = Note.iter_chunks(chunk_size=10, server_side=True)
+    assert sum(len(chunk) for chunk in chunks) == 25
+
+
+def test_aio_iter_chunks(Note):
+    async def main():
+        return [chunk async for chunk in Note.aio_iter_chunks(chunk_size=10)]
+
+    assert [len(chunk) for chunk in asyncio.run(main())] == [10, 10, 5]
+
+
+@pytest.mark.mysql
+def test_mysql_server_side_nested_query(make_ext):
+    url = os.environ.get('MYSQL_URL')
+    if not url:
+        pytest.skip('MYSQL_URL is not set')
+    pytest.importorskip('pymysql')
+    db = make_ext(DB_URL=url)
+
+    class StreamAuthor(db.Model):
+        name = peeweext.TextField()
+
+    class StreamNote(db.Model):
+        author = peeweext.ForeignKeyField(StreamAuthor)
+        message = peeweext.TextField()
+
+        class Meta:
+            batch_load = True
+
+    db.database.create_tables([StreamAuthor, StreamNote])
+    try:
+        author = StreamAuthor.create(name='a')
+        StreamNote.insert_many([(author.id, 'n%s' % i) for i in range(5)],
+                               fields=[StreamNote.author, StreamNote.message]).execute()
+        # 服务端游标使用独立连接，遍历期间可以在当前连接上查询
+        messages = []
+        for chunk in StreamNote.iter_chunks(chunk_size=2, server_side=True):
+            messages.extend('%s:%s' % (note.author.name, note.message) for note in chunk)
+            assert StreamAuthor.select().count() == 1
+        assert messages == ['a:n%s' % i for i in range(5)]
+    finally:
+        db.database.drop_tables([StreamNote, StreamAuthor])